@@ -0,0 +1,18 @@
+"""Shared test setup: import web_app/app.py with a throwaway working directory.
+
+app.py creates uploads/ and the SQLite state database relative to the
+working directory and needs GEMINI_API_KEY at import time, so both are set
+up here before any test module imports it. No request reaches the real API:
+tests that need the Gemini client replace app.client with a fake.
+"""
+import os
+import sys
+import tempfile
+
+WEB_APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'web_app')
+TEST_WORK_DIR = tempfile.mkdtemp(prefix='rag-app-tests-')
+
+os.environ.setdefault('GEMINI_API_KEY', 'test-api-key')
+os.environ['STATE_DATABASE'] = os.path.join(TEST_WORK_DIR, 'store_state.db')
+os.chdir(TEST_WORK_DIR)
+sys.path.insert(0, WEB_APP_DIR)
@@ -0,0 +1,101 @@
+"""Extracted text and Files API uploads cached by content hash"""
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+import app
+from app import TTLCache, cached_document_text, cached_files_api_upload, forget_files_api_upload
+
+XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+DOCX = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+
+@pytest.fixture
+def extractions(monkeypatch):
+    calls = []
+
+    def extract_document_text(file_path, mime_type, max_chars):
+        calls.append((file_path, mime_type, max_chars))
+        return 'text' if 'empty' not in file_path else ''
+
+    monkeypatch.setattr(app, 'extraction_cache', TTLCache(10, 60))
+    monkeypatch.setattr(app, 'extract_document_text', extract_document_text)
+    return calls
+
+
+@pytest.fixture
+def files_api(monkeypatch):
+    """Fake Files API; uploads expire after `files.lifetime`"""
+    fake = SimpleNamespace(uploaded=[], deleted=[], lifetime=timedelta(hours=48))
+
+    def upload(file, config):
+        uploaded = SimpleNamespace(name=f'files/{len(fake.uploaded)}', mime_type=config['mime_type'],
+                                   expiration_time=datetime.now(timezone.utc) + fake.lifetime)
+        fake.uploaded.append(uploaded)
+        return uploaded
+
+    def delete(name):
+        fake.deleted.append(name)
+
+    monkeypatch.setattr(app, 'client', SimpleNamespace(files=SimpleNamespace(upload=upload, delete=delete)))
+    cache = TTLCache(10, 3600, on_evict=app._delete_cached_api_file)
+    monkeypatch.setattr(app, 'file_handle_cache', cache)
+    fake.cache = cache
+    return fake
+
+
+def test_text_is_cached_per_hash_type_and_budget(extractions):
+    assert cached_document_text('/tmp/a.xlsx', XLSX, 'hash-a', 1000) == 'text'
+    assert cached_document_text('/tmp/renamed.xlsx', XLSX, 'hash-a', 1000) == 'text'
+    assert len(extractions) == 1
+
+    cached_document_text('/tmp/a.xlsx', XLSX, 'hash-a', 2000)
+    cached_document_text('/tmp/a.docx', DOCX, 'hash-a', 1000)
+    cached_document_text('/tmp/b.xlsx', XLSX, 'hash-b', 1000)
+    assert len(extractions) == 4
+
+
+def test_text_without_hash_or_content_is_not_cached(extractions):
+    cached_document_text('/tmp/a.xlsx', XLSX, None, 1000)
+    cached_document_text('/tmp/a.xlsx', XLSX, None, 1000)
+    cached_document_text('/tmp/empty.xlsx', XLSX, 'hash-empty', 1000)
+    cached_document_text('/tmp/empty.xlsx', XLSX, 'hash-empty', 1000)
+
+    assert len(extractions) == 4
+
+
+def test_same_bytes_reuse_one_upload(files_api):
+    first = cached_files_api_upload('/tmp/a.pdf', 'a.pdf', 'application/pdf', 'hash-a')
+    again = cached_files_api_upload('/tmp/copy.pdf', 'copy.pdf', 'application/pdf', 'hash-a')
+    other = cached_files_api_upload('/tmp/b.pdf', 'b.pdf', 'application/pdf', 'hash-b')
+
+    assert again is first
+    assert other is not first
+    assert len(files_api.uploaded) == 2
+
+
+def test_upload_expiring_soon_is_cached_until_just_before_expiry(files_api, monkeypatch):
+    files_api.lifetime = timedelta(minutes=10)
+    cached_files_api_upload('/tmp/a.pdf', 'a.pdf', 'application/pdf', 'hash-a')
+
+    now = time.time()
+    monkeypatch.setattr(app.time, 'time', lambda: now + 301)
+    cached_files_api_upload('/tmp/a.pdf', 'a.pdf', 'application/pdf', 'hash-a')
+
+    assert len(files_api.uploaded) == 2
+
+
+def test_forgotten_upload_is_deleted(files_api):
+    uploaded = cached_files_api_upload('/tmp/a.pdf', 'a.pdf', 'application/pdf', 'hash-a')
+
+    forget_files_api_upload('hash-a', 'application/pdf')
+
+    for _ in range(200):
+        if files_api.deleted:
+            break
+        time.sleep(0.01)
+    assert files_api.deleted == [uploaded.name]
+    cached_files_api_upload('/tmp/a.pdf', 'a.pdf', 'application/pdf', 'hash-a')
+    assert len(files_api.uploaded) == 2
@@ -0,0 +1,88 @@
+"""AppState: concurrent mutations and copy-on-write snapshots"""
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import app
+from app import AppState
+
+
+@pytest.fixture
+def state(monkeypatch):
+    # save_state() persists the global app state; these tests use their own instance
+    monkeypatch.setattr(app, 'save_state', lambda: None)
+    fresh = AppState()
+    fresh.restore(SimpleNamespace(name='fileSearchStores/state-test'), [])
+    yield fresh
+    for file_info in fresh.files():
+        app.delete_persisted_file(file_info)
+
+
+def _run_threads(target, count=8):
+    threads = [threading.Thread(target=target, args=(worker,)) for worker in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_concurrent_adds_are_not_lost(state):
+    def add(worker):
+        for i in range(50):
+            state.add_file({'filename': f'{worker}-{i}.txt', 'document_id': f'docs/{worker}-{i}',
+                            'custom_metadata': {f'key{worker}': i}})
+
+    _run_threads(add)
+
+    assert state.file_count() == 400
+    assert len({f['document_id'] for f in state.files()}) == 400
+    assert len(state.metadata_keys()) == 8
+
+
+def test_concurrent_metadata_updates_keep_one_entry_per_document(state):
+    state.add_file({'filename': 'shared.txt', 'document_id': 'docs/shared', 'custom_metadata': {}})
+
+    def update(worker):
+        for i in range(50):
+            state.update_metadata('docs/shared', {'editor': f'{worker}-{i}'})
+
+    _run_threads(update)
+
+    assert state.file_count() == 1
+    assert state.local_metadata('docs/shared')['editor'].endswith('-49')
+
+
+def test_snapshots_are_not_affected_by_later_edits(state):
+    state.add_file({'filename': 'a.txt', 'document_id': 'docs/a', 'custom_metadata': {'tipo': 'nota'}})
+    snapshot = state.files()
+
+    state.update_metadata('docs/a', {'tipo': 'acta'})
+    state.add_file({'filename': 'b.txt', 'document_id': 'docs/b', 'custom_metadata': {}})
+
+    assert [f['filename'] for f in snapshot] == ['a.txt']
+    assert snapshot[0]['custom_metadata'] == {'tipo': 'nota'}
+
+
+def test_ensure_store_creates_only_once(state):
+    state.restore(None, [])
+    created = []
+
+    def create():
+        time.sleep(0.01)
+        created.append(1)
+        return SimpleNamespace(name=f'fileSearchStores/created-{len(created)}')
+
+    names = []
+    _run_threads(lambda worker: names.append(state.ensure_store(create).name))
+
+    assert created == [1]
+    assert set(names) == {'fileSearchStores/created-1'}
+
+
+def test_clear_store_only_matches_the_active_store(state):
+    assert state.clear_store('fileSearchStores/other') is False
+    assert state.store_name == 'fileSearchStores/state-test'
+    assert state.clear_store('fileSearchStores/state-test') is True
+    assert state.store_name is None
@@ -0,0 +1,65 @@
+"""fetch_documents_for_stores: concurrent per-store listing with a per-store timeout"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import app
+from app import fetch_documents_for_stores
+
+
+@pytest.fixture
+def listing(monkeypatch):
+    """get_store_documents taking `delays[store]` seconds; stores in `fail` raise"""
+    fake = {'delays': {}, 'fail': set(), 'release': threading.Event()}
+
+    def get_store_documents(store_name, refresh=False):
+        if store_name in fake['fail']:
+            raise RuntimeError('permission denied')
+        fake['release'].wait(fake['delays'].get(store_name, 0))
+        return [{'name': f'{store_name}/documents/1'}]
+
+    monkeypatch.setattr(app, 'get_store_documents', get_store_documents)
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(app, 'catalog_executor', executor)
+    yield fake
+    fake['release'].set()
+    executor.shutdown(wait=True)
+
+
+def test_results_keep_the_store_order(listing):
+    results = fetch_documents_for_stores(['stores/b', 'stores/a'])
+
+    assert [name for name, _, _ in results] == ['stores/b', 'stores/a']
+    assert all(error is None for _, _, error in results)
+
+
+def test_failing_store_is_reported_not_fatal(listing):
+    listing['fail'].add('stores/broken')
+
+    results = fetch_documents_for_stores(['stores/ok', 'stores/broken'])
+
+    assert results[0][1] == [{'name': 'stores/ok/documents/1'}]
+    assert results[1] == ('stores/broken', None, 'permission denied')
+
+
+def test_queued_stores_are_timed_from_their_start(listing, monkeypatch):
+    monkeypatch.setattr(app, 'CATALOG_FETCH_TIMEOUT', 0.3)
+    listing['delays'] = {'stores/a': 0.15, 'stores/b': 0.15, 'stores/c': 0.15}
+
+    results = fetch_documents_for_stores(['stores/a', 'stores/b', 'stores/c'])
+
+    # 0.45 s in total on one worker, but no store takes longer than 0.3 s itself
+    assert all(error is None for _, _, error in results)
+
+
+def test_slow_store_times_out(listing, monkeypatch):
+    monkeypatch.setattr(app, 'CATALOG_FETCH_TIMEOUT', 0.2)
+    listing['delays'] = {'stores/slow': 5}
+
+    started = time.monotonic()
+    results = fetch_documents_for_stores(['stores/slow'])
+
+    assert time.monotonic() - started < 2
+    assert results == [('stores/slow', None, 'Timed out after 0.2s')]
@@ -0,0 +1,43 @@
+"""SessionHistoryStore: bounded per-session chat history"""
+import threading
+
+import pytest
+
+from app import SessionHistoryStore
+
+
+@pytest.mark.parametrize('spill', [False, True])
+def test_concurrent_exchanges_are_not_lost(spill):
+    sessions = SessionHistoryStore(max_sessions=10, max_bytes=10 ** 9, ttl=3600, max_messages=10 ** 6, spill=spill)
+
+    def chat(worker):
+        for turn in range(50):
+            sessions.append_exchange('shared', f'question {worker}/{turn}', 'answer')
+
+    threads = [threading.Thread(target=chat, args=(worker,)) for worker in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sessions.length('shared') == 8 * 50 * 2
+    sessions.clear('shared')
+
+
+def test_history_is_capped_per_session():
+    sessions = SessionHistoryStore(max_sessions=10, max_bytes=10 ** 6, ttl=3600, max_messages=4)
+    for turn in range(5):
+        sessions.append_exchange('s', f'q{turn}', f'a{turn}')
+
+    assert [m['content'] for m in sessions.get('s')] == ['q3', 'a3', 'q4', 'a4']
+
+
+def test_spilled_sessions_come_back():
+    sessions = SessionHistoryStore(max_sessions=1, max_bytes=10 ** 6, ttl=3600, spill=True)
+    sessions.append_exchange('first', 'q1', 'a1')
+    sessions.append_exchange('second', 'q2', 'a2')  # evicts 'first' to the database
+    sessions.append_exchange('first', 'q3', 'a3')
+
+    assert [m['content'] for m in sessions.get('first')] == ['q1', 'a1', 'q3', 'a3']
+    sessions.clear('first')
+    sessions.clear('second')
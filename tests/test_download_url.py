@@ -0,0 +1,188 @@
+"""download_url: Range resume with If-Range, restarts, conditional GETs and redirects"""
+import hashlib
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import app
+from app import URLImportError, download_url
+
+BODY = bytes(range(256)) * 1200  # ~300 KB
+CHANGED_BODY = b'changed' * 40000
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Serves BODY; behaviour per path is driven by the test's `server.plan`"""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        plan = self.server.plan
+        self.server.requests.append((self.path, dict(self.headers)))
+        attempt = len(self.server.requests)
+
+        if self.path in plan.get('redirects', {}):
+            self._send(302, b'', {'Location': plan['redirects'][self.path]})
+            return
+        if plan.get('not_modified') and self.headers.get('If-None-Match') == '"v1"':
+            self._send(304, b'', {'ETag': '"v1"'})
+            return
+
+        body = CHANGED_BODY if attempt > 1 and plan.get('changes') else BODY
+        validators = {'ETag': plan.get('etag', '"v1"'), 'Last-Modified': 'Wed, 01 Jan 2025 00:00:00 GMT'}
+        range_header = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        honour_range = (range_header and plan.get('ranges', True) and not plan.get('changes')
+                        and if_range in (validators['ETag'], validators['Last-Modified']))
+        if honour_range:
+            start = int(range_header.split('=')[1].rstrip('-'))
+            self._send(206, body[start:], dict(validators, **{
+                'Content-Range': f'bytes {start}-{len(body) - 1}/{len(body)}'
+            }))
+            return
+
+        drop_at = plan.get('drop_at') if attempt == 1 else None
+        self._send(200, body, validators, drop_at=drop_at)
+
+    def _send(self, status, body, headers, drop_at=None):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        if drop_at is not None:
+            self.wfile.write(body[:drop_at])
+            self.wfile.flush()
+            self.connection.shutdown(socket.SHUT_RDWR)
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server(monkeypatch):
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    httpd.plan = {}
+    httpd.requests = []
+    httpd.base = f'http://127.0.0.1:{httpd.server_port}'
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+
+    # The test server is on loopback: let redirect hops to it through, check the rest for real
+    validate = app.validate_import_url
+    monkeypatch.setattr(app, 'validate_import_url',
+                        lambda url: '127.0.0.1' if url.startswith(httpd.base) else validate(url))
+    monkeypatch.setattr(app.time, 'sleep', lambda seconds: None)  # no retry backoff
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _download(server, path='/file.txt', **kwargs):
+    buffer, size, headers = download_url(server.base + path, **kwargs)
+    try:
+        data = buffer.read() if buffer is not None else None
+        return data, size, headers, buffer.content_hash() if buffer is not None else None
+    finally:
+        if buffer is not None:
+            buffer.close()
+
+
+def test_plain_download_is_hashed(server):
+    data, size, headers, content_hash = _download(server)
+
+    assert data == BODY and size == len(BODY)
+    assert content_hash == hashlib.sha256(BODY).hexdigest()
+    assert headers['ETag'] == '"v1"'
+
+
+def test_dropped_connection_resumes_with_range_and_if_range(server):
+    server.plan = {'drop_at': 100000}
+
+    data, size, _, content_hash = _download(server)
+
+    assert data == BODY and size == len(BODY)
+    assert content_hash == hashlib.sha256(BODY).hexdigest()
+    # Resumes from the bytes buffered before the drop (whole chunks only)
+    resume_headers = server.requests[1][1]
+    resumed_at = int(resume_headers['Range'].split('=')[1].rstrip('-'))
+    assert 0 < resumed_at <= 100000
+    assert resume_headers['If-Range'] == '"v1"'
+
+
+def test_weak_etag_falls_back_to_last_modified(server):
+    server.plan = {'drop_at': 100000, 'etag': 'W/"weak"'}
+
+    data, _, _, _ = _download(server)
+
+    assert data == BODY
+    assert server.requests[1][1]['If-Range'] == 'Wed, 01 Jan 2025 00:00:00 GMT'
+
+
+def test_ignored_range_restarts_from_scratch(server):
+    server.plan = {'drop_at': 100000, 'ranges': False}
+
+    data, size, _, content_hash = _download(server)
+
+    assert data == BODY and size == len(BODY)
+    assert content_hash == hashlib.sha256(BODY).hexdigest()
+    assert 'Range' in server.requests[1][1]
+
+
+def test_changed_source_restarts_with_the_new_content(server):
+    server.plan = {'drop_at': 100000, 'changes': True}
+
+    data, size, _, content_hash = _download(server)
+
+    assert data == CHANGED_BODY and size == len(CHANGED_BODY)
+    assert content_hash == hashlib.sha256(CHANGED_BODY).hexdigest()
+
+
+def test_gives_up_after_the_retry_limit(server, monkeypatch):
+    monkeypatch.setattr(app, 'URL_DOWNLOAD_RETRIES', 0)
+    server.plan = {'drop_at': 100000}
+
+    with pytest.raises(app._RESUMABLE_ERRORS):
+        _download(server)
+
+
+def test_not_modified_returns_no_buffer(server):
+    server.plan = {'not_modified': True}
+
+    data, size, headers, _ = _download(server, conditional_headers={'If-None-Match': '"v1"'})
+
+    assert data is None and size == 0
+    assert headers['ETag'] == '"v1"'
+
+
+def test_too_large(server):
+    with pytest.raises(URLImportError):
+        _download(server, max_size=1000)
+
+
+def test_redirects_are_followed_and_revalidated(server):
+    server.plan = {'redirects': {'/old': '/file.txt'}}
+
+    data, _, _, _ = _download(server, '/old')
+
+    assert data == BODY
+    assert [path for path, _ in server.requests] == ['/old', '/file.txt']
+
+
+def test_redirect_to_private_network_is_blocked(server):
+    server.plan = {'redirects': {'/evil': 'http://169.254.169.254/latest/meta-data/'}}
+
+    with pytest.raises(URLImportError):
+        _download(server, '/evil')
+    assert len(server.requests) == 1
+
+
+def test_redirect_loops_are_cut(server):
+    server.plan = {'redirects': {'/loop': '/loop'}}
+
+    with pytest.raises(URLImportError):
+        _download(server, '/loop')
+    assert len(server.requests) == app.URL_MAX_REDIRECTS + 1
@@ -0,0 +1,104 @@
+"""enrich_store: checkpoints, skipping enriched documents and interrupted runs"""
+from types import SimpleNamespace
+
+import pytest
+
+import app
+from app import EnrichmentInProgressError, enrich_store, load_enriched_documents, load_enrichment_metadata
+
+STORE = 'fileSearchStores/enrich-store'
+SCHEMA = {'type': 'object', 'properties': {'tema': {'type': 'string'}}}
+DOCUMENTS = [f'{STORE}/documents/doc-{number}' for number in range(1, 4)]
+
+
+class Interrupted(BaseException):
+    """Stands in for a shutdown in the middle of a run"""
+
+
+@pytest.fixture
+def analyses(monkeypatch):
+    """Fake store listing and per-document analysis; `analyses.fail` maps document -> exception"""
+    fake = SimpleNamespace(analyzed=[], fail={}, checkpoints=[])
+    documents = [{'name': name, 'display_name': name.rsplit('/', 1)[1]} for name in DOCUMENTS]
+
+    def enrich_target(target, schema, model, content_hashes):
+        document_id = target[0]
+        fake.analyzed.append(document_id)
+        if document_id in fake.fail:
+            raise fake.fail[document_id]
+        return {'tema': f'tema de {target[1]}'}
+
+    record_enrichments = app.record_enrichments
+
+    def recording(store_name, digest, model, results):
+        fake.checkpoints.append(sorted(results))
+        record_enrichments(store_name, digest, model, results)
+
+    monkeypatch.setattr(app, 'get_store_documents', lambda store_name, refresh=False: documents)
+    monkeypatch.setattr(app, '_enrich_target', enrich_target)
+    monkeypatch.setattr(app, 'record_enrichments', recording)
+    monkeypatch.setattr(app, 'ENRICH_CHECKPOINT_EVERY', 2)
+    yield fake
+    app.forget_enrichments(store_name=STORE)
+
+
+def _enrich(**kwargs):
+    return enrich_store(STORE, SCHEMA, model='gemini-test', parallelism=1, **kwargs)
+
+
+def test_results_are_checkpointed_and_failures_reported(analyses):
+    analyses.fail[DOCUMENTS[1]] = ValueError('No text could be retrieved for this document')
+
+    summary = _enrich()
+
+    assert (summary['total'], summary['enriched'], summary['failed'], summary['skipped']) == (3, 2, 1, 0)
+    assert summary['failures'] == [{'document_id': DOCUMENTS[1], 'name': 'doc-2',
+                                    'error': 'No text could be retrieved for this document'}]
+    assert summary['schema_hash'] == app.schema_hash(SCHEMA)
+    assert load_enriched_documents(STORE, app.schema_hash(SCHEMA)) == {DOCUMENTS[0], DOCUMENTS[2]}
+    assert load_enrichment_metadata(STORE)[DOCUMENTS[2]] == {'tema': 'tema de doc-3'}
+
+
+def test_rerun_skips_documents_enriched_with_the_same_schema(analyses):
+    analyses.fail[DOCUMENTS[1]] = ValueError('temporary')
+    _enrich()
+    analyses.fail.clear()
+    analyses.analyzed.clear()
+
+    summary = _enrich()
+
+    assert analyses.analyzed == [DOCUMENTS[1]]
+    assert (summary['enriched'], summary['skipped']) == (1, 2)
+
+    analyses.analyzed.clear()
+    assert _enrich(force=True)['enriched'] == 3
+    assert len(analyses.analyzed) == 3
+
+    other_schema = {'type': 'object', 'properties': {'precio': {'type': 'number'}}}
+    analyses.analyzed.clear()
+    enrich_store(STORE, other_schema, model='gemini-test', parallelism=1)
+    assert len(analyses.analyzed) == 3
+
+
+def test_interrupted_run_keeps_finished_checkpoints(analyses):
+    analyses.fail[DOCUMENTS[2]] = Interrupted()
+
+    with pytest.raises(Interrupted):
+        _enrich()
+
+    assert load_enriched_documents(STORE, app.schema_hash(SCHEMA)) == {DOCUMENTS[0], DOCUMENTS[1]}
+    assert analyses.checkpoints == [[DOCUMENTS[0], DOCUMENTS[1]]]
+
+    # The store is released and the next run only picks up what is left
+    analyses.fail.clear()
+    analyses.analyzed.clear()
+    assert _enrich()['enriched'] == 1
+    assert analyses.analyzed == [DOCUMENTS[2]]
+
+
+def test_one_run_per_store(analyses, monkeypatch):
+    monkeypatch.setattr(app, '_enrichments_running', {STORE})
+
+    with pytest.raises(EnrichmentInProgressError):
+        _enrich()
+    assert analyses.analyzed == []
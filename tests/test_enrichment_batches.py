@@ -0,0 +1,110 @@
+"""Offline enrichment: packing requests into Batch API jobs and fanning results back"""
+import json
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+import pytest
+
+import app
+from app import _collect_batch, _pack_batches, enrich_store, load_enrichment_metadata
+
+STORE = 'fileSearchStores/batch-enrich-store'
+SCHEMA = {'type': 'object', 'properties': {'tema': {'type': 'string'}}}
+
+
+def _entries(*sizes):
+    return [((f'doc-{index}', f'doc-{index}', None), f'request-{index}', size) for index, size in enumerate(sizes)]
+
+
+def _response(metadata=None, error=None, text=None):
+    return SimpleNamespace(
+        error=SimpleNamespace(message=error) if error else None,
+        response=SimpleNamespace(text=text if text is not None else json.dumps(metadata))
+    )
+
+
+def _batch_job(responses, state='JOB_STATE_SUCCEEDED'):
+    return SimpleNamespace(name='batches/1', state=SimpleNamespace(name=state),
+                           dest=SimpleNamespace(inlined_responses=responses))
+
+
+def test_batches_split_by_request_count(monkeypatch):
+    monkeypatch.setattr(app, 'GEMINI_BATCH_MAX_REQUESTS', 2)
+
+    batches = list(_pack_batches(_entries(1, 1, 1, 1, 1)))
+
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+
+
+def test_batches_split_by_inline_size(monkeypatch):
+    monkeypatch.setattr(app, 'BATCH_INLINE_MAX_CHARS', 100)
+
+    batches = list(_pack_batches(_entries(60, 30, 20, 150, 10)))
+
+    assert [[entry[2] for entry in batch] for batch in batches] == [[60, 30], [20], [150], [10]]
+    assert list(_pack_batches([])) == []
+
+
+def test_responses_are_matched_to_documents_in_order():
+    recorded = []
+
+    def record(target, metadata=None, error=None):
+        recorded.append((target[0], metadata, error))
+
+    entries = _entries(1, 1, 1, 1)
+    job = _batch_job([
+        _response({'tema': 'uno'}),
+        _response(error='quota exceeded'),
+        _response(text='not json')
+    ], state='JOB_STATE_PARTIALLY_SUCCEEDED')
+
+    _collect_batch(job, entries, record)
+
+    assert recorded[0] == ('doc-0', {'tema': 'uno'}, None)
+    assert recorded[1] == ('doc-1', None, 'Batch request failed: quota exceeded')
+    assert recorded[2][0] == 'doc-2' and recorded[2][2].startswith('Invalid batch response')
+    assert recorded[3] == ('doc-3', None, 'Missing from batch results')
+
+
+def test_failed_job_raises():
+    with pytest.raises(RuntimeError, match='JOB_STATE_EXPIRED'):
+        _collect_batch(_batch_job([], state='JOB_STATE_EXPIRED'), _entries(1), lambda *args, **kwargs: None)
+
+
+@pytest.fixture
+def batch_api(monkeypatch):
+    """Fake Batch API whose jobs finish at once with one answer per request"""
+    fake = SimpleNamespace(jobs=[])
+    documents = [{'name': f'{STORE}/documents/doc-{number}', 'display_name': f'doc-{number}'}
+                 for number in range(1, 6)]
+
+    def create(model, src, config=None):
+        fake.jobs.append(src)
+        responses = [_response({'tema': request}) for request in src]
+        return _batch_job(responses)
+
+    def track(operation, **kwargs):
+        future = Future()
+        future.set_result(operation)
+        return future
+
+    def batch_request(target, schema, model, content_hashes, uploads):
+        return target[1], 10
+
+    monkeypatch.setattr(app, 'client', SimpleNamespace(batches=SimpleNamespace(create=create)))
+    monkeypatch.setattr(app.operation_tracker, 'track', track)
+    monkeypatch.setattr(app, 'get_store_documents', lambda store_name, refresh=False: documents)
+    monkeypatch.setattr(app, '_schema_batch_request', batch_request)
+    monkeypatch.setattr(app, 'GEMINI_BATCH_MAX_REQUESTS', 2)
+    yield fake
+    app.forget_enrichments(store_name=STORE)
+
+
+def test_offline_enrichment_records_every_batch(batch_api):
+    summary = enrich_store(STORE, SCHEMA, model='gemini-test', parallelism=2, offline=True)
+
+    result = summary.result(timeout=10)
+    assert result['offline'] is True
+    assert (result['total'], result['enriched'], result['failed']) == (5, 5, 0)
+    assert [len(job) for job in batch_api.jobs] == [2, 2, 1]
+    assert load_enrichment_metadata(STORE)[f'{STORE}/documents/doc-4'] == {'tema': 'doc-4'}
@@ -0,0 +1,57 @@
+"""AppState file registry: document ID and metadata key indexes"""
+import pytest
+
+from app import AppState
+
+
+@pytest.fixture
+def registry():
+    state = AppState()
+    state.restore(None, [
+        {'filename': 'a.pdf', 'document_id': 'stores/s/documents/a', 'custom_metadata': {'tipo': 'factura'}},
+        {'filename': 'b.pdf', 'document_id': 'stores/s/documents/b', 'custom_metadata': {'autor': 'Ana'}},
+        {'filename': 'c.pdf', 'document_id': None, 'custom_metadata': {}},
+    ])
+    return state
+
+
+def test_find_file_by_document_id(registry):
+    assert registry.find_file('stores/s/documents/b')['filename'] == 'b.pdf'
+    assert registry.find_file('stores/s/documents/missing') is None
+    assert registry.local_metadata('stores/s/documents/a') == {'tipo': 'factura'}
+    assert registry.local_metadata('stores/s/documents/missing') is None
+
+
+def test_metadata_key_index_follows_edits(registry):
+    assert registry.metadata_keys() == ['autor', 'tipo']
+
+    registry.update_metadata('stores/s/documents/a', {'estado': 'pagada'})
+
+    assert registry.metadata_keys() == ['autor', 'estado']
+    assert registry.documents_with_metadata_key('estado') == {'stores/s/documents/a'}
+    assert registry.documents_with_metadata_key('tipo') == set()
+
+
+def test_update_keeps_position_and_untracked_documents_are_added(registry):
+    registry.update_metadata('stores/s/documents/a', {'tipo': 'contrato'})
+    registry.update_metadata('stores/s/documents/new', {'tipo': 'nota'})
+
+    assert [f.get('filename') for f in registry.files()] == ['a.pdf', 'b.pdf', 'c.pdf', None]
+    assert registry.documents_with_metadata_key('tipo') == {'stores/s/documents/a', 'stores/s/documents/new'}
+
+
+def test_remove_document_drops_every_index_entry(registry):
+    assert registry.remove_document('stores/s/documents/b') == 1
+    assert registry.remove_document('stores/s/documents/b') == 0
+
+    assert registry.find_file('stores/s/documents/b') is None
+    assert registry.metadata_keys() == ['tipo']
+    assert registry.file_count() == 2
+
+
+def test_merge_metadata_only_applies_to_the_active_store(registry):
+    assert registry.merge_metadata({'stores/s/documents/a': {'year': 2024}}, store_name='stores/other') is False
+    assert registry.local_metadata('stores/s/documents/a') == {'tipo': 'factura'}
+
+    assert registry.merge_metadata({'stores/s/documents/a': {'year': 2024}}) is True
+    assert registry.local_metadata('stores/s/documents/a') == {'tipo': 'factura', 'year': 2024}
@@ -0,0 +1,121 @@
+"""Background investigations: progress, partial results and resume"""
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import app
+
+STORE = 'fileSearchStores/investigation-store'
+
+
+@pytest.fixture
+def gemini(monkeypatch):
+    """generate_content_with_retry that fails for questions listed in `failing`"""
+    fake = SimpleNamespace(failing=set(), asked=[])
+
+    def generate(model, contents, config=None):
+        if config is None:  # executive summary
+            return SimpleNamespace(text='Resumen', candidates=[])
+        fake.asked.append(contents)
+        if contents in fake.failing:
+            raise RuntimeError('model overloaded')
+        return SimpleNamespace(text=f'Respuesta a {contents}', candidates=[])
+
+    monkeypatch.setattr(app, 'generate_content_with_retry', generate)
+    yield fake
+    for investigation in app.load_investigations():
+        if investigation['store_name'] == STORE:
+            app.delete_investigation_record(investigation['id'])
+
+
+def _wait_for_job(job_id):
+    for _ in range(300):
+        job = app.get_job(job_id)
+        if job['status'] in ('completed', 'failed'):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f'job {job_id} did not finish')
+
+
+def _progress(client, investigation_id):
+    return client.get(f'/investigations/{investigation_id}/progress').get_json()
+
+
+def test_failed_questions_leave_a_partial_investigation_that_resumes(gemini):
+    gemini.failing.add('¿B?')
+    client = app.app.test_client()
+
+    response = client.post('/investigate', json={
+        'title': 'Contratos', 'questions': ['¿A?', '¿B?', '¿C?'], 'store_name': STORE, 'parallelism': 3
+    })
+    assert response.status_code == 202
+    body = response.get_json()
+    _wait_for_job(body['job_id'])
+
+    progress = _progress(client, body['investigation_id'])
+    assert progress['status'] == 'partial'
+    assert progress['progress'] == {'total': 3, 'completed': 2, 'failed': 1, 'pending': 0}
+    sections = app.load_investigation(body['investigation_id'])['sections']
+    assert [s['question'] for s in sections] == ['¿A?', '¿B?', '¿C?']
+
+    gemini.failing.clear()
+    gemini.asked.clear()
+    resumed = client.post(f"/investigations/{body['investigation_id']}/resume", json={'parallelism': 2})
+    assert resumed.status_code == 202
+    _wait_for_job(resumed.get_json()['job_id'])
+
+    assert gemini.asked == ['¿B?']
+    progress = _progress(client, body['investigation_id'])
+    assert progress['status'] == 'completed'
+    assert progress['progress']['completed'] == 3
+    investigation = app.load_investigation(body['investigation_id'])
+    assert investigation['sections'][1]['answer'] == 'Respuesta a ¿B?'
+    assert investigation['summary'] == 'Resumen'
+
+    assert client.post(f"/investigations/{body['investigation_id']}/resume").status_code == 400
+
+
+def test_running_record_without_a_job_is_interrupted(gemini):
+    investigation = {
+        'id': 'inv-interrupted', 'title': 'Cortada', 'store_name': STORE, 'status': 'running',
+        'job_id': 'job-lost-on-restart', 'summary': '', 'created_at': '2026-01-01T00:00:00',
+        'metadata': {'total_questions': 2, 'total_citations': 0, 'model_used': 'gemini-2.5-flash'},
+        'sections': [
+            {'question': '¿Hecha?', 'answer': 'Sí', 'citations': [], 'status': 'completed'},
+            {'question': '¿Pendiente?', 'answer': '', 'citations': [], 'status': 'pending'}
+        ]
+    }
+    app.save_investigation(investigation)
+    client = app.app.test_client()
+
+    assert _progress(client, 'inv-interrupted')['status'] == 'interrupted'
+
+    resumed = client.post('/investigations/inv-interrupted/resume')
+    assert resumed.status_code == 202
+    _wait_for_job(resumed.get_json()['job_id'])
+    assert gemini.asked == ['¿Pendiente?']
+    assert _progress(client, 'inv-interrupted')['status'] == 'completed'
+
+
+def test_running_investigation_cannot_be_resumed(gemini):
+    job = app.create_job('investigation')
+    app.update_job(job['id'], status='running')
+    app.save_investigation({
+        'id': 'inv-running', 'title': 'En curso', 'store_name': STORE, 'status': 'running',
+        'job_id': job['id'], 'sections': [], 'metadata': {'model_used': 'gemini-2.5-flash'}
+    })
+
+    response = app.app.test_client().post('/investigations/inv-running/resume')
+
+    assert response.status_code == 409
+    app.update_job(job['id'], status='completed')
+
+
+def test_validation_errors():
+    client = app.app.test_client()
+
+    assert client.post('/investigate', json={'questions': ['¿A?'], 'store_name': STORE}).status_code == 400
+    assert client.post('/investigate', json={'title': 'T', 'questions': [' '], 'store_name': STORE}).status_code == 400
+    assert client.get('/investigations/unknown/progress').status_code == 404
+    assert client.post('/investigations/unknown/resume').status_code == 404
@@ -0,0 +1,33 @@
+"""build_metadata_filter: AIP-160 filter strings for File Search"""
+from app import build_metadata_filter
+
+
+def test_no_filters():
+    assert build_metadata_filter(None) is None
+    assert build_metadata_filter([]) is None
+
+
+def test_string_values_are_quoted():
+    assert build_metadata_filter([{'key': 'tipo', 'value': 'factura'}]) == 'tipo="factura"'
+
+
+def test_numeric_values_are_not_quoted():
+    assert build_metadata_filter([{'key': 'year', 'value': '2024'}]) == 'year=2024'
+    assert build_metadata_filter([{'key': 'price', 'value': 9.5}]) == 'price=9.5'
+
+
+def test_quotes_are_escaped():
+    assert build_metadata_filter([{'key': 'title', 'value': 'say "hi"'}]) == 'title="say \\"hi\\""'
+
+
+def test_filters_are_joined_with_and():
+    filters = [{'key': 'tipo', 'value': 'factura'}, {'key': 'year', 'value': '2024'}]
+
+    assert build_metadata_filter(filters) == 'tipo="factura" AND year=2024'
+
+
+def test_incomplete_filters_are_skipped():
+    filters = [{'key': '', 'value': 'x'}, {'key': 'tipo', 'value': ''}, {'value': 'y'}, {'key': 'a', 'value': 'b'}]
+
+    assert build_metadata_filter(filters) == 'a="b"'
+    assert build_metadata_filter([{'key': 'tipo'}]) is None
@@ -0,0 +1,116 @@
+"""OperationTracker: adaptive polling, timeouts and poller robustness"""
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import app
+from app import OperationTracker
+
+
+def _operation(ready_after):
+    return SimpleNamespace(done=False, polls=0, ready_after=ready_after)
+
+
+def _refresh(operation):
+    operation.polls += 1
+    operation.done = operation.polls >= operation.ready_after
+    return operation
+
+
+@pytest.fixture
+def tracker():
+    return OperationTracker(min_interval=0.01, max_interval=0.05, jitter=0.0)
+
+
+def test_resolves_when_operation_finishes(tracker):
+    operation = _operation(ready_after=3)
+    future = tracker.track(operation, 'text/plain', timeout=5, refresh=_refresh)
+
+    assert future.result(timeout=5) is operation
+    assert operation.polls == 3
+
+
+def test_finished_operation_is_not_polled(tracker):
+    operation = SimpleNamespace(done=True)
+    future = tracker.track(operation, timeout=5, refresh=pytest.fail)
+
+    assert future.done()
+    assert future.result() is operation
+
+
+def test_times_out(tracker):
+    future = tracker.track(_operation(ready_after=10 ** 6), timeout=0.1, refresh=_refresh)
+
+    with pytest.raises(TimeoutError):
+        future.result(timeout=5)
+
+
+def test_learns_latency_per_mime_type(tracker):
+    future = tracker.track(_operation(ready_after=2), 'application/pdf', timeout=5, refresh=_refresh)
+    future.result(timeout=5)
+
+    assert tracker.estimate('application/pdf') > 0
+    assert tracker.estimate('text/csv') is None
+
+
+def test_first_check_waits_for_the_estimate():
+    tracker = OperationTracker(min_interval=0.01, max_interval=1.0, jitter=0.0)
+    tracker.record_latency('application/pdf', 0.5)
+    poll_times = []
+
+    def refresh(operation):
+        poll_times.append(time.monotonic())
+        return _refresh(operation)
+
+    started = time.monotonic()
+    tracker.track(_operation(ready_after=1), 'application/pdf', timeout=5, refresh=refresh).result(timeout=5)
+
+    # First check around 80% of the learned latency, not after min_interval
+    assert poll_times[0] - started >= 0.35
+
+
+def test_backoff_grows_and_is_capped(tracker):
+    entry = {'interval': tracker.min_interval, 'max_interval': tracker.max_interval}
+    intervals = [tracker._next_interval(entry) for _ in range(20)]
+
+    assert intervals[1] > intervals[0]
+    assert max(intervals) == pytest.approx(tracker.max_interval)
+
+
+def test_error_in_one_entry_does_not_stop_the_poller(tracker):
+    def broken_is_done(operation):
+        if operation.polls:
+            raise ValueError('broken is_done')
+        return False
+
+    failing = tracker.track(_operation(ready_after=1), timeout=5, refresh=_refresh, is_done=broken_is_done)
+    with pytest.raises(ValueError):
+        failing.result(timeout=5)
+
+    healthy = tracker.track(_operation(ready_after=2), timeout=5, refresh=_refresh)
+    assert healthy.result(timeout=5).done
+
+
+def test_refresh_errors_are_retried(tracker):
+    calls = []
+
+    def flaky_refresh(operation):
+        calls.append(1)
+        if len(calls) == 1:
+            raise ConnectionError('temporary')
+        return _refresh(operation)
+
+    future = tracker.track(_operation(ready_after=1), timeout=5, refresh=flaky_refresh)
+
+    assert future.result(timeout=5).done
+    assert len(calls) == 2
+
+
+def test_upload_timeout_scales_with_size_and_latency():
+    base = app.upload_operation_timeout(0)
+    assert base == app.UPLOAD_OPERATION_TIMEOUT
+    assert app.upload_operation_timeout(50 * 1024 * 1024) == pytest.approx(base + 50 * app.UPLOAD_TIMEOUT_PER_MB)
+
+    app.operation_tracker.record_latency('application/x-test-slow', base)
+    assert app.upload_operation_timeout(0, 'application/x-test-slow') == pytest.approx(3 * base)
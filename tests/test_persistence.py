@@ -0,0 +1,120 @@
+"""SQLite state persistence: row-level round-trips and the one-time JSON migration"""
+import json
+import sqlite3
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def fresh_db(tmp_path):
+    """An empty database with the app schema, separate from the shared test database"""
+    conn = sqlite3.connect(str(tmp_path / 'state.db'))
+    conn.execute('PRAGMA foreign_keys=ON')
+    conn.executescript(app.DB_SCHEMA)
+    app._add_missing_columns(conn)
+    yield conn
+    conn.close()
+
+
+def _tracked(document_id):
+    return [f for f in app._load_files(app._db()) if f.get('document_id') == document_id]
+
+
+def test_file_and_metadata_round_trip(fresh_db):
+    file_info = {
+        'filename': 'contrato.pdf',
+        'size': 2048,
+        'document_id': 'stores/s/documents/contrato',
+        'custom_metadata': {'tipo': 'contrato', 'importe': 1500.5, 'year': 2024}
+    }
+    with fresh_db:
+        app._insert_file(fresh_db, file_info)
+
+    [loaded] = app._load_files(fresh_db)
+
+    assert loaded == file_info  # file_id was set on the original by the insert
+    assert isinstance(loaded['custom_metadata']['year'], int)
+
+
+def test_files_keep_insertion_order(fresh_db):
+    with fresh_db:
+        for name in ('c.txt', 'a.txt', 'b.txt'):
+            app._insert_file(fresh_db, {'filename': name, 'custom_metadata': {}})
+
+    assert [f['filename'] for f in app._load_files(fresh_db)] == ['c.txt', 'a.txt', 'b.txt']
+
+
+def test_single_row_updates_and_deletes():
+    document_id = 'stores/persist/documents/one'
+    file_info = {'filename': 'one.txt', 'document_id': document_id, 'custom_metadata': {'tipo': 'nota'}}
+    app.persist_file(file_info)
+
+    app.persist_file_metadata(dict(file_info, custom_metadata={'tipo': 'acta', 'autor': 'Ana'}))
+    [loaded] = _tracked(document_id)
+    assert loaded['custom_metadata'] == {'tipo': 'acta', 'autor': 'Ana'}
+    assert loaded['file_id'] == file_info['file_id']
+
+    app.delete_persisted_file(file_info)
+    assert _tracked(document_id) == []
+    orphans = app._db().execute('SELECT COUNT(*) FROM file_metadata WHERE file_id = ?',
+                                (file_info['file_id'],)).fetchone()[0]
+    assert orphans == 0
+
+
+def test_settings_round_trip():
+    app.save_state_value('test_setting', {'model': 'gemini-3-flash-preview', 'temperature': 0.2})
+
+    assert app.load_state_value('test_setting') == {'model': 'gemini-3-flash-preview', 'temperature': 0.2}
+    assert app.load_state_value('missing_setting', 'fallback') == 'fallback'
+
+
+def test_investigations_round_trip():
+    older = {'id': 'inv-persist-1', 'created_at': '2026-01-01 10:00:00', 'title': 'Older', 'sections': []}
+    newer = {'id': 'inv-persist-2', 'created_at': '2026-02-01 10:00:00', 'title': 'Newer',
+             'sections': [{'question': '¿Qué?', 'answer': 'Esto'}]}
+    app.save_investigation(older)
+    app.save_investigation(newer)
+
+    assert app.load_investigation('inv-persist-2') == newer
+    ids = [inv['id'] for inv in app.load_investigations() if inv['id'].startswith('inv-persist-')]
+    assert ids == ['inv-persist-2', 'inv-persist-1']
+
+    assert app.delete_investigation_record('inv-persist-1') is True
+    assert app.delete_investigation_record('inv-persist-1') is False
+    assert app.load_investigation('inv-persist-1') is None
+    app.delete_investigation_record('inv-persist-2')
+
+
+def test_legacy_json_is_migrated_once(fresh_db, tmp_path, monkeypatch):
+    legacy_path = tmp_path / 'store_state.json'
+    legacy_path.write_text(json.dumps({
+        'store_name': 'fileSearchStores/legacy',
+        'uploaded_files': [{'filename': 'old.pdf', 'document_id': 'd1', 'custom_metadata': {'tipo': 'x'}}],
+        'investigations': [{'id': 'inv-legacy', 'created_at': '2025-01-01', 'title': 'Legacy'}]
+    }))
+    monkeypatch.setattr(app, 'PERSISTENCE_FILE', str(legacy_path))
+
+    app._migrate_json_state(fresh_db)
+
+    [migrated] = app._load_files(fresh_db)
+    assert (migrated['filename'], migrated['custom_metadata']) == ('old.pdf', {'tipo': 'x'})
+    settings = dict(fresh_db.execute('SELECT key, value FROM settings'))
+    assert json.loads(settings['store_name']) == 'fileSearchStores/legacy'
+    assert fresh_db.execute('SELECT id FROM investigations').fetchall() == [('inv-legacy',)]
+    assert not legacy_path.exists()
+    assert (tmp_path / 'store_state.json.migrated').exists()
+
+
+def test_migration_is_skipped_when_the_database_has_rows(fresh_db, tmp_path, monkeypatch):
+    with fresh_db:
+        app._insert_file(fresh_db, {'filename': 'current.txt', 'custom_metadata': {}})
+    legacy_path = tmp_path / 'store_state.json'
+    legacy_path.write_text(json.dumps({'uploaded_files': [{'filename': 'stale.txt'}]}))
+    monkeypatch.setattr(app, 'PERSISTENCE_FILE', str(legacy_path))
+
+    app._migrate_json_state(fresh_db)
+
+    assert [f['filename'] for f in app._load_files(fresh_db)] == ['current.txt']
+    assert legacy_path.exists()
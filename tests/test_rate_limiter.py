@@ -0,0 +1,92 @@
+"""Shared Gemini rate limiter and generate_content_with_retry"""
+from types import SimpleNamespace
+
+import pytest
+
+import app
+from app import RateLimiter, generate_content_stream_limited, generate_content_with_retry
+
+
+class CountingLimiter:
+    def __init__(self):
+        self.acquired = 0
+
+    def acquire(self):
+        self.acquired += 1
+
+
+class RateLimited(Exception):
+    code = 429
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    counting = CountingLimiter()
+    monkeypatch.setattr(app, 'gemini_rate_limiter', counting)
+    monkeypatch.setattr(app.time, 'sleep', lambda seconds: None)
+    return counting
+
+
+def _client(monkeypatch, generate=None, stream=None):
+    models = SimpleNamespace(generate_content=generate, generate_content_stream=stream)
+    monkeypatch.setattr(app, 'client', SimpleNamespace(models=models))
+
+
+def test_burst_then_waits_for_refill(monkeypatch):
+    now = [0.0]
+    slept = []
+    monkeypatch.setattr(app.time, 'monotonic', lambda: now[0])
+
+    def sleep(seconds):
+        slept.append(seconds)
+        now[0] += seconds
+
+    monkeypatch.setattr(app.time, 'sleep', sleep)
+    limiter = RateLimiter(60, burst=2)
+
+    limiter.acquire()
+    limiter.acquire()
+    assert slept == []
+    limiter.acquire()
+    assert slept == [pytest.approx(1.0)]
+
+
+def test_zero_rate_never_blocks(monkeypatch):
+    monkeypatch.setattr(app.time, 'sleep', lambda seconds: pytest.fail('should not sleep'))
+    limiter = RateLimiter(0)
+    for _ in range(100):
+        limiter.acquire()
+
+
+def test_rate_limited_calls_are_retried(monkeypatch, limiter):
+    calls = []
+
+    def generate(**kwargs):
+        calls.append(kwargs)
+        if len(calls) < 3:
+            raise RateLimited('RESOURCE_EXHAUSTED')
+        return 'answer'
+
+    _client(monkeypatch, generate=generate)
+
+    assert generate_content_with_retry(model='m', contents='q') == 'answer'
+    assert len(calls) == 3
+    assert limiter.acquired == 3
+
+
+def test_other_errors_are_not_retried(monkeypatch, limiter):
+    def generate(**kwargs):
+        raise ValueError('bad request')
+
+    _client(monkeypatch, generate=generate)
+
+    with pytest.raises(ValueError):
+        generate_content_with_retry(model='m', contents='q')
+    assert limiter.acquired == 1
+
+
+def test_streams_take_a_token(monkeypatch, limiter):
+    _client(monkeypatch, stream=lambda **kwargs: iter(['a', 'b']))
+
+    assert list(generate_content_stream_limited(model='m', contents='q')) == ['a', 'b']
+    assert limiter.acquired == 1
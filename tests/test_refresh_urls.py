@@ -0,0 +1,136 @@
+"""_refresh_url_source: conditional GETs, same-content skips and document replacement"""
+import hashlib
+import threading
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import pytest
+
+import app
+from app import list_url_sources, record_url_source
+
+STORE = 'fileSearchStores/refresh-store'
+OLD_DOCUMENT = f'{STORE}/documents/old'
+NEW_DOCUMENT = f'{STORE}/documents/new'
+BODY = b'original content'
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Serves server.body with ETag "v1"; answers 304 to a matching If-None-Match"""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers))
+        if self.headers.get('If-None-Match') == self.server.etag:
+            self.send_response(304)
+            self.send_header('ETag', self.server.etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', self.server.etag)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(self.server.body)))
+        self.end_headers()
+        self.wfile.write(self.server.body)
+
+
+@pytest.fixture
+def server(monkeypatch):
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    httpd.body, httpd.etag, httpd.requests = BODY, '"v1"', []
+    httpd.url = f'http://127.0.0.1:{httpd.server_port}/doc.txt'
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    monkeypatch.setattr(app, 'validate_import_url', lambda url: '127.0.0.1')
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    """Fake document deletes and imports; `imports.document_id` is what the next import returns"""
+    deleted = []
+    imports = SimpleNamespace(document_id=NEW_DOCUMENT, calls=[], deleted=deleted)
+    documents = SimpleNamespace(delete=lambda name, config=None: deleted.append(name))
+    monkeypatch.setattr(app, 'client', SimpleNamespace(file_search_stores=SimpleNamespace(documents=documents)))
+
+    def process_upload(source, filename, file_size, metadata, *args, **kwargs):
+        source.close()
+        imports.calls.append((filename, metadata))
+        done = Future()
+        done.set_result({'document_id': imports.document_id, 'filename': filename, 'store_name': STORE})
+        return done
+
+    monkeypatch.setattr(app, '_process_upload', process_upload)
+    yield imports
+    app.forget_url_sources(store_name=STORE)
+
+
+def _source(server, sha256=hashlib.sha256(BODY).hexdigest()):
+    record_url_source(STORE, server.url, OLD_DOCUMENT, 'doc.txt', {'ETag': '"v1"'}, sha256,
+                      {'source_url': server.url, 'tipo': 'faq'}, {})
+    return list_url_sources(STORE)[0]
+
+
+def _refresh(source, force=False):
+    outcome = app._refresh_url_source(source, force=force)
+    return outcome.result(timeout=10) if isinstance(outcome, Future) else outcome
+
+
+def test_not_modified_leaves_the_document(server, backend):
+    result = _refresh(_source(server))
+
+    assert result == {'status': 'unchanged', 'reason': 'not_modified', 'document_id': OLD_DOCUMENT,
+                      'store_name': STORE}
+    assert server.requests[0]['If-None-Match'] == '"v1"'
+    assert backend.calls == [] and backend.deleted == []
+
+
+def test_same_content_is_not_reimported(server, backend):
+    server.etag = '"v2"'  # new validator, same bytes
+
+    result = _refresh(_source(server))
+
+    assert result['status'] == 'unchanged' and result['reason'] == 'same_content'
+    assert backend.calls == [] and backend.deleted == []
+    assert list_url_sources(STORE)[0]['etag'] == '"v2"'
+
+
+def test_changed_content_replaces_the_document(server, backend):
+    server.etag, server.body = '"v2"', b'new content'
+
+    result = _refresh(_source(server))
+
+    assert result['status'] == 'updated'
+    assert result['document_id'] == NEW_DOCUMENT and result['replaced_document_id'] == OLD_DOCUMENT
+    assert backend.calls[0][1]['tipo'] == 'faq'
+    assert backend.deleted == [OLD_DOCUMENT]
+    source = list_url_sources(STORE)[0]
+    assert source['document_id'] == NEW_DOCUMENT
+    assert source['sha256'] == hashlib.sha256(b'new content').hexdigest()
+    assert source['etag'] == '"v2"'
+
+
+def test_import_without_document_keeps_the_old_one(server, backend):
+    server.etag, server.body = '"v2"', b'new content'
+    backend.document_id = None
+
+    with pytest.raises(Exception, match='returned no document'):
+        _refresh(_source(server))
+
+    assert backend.deleted == []
+    source = list_url_sources(STORE)[0]
+    assert source['document_id'] == OLD_DOCUMENT
+    assert source['sha256'] == hashlib.sha256(BODY).hexdigest()
+
+
+def test_force_skips_the_conditional_get(server, backend):
+    result = _refresh(_source(server), force=True)
+
+    assert 'If-None-Match' not in server.requests[0]
+    assert result['status'] == 'updated'
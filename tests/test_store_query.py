@@ -0,0 +1,140 @@
+"""iter_store_query: concurrent per-document retrieval merged into a top-k"""
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import app
+from app import iter_store_query
+
+STORE = 'fileSearchStores/test-store'
+
+
+def _doc(name):
+    return f'{STORE}/documents/{name}'
+
+
+class FakeDocuments:
+    """documents.query returning fixed relevance scores per document"""
+
+    def __init__(self, scores, fail=(), delay=None):
+        self.scores = scores  # document name -> list of scores
+        self.fail = set(fail)
+        self.delay = delay or {}
+        self.calls = []
+
+    def query(self, name, query, config=None):
+        self.calls.append((name, config))
+        time.sleep(self.delay.get(name, 0))
+        if name in self.fail:
+            raise RuntimeError('backend error')
+        scores = self.scores[name][:config['results_count']]
+        return SimpleNamespace(relevant_chunks=[
+            SimpleNamespace(
+                chunk_relevance_score=score,
+                chunk=SimpleNamespace(data=SimpleNamespace(string_value=f'{name}#{i}'), custom_metadata=None)
+            )
+            for i, score in enumerate(scores)
+        ])
+
+
+@pytest.fixture
+def documents(monkeypatch):
+    def install(scores, **kwargs):
+        fake = FakeDocuments(scores, **kwargs)
+        monkeypatch.setattr(app, 'client', SimpleNamespace(file_search_stores=SimpleNamespace(documents=fake)))
+        return fake
+
+    app.retrieval_cache.clear()
+    yield install
+    app.retrieval_cache.clear()
+
+
+def _run(names, results_count, per_document_count=None):
+    events = list(iter_store_query(names, 'query', results_count, per_document_count or results_count))
+    return events[:-1], events[-1]
+
+
+def test_keeps_the_best_chunks_across_documents(documents):
+    documents({
+        _doc('a'): [0.9, 0.5, 0.1],
+        _doc('b'): [0.8, 0.7, 0.2],
+        _doc('c'): [0.95, 0.3, 0.05],
+    })
+
+    _, result = _run([_doc('a'), _doc('b'), _doc('c')], results_count=4, per_document_count=3)
+
+    assert [chunk['relevance_score'] for chunk in result['chunks']] == [0.95, 0.9, 0.8, 0.7]
+    assert result['chunks'][0]['document_name'] == _doc('c')
+    assert result['chunks'][0]['text'] == f"{_doc('c')}#0"
+    assert result['errors'] == []
+
+
+def test_reports_progress_per_document(documents):
+    documents({_doc('a'): [0.5, 0.4], _doc('b'): [0.3]})
+
+    progress, result = _run([_doc('a'), _doc('b')], results_count=10)
+
+    assert [event['documents_done'] for event in progress] == [1, 2]
+    assert all(event['documents_total'] == 2 for event in progress)
+    assert progress[-1]['chunks_found'] == 3
+    assert len(result['chunks']) == 3
+
+
+def test_per_document_count_is_sent_to_each_query(documents):
+    fake = documents({_doc('a'): [0.5] * 10, _doc('b'): [0.4] * 10})
+
+    _, result = _run([_doc('a'), _doc('b')], results_count=3, per_document_count=2)
+
+    assert {config['results_count'] for _, config in fake.calls} == {2}
+    assert len(result['chunks']) == 3
+
+
+def test_failing_document_is_reported_not_fatal(documents):
+    documents({_doc('ok'): [0.6], _doc('broken'): []}, fail=[_doc('broken')])
+
+    _, result = _run([_doc('ok'), _doc('broken')], results_count=5)
+
+    assert [chunk['document_name'] for chunk in result['chunks']] == [_doc('ok')]
+    assert result['errors'] == [{'document_name': _doc('broken'), 'error': 'backend error'}]
+
+
+def test_slow_documents_time_out(documents, monkeypatch):
+    monkeypatch.setattr(app, 'STORE_QUERY_TIMEOUT', 0.2)
+    documents({_doc('fast'): [0.6], _doc('slow'): [0.99]}, delay={_doc('slow'): 1.0})
+
+    _, result = _run([_doc('fast'), _doc('slow')], results_count=5)
+
+    assert [chunk['document_name'] for chunk in result['chunks']] == [_doc('fast')]
+    assert [error['document_name'] for error in result['errors']] == [_doc('slow')]
+    assert 'Timed out' in result['errors'][0]['error']
+
+
+def test_repeated_queries_use_the_retrieval_cache(documents):
+    fake = documents({_doc('a'): [0.9, 0.8, 0.7]})
+
+    _run([_doc('a')], results_count=3)
+    _, result = _run([_doc('a')], results_count=2)
+
+    assert len(fake.calls) == 1
+    assert [chunk['relevance_score'] for chunk in result['chunks']] == [0.9, 0.8]
+
+
+def test_route_rejects_unknown_models(documents):
+    documents({})
+    response = app.app.test_client().post('/store-query', json={
+        'query': 'q', 'store_name': STORE, 'documents': [_doc('a')], 'generate': True, 'model': 'not-a-model'
+    })
+
+    assert response.status_code == 400
+
+
+def test_route_rejects_documents_of_other_stores(documents):
+    fake = documents({})
+    response = app.app.test_client().post('/store-query', json={
+        'query': 'q', 'store_name': STORE, 'documents': ['fileSearchStores/other/documents/x'], 'stream': False
+    })
+
+    assert response.status_code == 400
+    assert response.get_json()['documents'] == ['fileSearchStores/other/documents/x']
+    assert fake.calls == []
@@ -0,0 +1,120 @@
+"""sync_directory: manifest updates when deletes or imports fail"""
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+import pytest
+
+import app
+from app import load_sync_manifest, sync_directory
+
+STORE = 'fileSearchStores/sync-store'
+
+
+class FakeDocuments:
+    def __init__(self, fail_delete=False):
+        self.fail_delete = fail_delete
+        self.deleted = []
+
+    def delete(self, name, config=None):
+        if self.fail_delete:
+            raise RuntimeError('backend error')
+        self.deleted.append(name)
+
+
+@pytest.fixture
+def documents(monkeypatch):
+    def install(**kwargs):
+        fake = FakeDocuments(**kwargs)
+        monkeypatch.setattr(app, 'client', SimpleNamespace(file_search_stores=SimpleNamespace(documents=fake)))
+        return fake
+    return install
+
+
+@pytest.fixture
+def imports(monkeypatch):
+    """Replace _process_upload with an import that resolves to the given document_id"""
+    uploaded = []
+
+    def install(document_id):
+        def process_upload(source, filename, file_size, *args, **kwargs):
+            source.close()
+            uploaded.append(filename)
+            done = Future()
+            done.set_result({'document_id': document_id, 'filename': filename, 'store_name': STORE})
+            return done
+        monkeypatch.setattr(app, '_process_upload', process_upload)
+        return uploaded
+    return install
+
+
+def _sync(directory):
+    return sync_directory(str(directory), STORE, parallelism=2).result(timeout=10)
+
+
+def test_first_sync_uploads_and_records_the_manifest(tmp_path, documents, imports):
+    documents()
+    imports('fileSearchStores/sync-store/documents/new')
+    (tmp_path / 'a.txt').write_text('hello')
+
+    summary = _sync(tmp_path)
+
+    assert summary['uploaded'] == 1 and summary['failed'] == 0
+    assert load_sync_manifest(STORE, str(tmp_path.resolve()))['a.txt']['document_id'].endswith('/new')
+    app.forget_sync_manifest(store_name=STORE)
+
+
+def test_failed_delete_keeps_the_manifest_row(tmp_path, documents, imports):
+    documents()
+    imports('fileSearchStores/sync-store/documents/gone')
+    (tmp_path / 'gone.txt').write_text('bye')
+    _sync(tmp_path)
+    (tmp_path / 'gone.txt').unlink()
+
+    fake = documents(fail_delete=True)
+    summary = _sync(tmp_path)
+
+    assert summary['failed'] == 1 and summary['deleted'] == 0
+    assert 'gone.txt' in load_sync_manifest(STORE, str(tmp_path.resolve()))
+
+    # The next sync retries the delete
+    fake.fail_delete = False
+    summary = _sync(tmp_path)
+    assert summary['deleted'] == 1
+    assert fake.deleted == ['fileSearchStores/sync-store/documents/gone']
+    assert load_sync_manifest(STORE, str(tmp_path.resolve())) == {}
+
+
+def test_import_without_document_keeps_the_old_version(tmp_path, documents, imports):
+    fake = documents()
+    imports('fileSearchStores/sync-store/documents/v1')
+    path = tmp_path / 'doc.txt'
+    path.write_text('version 1')
+    _sync(tmp_path)
+    path.write_text('version 2 is longer')
+
+    imports(None)
+    summary = _sync(tmp_path)
+
+    assert summary['failed'] == 1 and summary['uploaded'] == 0
+    entry = load_sync_manifest(STORE, str(tmp_path.resolve()))['doc.txt']
+    assert entry['document_id'] == 'fileSearchStores/sync-store/documents/v1'
+    assert fake.deleted == []
+    app.forget_sync_manifest(store_name=STORE)
+
+
+def test_changed_file_replaces_the_old_document(tmp_path, documents, imports):
+    fake = documents()
+    imports('fileSearchStores/sync-store/documents/v1')
+    path = tmp_path / 'doc.txt'
+    path.write_text('version 1')
+    _sync(tmp_path)
+    path.write_text('version 2 is longer')
+
+    imports('fileSearchStores/sync-store/documents/v2')
+    summary = _sync(tmp_path)
+
+    assert summary['uploaded'] == 1
+    entry = load_sync_manifest(STORE, str(tmp_path.resolve()))['doc.txt']
+    assert entry['document_id'] == 'fileSearchStores/sync-store/documents/v2'
+    assert fake.deleted == ['fileSearchStores/sync-store/documents/v1']
+    app.forget_sync_manifest(store_name=STORE)
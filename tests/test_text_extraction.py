@@ -0,0 +1,123 @@
+"""Streaming DOCX/XLSX text extraction and sample_text budgets"""
+import zipfile
+
+from openpyxl import Workbook
+
+from app import iter_docx_text, iter_xlsx_text, sample_text
+
+W = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+
+
+def _paragraph(text, style=None):
+    properties = f'<w:pPr><w:pStyle w:val="{style}"/></w:pPr>' if style else ''
+    return f'<w:p>{properties}<w:r><w:t>{text}</w:t></w:r></w:p>'
+
+
+def _cell(*paragraphs):
+    return f"<w:tc>{''.join(_paragraph(text) for text in paragraphs)}</w:tc>"
+
+
+def _docx(path, body):
+    with zipfile.ZipFile(path, 'w') as archive:
+        archive.writestr('word/document.xml', f'<w:document xmlns:w="{W}"><w:body>{body}</w:body></w:document>')
+    return str(path)
+
+
+class Lines:
+    """Line generator that records how far it was read and whether it was closed"""
+
+    def __init__(self, lines):
+        self.lines = list(lines)
+        self.read = 0
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.read >= len(self.lines):
+            raise StopIteration
+        self.read += 1
+        return self.lines[self.read - 1]
+
+    def close(self):
+        self.closed = True
+
+
+def test_docx_paragraphs_headings_and_table_rows(tmp_path):
+    path = _docx(tmp_path / 'informe.docx', ''.join([
+        _paragraph('Informe anual', 'Title'),
+        _paragraph('Introducción'),
+        _paragraph('Ventas', 'Heading1'),
+        _paragraph('   '),
+        f"<w:tbl><w:tr>{_cell('Región')}{_cell('Total')}</w:tr>"
+        f"<w:tr>{_cell('Norte', 'y costa')}{_cell('10')}</w:tr>"
+        f"<w:tr>{_cell()}{_cell()}</w:tr></w:tbl>",
+        _paragraph('Cierre')
+    ]))
+
+    assert list(iter_docx_text(path)) == [
+        '# Informe anual', 'Introducción', '# Ventas', 'Región | Total', 'Norte y costa | 10', 'Cierre'
+    ]
+
+
+def test_xlsx_yields_a_header_per_sheet_and_caps_rows(tmp_path):
+    wb = Workbook()
+    first = wb.active
+    first.title = 'Ventas'
+    first.append(['Mes', 'Total', None])
+    first.append([None, None])
+    for month in range(1, 6):
+        first.append([month, month * 10])
+    second = wb.create_sheet('Notas')
+    second.append(['Revisado'])
+    path = str(tmp_path / 'libro.xlsx')
+    wb.save(path)
+
+    assert list(iter_xlsx_text(path, max_rows=3)) == [
+        '=== Sheet: Ventas ===', 'Mes | Total', '1 | 10', '2 | 20',
+        '=== Sheet: Notas ===', 'Revisado'
+    ]
+
+
+def test_short_text_is_returned_whole():
+    lines = Lines(['uno', 'dos', 'tres'])
+
+    assert sample_text(lines, max_chars=100) == 'uno\ndos\ntres'
+    assert lines.closed
+
+
+def test_long_text_keeps_head_every_section_and_tail():
+    body = []
+    for sheet in range(1, 6):
+        body.append(f'=== Sheet: Hoja {sheet} ===')
+        body.extend(f'hoja {sheet} fila {row:03d}' for row in range(200))
+    lines = Lines(body)
+
+    text = sample_text(lines, max_chars=2000)
+
+    assert len(text) <= 2000
+    assert text.startswith('=== Sheet: Hoja 1 ===\nhoja 1 fila 000')
+    for sheet in range(2, 6):
+        assert f'=== Sheet: Hoja {sheet} ===\nhoja {sheet} fila 000' in text
+    assert text.endswith('hoja 5 fila 199')
+    assert '[...]' in text
+    assert lines.closed
+
+
+def test_scan_budget_stops_reading():
+    lines = Lines(f'line {number:05d}' for number in range(100_000))
+
+    text = sample_text(lines, max_chars=500, scan_max_chars=12_000)
+
+    assert lines.read == 1091  # 11 characters per line: stopped on the first line past 12,000
+    assert len(text) <= 500
+    assert text.endswith('line 01089')
+    assert lines.closed
+
+
+def test_single_oversized_line_keeps_its_start():
+    text = sample_text(Lines(['x' * 5000, 'after']), max_chars=1000)
+
+    assert text.startswith('x' * 450)
+    assert len(text) <= 1000
@@ -0,0 +1,92 @@
+"""TokenEstimator calibration and fit_document_text budgets"""
+from types import SimpleNamespace
+
+import pytest
+
+import app
+from app import TTLCache, TokenEstimator, fit_document_text
+
+XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+@pytest.fixture
+def count_tokens(monkeypatch):
+    """Fake count_tokens at `tokens.ratio` characters per token; `tokens.error` makes it fail"""
+    fake = SimpleNamespace(calls=[], ratio=2.0, error=None)
+
+    def count(model, contents):
+        fake.calls.append(model)
+        if fake.error:
+            raise fake.error
+        return SimpleNamespace(total_tokens=int(len(contents) / fake.ratio))
+
+    monkeypatch.setattr(app, 'client', SimpleNamespace(models=SimpleNamespace(count_tokens=count)))
+    return fake
+
+
+def test_estimates_use_the_default_ratio_until_calibrated():
+    estimator = TokenEstimator(default_ratio=4.0)
+
+    assert estimator.estimate('x' * 400, 'model') == 101
+    assert estimator.chars_for(1000, 'model') == 4000
+
+
+def test_calibration_runs_once_per_model(count_tokens):
+    estimator = TokenEstimator(min_sample_chars=100)
+
+    assert estimator.calibrate('dense', 'x' * 1000) is True
+    assert estimator.calibrate('dense', 'y' * 1000) is False
+    assert estimator.chars_for(1000, 'dense') == 2000
+    assert estimator.chars_for(1000, 'other') == 4000
+    assert count_tokens.calls == ['dense']
+
+
+def test_close_ratio_does_not_ask_for_a_resample(count_tokens):
+    count_tokens.ratio = 3.8
+
+    assert TokenEstimator(min_sample_chars=100).calibrate('model', 'x' * 1000) is False
+
+
+def test_short_text_failure_and_disabled_calibration_keep_the_default(count_tokens):
+    assert TokenEstimator(min_sample_chars=2000).calibrate('model', 'x' * 100) is False
+    assert TokenEstimator(calibrate=False).calibrate('model', 'x' * 5000) is False
+    assert count_tokens.calls == []
+
+    count_tokens.error = RuntimeError('unavailable')
+    failing = TokenEstimator(min_sample_chars=100)
+    assert failing.calibrate('model', 'x' * 1000) is False
+    assert failing.calibrate('model', 'x' * 1000) is False
+    assert failing.chars_per_token('model') == 4.0
+    assert count_tokens.calls == ['model']
+
+
+def test_document_text_is_resampled_after_calibration(count_tokens, monkeypatch):
+    budgets = []
+
+    def extract_document_text(file_path, mime_type, max_chars):
+        budgets.append(max_chars)
+        return 'x' * max_chars
+
+    monkeypatch.setattr(app, 'extract_document_text', extract_document_text)
+    monkeypatch.setattr(app, 'extraction_cache', TTLCache(10, 60))
+    monkeypatch.setattr(app, 'token_estimator', TokenEstimator(min_sample_chars=100))
+    monkeypatch.setattr(app, 'PROMPT_TOKEN_BUDGETS', {'gemini-pro-test': 1000})
+
+    text = fit_document_text('/tmp/a.xlsx', XLSX, 'gemini-pro-test', 'hash-a')
+
+    assert budgets == [4000, 2000]
+    assert len(text) == 2000
+
+    # Calibrated: the next document is sampled to the right size at once
+    budgets.clear()
+    fit_document_text('/tmp/b.xlsx', XLSX, 'gemini-pro-test', 'hash-b')
+    assert budgets == [2000]
+    assert count_tokens.calls == ['gemini-pro-test']
+
+
+def test_models_without_an_override_use_the_default_budget(monkeypatch):
+    monkeypatch.setattr(app, 'PROMPT_TOKEN_BUDGETS', {'gemini-pro-test': 1000})
+    monkeypatch.setattr(app, 'PROMPT_TOKEN_BUDGET', 3000)
+
+    assert app.prompt_token_budget('gemini-pro-test') == 1000
+    assert app.prompt_token_budget('gemini-flash-test') == 3000
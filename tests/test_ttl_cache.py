@@ -0,0 +1,119 @@
+"""TTLCache: LRU eviction, expiry, store tags and eviction callbacks"""
+import pytest
+
+from app import TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr('app.time.time', fake.time)
+    return fake
+
+
+def test_hit_and_miss_counters():
+    cache = TTLCache(10, 60)
+    cache.set('a', 1)
+
+    assert cache.get('a') == 1
+    assert cache.get('missing') is None
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['hit_rate']) == (1, 1, 0.5)
+
+
+def test_evicts_least_recently_used():
+    cache = TTLCache(2, 60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')  # 'b' is now the least recently used
+    cache.set('c', 3)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache.stats()['entries'] == 2
+
+
+def test_entries_expire(clock):
+    cache = TTLCache(10, 60)
+    cache.set('default', 1)
+    cache.set('short', 2, ttl=5)
+
+    clock.now += 10
+    assert cache.get('short') is None
+    assert cache.get('default') == 1
+
+    clock.now += 60
+    assert cache.get('default') is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_invalidate_store_drops_only_tagged_entries():
+    cache = TTLCache(10, 60)
+    cache.set('a1', 1, store='stores/a')
+    cache.set('a2', 2, store='stores/a')
+    cache.set('b1', 3, store='stores/b')
+    cache.set('untagged', 4)
+
+    assert cache.invalidate_store('stores/a') == 2
+    assert cache.get('a1') is None and cache.get('a2') is None
+    assert cache.get('b1') == 3
+    assert cache.get('untagged') == 4
+    assert cache.invalidate_store('stores/a') == 0
+
+
+def test_replaced_entry_leaves_its_old_store_tag():
+    cache = TTLCache(10, 60)
+    cache.set('key', 1, store='stores/a')
+    cache.set('key', 2, store='stores/b')
+
+    assert cache.invalidate_store('stores/a') == 0
+    assert cache.get('key') == 2
+    assert cache.invalidate_store('stores/b') == 1
+
+
+def test_on_evict_sees_every_value_that_leaves(clock):
+    evicted = []
+    cache = TTLCache(2, 60, on_evict=evicted.append)
+    cache.set('a', 'a1')
+    cache.set('a', 'a2')            # replacement
+    cache.set('b', 'b1', store='s')
+    cache.set('c', 'c1')            # capacity: evicts 'a'
+    cache.invalidate_store('s')     # 'b'
+    cache.set('d', 'd1', ttl=1)
+    clock.now += 5
+    cache.get('d')                  # expiry
+    cache.delete('c')
+
+    assert evicted == ['a1', 'a2', 'b1', 'd1', 'c1']
+
+
+def test_on_evict_errors_are_swallowed():
+    def broken(_):
+        raise RuntimeError('cleanup failed')
+
+    cache = TTLCache(1, 60, on_evict=broken)
+    cache.set('a', 1)
+    cache.set('b', 2)
+
+    assert cache.get('b') == 2
+
+
+def test_clear_empties_everything():
+    evicted = []
+    cache = TTLCache(10, 60, on_evict=evicted.append)
+    cache.set('a', 1, store='s')
+    cache.set('b', 2)
+    cache.clear()
+
+    assert sorted(evicted) == [1, 2]
+    assert cache.stats()['entries'] == 0
+    assert cache.invalidate_store('s') == 0
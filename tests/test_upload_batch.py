@@ -0,0 +1,126 @@
+"""/upload-batch: zip expansion, per-file failures and releasing the upload worker"""
+import hashlib
+import io
+import os
+import tempfile
+import time
+import zipfile
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+import pytest
+
+import app
+
+STORE = 'fileSearchStores/batch-store'
+
+
+@pytest.fixture
+def imports(monkeypatch):
+    """Fake upload start and import tracking.
+
+    `fail_start` / `fail_import` hold filenames whose upload or import fails;
+    with `hold=True` every import stays pending until `release()` is called.
+    """
+    fake = SimpleNamespace(fail_start=set(), fail_import=set(), hold=False, pending=[])
+
+    def start_upload_operation(source, filename, mime_type, upload_config, target_store_name):
+        if filename in fake.fail_start:
+            raise RuntimeError(f'upload rejected: {filename}')
+        if filename in fake.fail_import:
+            operation = SimpleNamespace(error=SimpleNamespace(message='import failed'), response=None)
+        else:
+            operation = SimpleNamespace(error=None, response=SimpleNamespace(name=f'{STORE}/documents/{filename}'))
+        return operation, None
+
+    def track(operation, mime_type=None, timeout=None, **kwargs):
+        future = Future()
+        if fake.hold:
+            fake.pending.append((future, operation))
+        else:
+            future.set_result(operation)
+        return future
+
+    def release():
+        for future, operation in fake.pending:
+            future.set_result(operation)
+
+    fake.release = release
+    monkeypatch.setattr(app, '_start_upload_operation', start_upload_operation)
+    monkeypatch.setattr(app.operation_tracker, 'track', track)
+    yield fake
+    app.forget_content_hashes(store_name=STORE)
+
+
+def _zip(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    buffer.seek(0)
+    return buffer
+
+
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _wait_for_job(client, job_id):
+    for _ in range(200):
+        job = client.get(f'/jobs/{job_id}').get_json()['job']
+        if job['status'] in ('completed', 'failed'):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f'job {job_id} did not finish')
+
+
+def test_zip_members_are_expanded_and_failures_reported_per_file(imports):
+    imports.fail_start.add('broken.txt')
+    imports.fail_import.add('bad.md')
+    client = app.app.test_client()
+
+    response = client.post('/upload-batch', data={
+        'files': [
+            (_zip({'docs/a.txt': 'alpha', 'docs/bad.md': '# bad', 'setup.exe': 'MZ', 'empty.txt': ''}),
+             'corpus.zip'),
+            (io.BytesIO(b'plain file'), 'broken.txt'),
+            (io.BytesIO(b'notes'), 'notes.txt')
+        ],
+        'store_name': STORE
+    }, content_type='multipart/form-data')
+
+    assert response.status_code == 202
+    body = response.get_json()
+    assert body['total'] == 4
+    assert sorted(body['skipped']) == ['empty.txt', 'setup.exe']
+
+    job = _wait_for_job(client, body['job_id'])
+    assert job['status'] == 'completed'
+    result = job['result']
+    assert (result['total'], result['succeeded'], result['failed']) == (4, 2, 2)
+    by_name = {entry['filename']: entry for entry in result['files']}
+    assert by_name['a.txt']['document_id'] == f'{STORE}/documents/a.txt'
+    assert by_name['notes.txt']['success'] is True
+    assert by_name['bad.md']['error'] == 'Upload failed: import failed'
+    assert by_name['broken.txt']['error'] == 'upload rejected: broken.txt'
+    assert app.find_content_hash(STORE, _sha256(b'notes'))['document_id'] == f'{STORE}/documents/notes.txt'
+
+
+def test_worker_is_released_while_imports_run(imports):
+    imports.hold = True
+    batch_dir = tempfile.mkdtemp(prefix='batch_', dir=app.app.config['UPLOAD_FOLDER'])
+    entries = []
+    for name in ('one.txt', 'two.txt'):
+        path = os.path.join(batch_dir, name)
+        with open(path, 'wb') as f:
+            f.write(name.encode())
+        entries.append((path, name, len(name), _sha256(name.encode())))
+    job = app.create_job('upload_batch', store_name=STORE)
+
+    summary = app._process_upload_batch(job['id'], batch_dir, entries, {}, {}, STORE, 2)
+
+    assert isinstance(summary, Future) and not summary.done()
+    assert len(imports.pending) == 2
+    imports.release()
+    assert summary.result(timeout=5)['succeeded'] == 2
+    assert not os.path.exists(batch_dir)
@@ -0,0 +1,141 @@
+"""Content-hash deduplication for /upload and /upload-stream"""
+import hashlib
+import io
+import time
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+import pytest
+
+import app
+
+STORE = 'fileSearchStores/dedup-store'
+DATA = b'the same contract, uploaded twice'
+
+
+@pytest.fixture
+def api(monkeypatch):
+    """Fake direct upload and documents.get; `api.missing` holds documents deleted behind the app's back"""
+    fake = SimpleNamespace(uploads=[], missing=set())
+
+    def upload_to_file_search_store(file, file_search_store_name, config=None):
+        fake.uploads.append(file.read())
+        name = f"{file_search_store_name}/documents/doc-{len(fake.uploads)}"
+        return SimpleNamespace(done=True, error=None, response=SimpleNamespace(name=name))
+
+    def get(name, config=None):
+        if name in fake.missing:
+            raise RuntimeError('404 NOT_FOUND')
+        return SimpleNamespace(name=name)
+
+    def track(operation, mime_type=None, timeout=None, **kwargs):
+        future = Future()
+        future.set_result(operation)
+        return future
+
+    stores = SimpleNamespace(upload_to_file_search_store=upload_to_file_search_store,
+                             documents=SimpleNamespace(get=get))
+    monkeypatch.setattr(app, 'client', SimpleNamespace(file_search_stores=stores))
+    monkeypatch.setattr(app.operation_tracker, 'track', track)
+    yield fake
+    for number in range(1, len(fake.uploads) + 1):
+        app.state.remove_document(f'{STORE}/documents/doc-{number}')
+    app.forget_content_hashes(store_name=STORE)
+
+
+def _upload(client, filename='contract.txt', data=DATA, **form):
+    return client.post('/upload', data=dict(form, file=(io.BytesIO(data), filename), store_name=STORE),
+                       content_type='multipart/form-data')
+
+
+def _upload_and_wait(client, **form):
+    body = _upload(client, **form).get_json()
+    for _ in range(200):
+        job = client.get(body['status_url']).get_json()['job']
+        if job['status'] in ('completed', 'failed'):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"{body['status_url']} did not finish")
+
+
+def _bytes_saved():
+    return app.load_state_value('dedup_bytes_saved', 0)
+
+
+def test_same_content_is_not_uploaded_twice(api):
+    client = app.app.test_client()
+    first = _upload_and_wait(client)
+    saved_before = _bytes_saved()
+
+    response = _upload(client, filename='copy-of-contract.txt')
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['duplicate'] is True
+    assert body['document_id'] == first['result']['document_id']
+    assert body['existing_filename'] == 'contract.txt'
+    assert body['bytes_saved'] == len(DATA)
+    assert body['metadata_updated'] is False
+    assert len(api.uploads) == 1
+    assert _bytes_saved() == saved_before + len(DATA)
+
+
+def test_duplicate_can_update_the_existing_metadata(api):
+    client = app.app.test_client()
+    document_id = _upload_and_wait(client, metadata='{"tipo": "contrato"}')['result']['document_id']
+
+    body = _upload(client, metadata='{"año": "2024"}', on_duplicate='update_metadata').get_json()
+
+    assert body['duplicate'] is True and body['metadata_updated'] is True
+    assert app.state.local_metadata(document_id) == {'tipo': 'contrato', 'año': '2024'}
+    assert len(api.uploads) == 1
+
+
+def test_on_duplicate_upload_forces_a_new_import(api):
+    client = app.app.test_client()
+    _upload_and_wait(client)
+
+    job = _upload_and_wait(client, on_duplicate='upload')
+
+    assert job['status'] == 'completed'
+    assert len(api.uploads) == 2
+
+
+def test_stale_hash_is_dropped_and_the_file_uploaded(api):
+    client = app.app.test_client()
+    document_id = _upload_and_wait(client)['result']['document_id']
+    api.missing.add(document_id)
+
+    job = _upload_and_wait(client)
+
+    assert job['result']['document_id'] != document_id
+    assert len(api.uploads) == 2
+
+
+def test_upload_stream_checks_the_claimed_hash(api):
+    client = app.app.test_client()
+    _upload_and_wait(client)
+    sha256 = hashlib.sha256(DATA).hexdigest()
+
+    def stream(data):
+        return client.post('/upload-stream?filename=contract.txt', data=data,
+                           headers={'X-Store-Name': STORE, 'X-Content-SHA256': sha256})
+
+    duplicate = stream(DATA)
+    assert duplicate.status_code == 200
+    assert duplicate.get_json()['duplicate'] is True
+
+    forged = stream(b'different bytes claiming the same hash')
+    assert forged.status_code == 400
+    assert len(api.uploads) == 1
+
+
+def test_storage_usage_reports_bytes_saved(api, monkeypatch):
+    client = app.app.test_client()
+    _upload_and_wait(client)
+    _upload(client)
+    monkeypatch.setattr(app, 'get_store_catalog', lambda refresh=False: [])
+
+    body = client.get('/storage-usage').get_json()
+
+    assert body['dedup_bytes_saved'] == _bytes_saved() >= len(DATA)
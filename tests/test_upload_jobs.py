@@ -0,0 +1,100 @@
+"""/upload: 202 with a job ID, then the result through GET /jobs/<job_id>"""
+import io
+import time
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+import pytest
+
+import app
+
+STORE = 'fileSearchStores/upload-store'
+
+
+@pytest.fixture
+def api(monkeypatch):
+    """Fake direct upload; `api.error` makes the import operation fail"""
+    fake = SimpleNamespace(error=None, uploads=[])
+
+    def upload_to_file_search_store(file, file_search_store_name, config=None):
+        fake.uploads.append((file.read(), file_search_store_name, config))
+        name = f"{file_search_store_name}/documents/{config['display_name']}"
+        error = SimpleNamespace(message=fake.error) if fake.error else None
+        return SimpleNamespace(done=True, error=error, response=SimpleNamespace(name=name))
+
+    def track(operation, mime_type=None, timeout=None, **kwargs):
+        future = Future()
+        future.set_result(operation)
+        return future
+
+    stores = SimpleNamespace(upload_to_file_search_store=upload_to_file_search_store)
+    monkeypatch.setattr(app, 'client', SimpleNamespace(file_search_stores=stores))
+    monkeypatch.setattr(app.operation_tracker, 'track', track)
+    yield fake
+    app.forget_content_hashes(store_name=STORE)
+
+
+def _upload(client, data, filename='report.txt', **form):
+    return client.post('/upload', data=dict(form, file=(io.BytesIO(data), filename), store_name=STORE),
+                       content_type='multipart/form-data')
+
+
+def _wait_for_job(client, status_url):
+    for _ in range(200):
+        job = client.get(status_url).get_json()['job']
+        if job['status'] in ('completed', 'failed'):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f'{status_url} did not finish')
+
+
+def test_upload_returns_a_job_and_completes(api):
+    client = app.app.test_client()
+
+    response = _upload(client, b'quarterly numbers', metadata='{"tipo": "informe"}')
+
+    assert response.status_code == 202
+    body = response.get_json()
+    assert body['status'] == 'queued' and body['status_url'] == f"/jobs/{body['job_id']}"
+    assert body['file_size'] == len(b'quarterly numbers')
+
+    job = _wait_for_job(client, body['status_url'])
+    assert job['status'] == 'completed' and job['type'] == 'upload'
+    assert job['result']['document_id'] == f'{STORE}/documents/report.txt'
+    assert job['result']['mime_type'] == 'text/plain'
+    assert api.uploads[0][0] == b'quarterly numbers'
+    assert app.state.local_metadata(f'{STORE}/documents/report.txt') == {'tipo': 'informe'}
+    app.state.remove_document(f'{STORE}/documents/report.txt')
+
+
+def test_failed_import_is_reported_on_the_job(api):
+    api.error = 'unsupported content'
+    client = app.app.test_client()
+
+    body = _upload(client, b'broken bytes', 'broken.txt').get_json()
+
+    job = _wait_for_job(client, body['status_url'])
+    assert job['status'] == 'failed'
+    assert 'unsupported content' in job['error']
+
+
+def test_unknown_job_is_404():
+    response = app.app.test_client().get('/jobs/does-not-exist')
+
+    assert response.status_code == 404
+
+
+def test_full_queue_is_rejected(api, monkeypatch):
+    monkeypatch.setattr(app, 'MAX_PENDING_JOBS', 0)
+
+    response = _upload(app.app.test_client(), b'one more file')
+
+    assert response.status_code == 503
+    assert api.uploads == []
+
+
+def test_unsupported_type_is_rejected_before_queueing(api):
+    response = _upload(app.app.test_client(), b'MZ', 'setup.exe')
+
+    assert response.status_code == 400
+    assert api.uploads == []
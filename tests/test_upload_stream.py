@@ -0,0 +1,145 @@
+"""Spooled /upload buffers, RequestBodyStream and /upload-stream"""
+import hashlib
+import io
+import os
+import time
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+import pytest
+
+import app
+from app import RequestBodyStream
+
+STORE = 'fileSearchStores/stream-store'
+
+
+@pytest.fixture
+def api(monkeypatch):
+    """Fake direct upload that records what the SDK would be handed"""
+    fake = SimpleNamespace(uploads=[])
+
+    def upload_to_file_search_store(file, file_search_store_name, config=None):
+        rolled = getattr(file, '_rolled', None)
+        fake.uploads.append(SimpleNamespace(source=file, rolled=rolled, data=file.read(), config=config))
+        name = f"{file_search_store_name}/documents/{config['display_name']}"
+        return SimpleNamespace(done=True, error=None, response=SimpleNamespace(name=name))
+
+    def track(operation, mime_type=None, timeout=None, **kwargs):
+        future = Future()
+        future.set_result(operation)
+        return future
+
+    stores = SimpleNamespace(upload_to_file_search_store=upload_to_file_search_store)
+    monkeypatch.setattr(app, 'client', SimpleNamespace(file_search_stores=stores))
+    monkeypatch.setattr(app.operation_tracker, 'track', track)
+    yield fake
+    for upload in fake.uploads:
+        app.state.remove_document(f"{STORE}/documents/{upload.config['display_name']}")
+    app.forget_content_hashes(store_name=STORE)
+
+
+class Trickle:
+    """Request stream that returns at most `step` bytes per read, like a slow socket"""
+
+    def __init__(self, data, step):
+        self._data = io.BytesIO(data)
+        self._step = step
+
+    def read(self, size=-1):
+        return self._data.read(min(size, self._step))
+
+
+def _wait_for_job(client, status_url):
+    for _ in range(200):
+        job = client.get(status_url).get_json()['job']
+        if job['status'] in ('completed', 'failed'):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f'{status_url} did not finish')
+
+
+def _upload(client, data, filename):
+    return client.post('/upload', data={'file': (io.BytesIO(data), filename), 'store_name': STORE},
+                       content_type='multipart/form-data')
+
+
+def test_small_upload_is_streamed_from_memory(api):
+    client = app.app.test_client()
+    before = set(os.listdir(app.app.config['UPLOAD_FOLDER']))
+
+    body = _upload(client, b'id,total\n1,10\n', 'sales.csv').get_json()
+    assert _wait_for_job(client, body['status_url'])['status'] == 'completed'
+
+    upload = api.uploads[0]
+    assert upload.rolled is False
+    assert upload.data == b'id,total\n1,10\n'
+    assert upload.config['mime_type'] == 'text/csv'
+    assert upload.source.closed
+    assert set(os.listdir(app.app.config['UPLOAD_FOLDER'])) == before
+
+
+def test_large_upload_rolls_over_to_an_anonymous_temp_file(api, monkeypatch):
+    monkeypatch.setattr(app, 'UPLOAD_SPOOL_THRESHOLD', 16)
+    client = app.app.test_client()
+    data = b'x' * 1000
+    before = set(os.listdir(app.app.config['UPLOAD_FOLDER']))
+
+    body = _upload(client, data, 'big.txt').get_json()
+    assert _wait_for_job(client, body['status_url'])['status'] == 'completed'
+
+    assert api.uploads[0].rolled is True
+    assert api.uploads[0].data == data
+    assert set(os.listdir(app.app.config['UPLOAD_FOLDER'])) == before
+    assert app.find_content_hash(STORE, hashlib.sha256(data).hexdigest()) is not None
+
+
+def test_request_body_stream_answers_the_size_probe_and_fills_chunks():
+    data = bytes(range(256)) * 4
+    body = RequestBodyStream(Trickle(data, 7), len(data))
+
+    assert body.seek(0, io.SEEK_END) == len(data)
+    assert body.tell() == len(data)
+    assert body.seek(0) == 0
+    assert body.content_hash() is None
+
+    chunks = []
+    while True:
+        chunk = body.read(100)
+        if not chunk:
+            break
+        chunks.append(chunk)
+
+    assert [len(chunk) for chunk in chunks] == [100] * 10 + [24]
+    assert b''.join(chunks) == data
+    assert body.content_hash() == hashlib.sha256(data).hexdigest()
+    with pytest.raises(io.UnsupportedOperation):
+        body.seek(0)
+
+
+def test_upload_stream_forwards_the_raw_body(api):
+    client = app.app.test_client()
+    data = b'# Notes\n\nstreamed straight through'
+
+    response = client.post('/upload-stream?filename=notes.md', data=data, headers={
+        'X-Store-Name': STORE, 'X-Metadata': '{"tipo": "nota"}', 'Content-Type': 'application/octet-stream'
+    })
+
+    assert response.status_code == 202
+    body = response.get_json()
+    assert body['file_size'] == len(data)
+    job = _wait_for_job(client, body['status_url'])
+    assert job['status'] == 'completed'
+    assert isinstance(api.uploads[0].source, RequestBodyStream)
+    assert api.uploads[0].data == data
+    assert api.uploads[0].config['mime_type'] == 'text/markdown'
+    assert app.state.local_metadata(job['result']['document_id']) == {'tipo': 'nota'}
+
+
+def test_upload_stream_validation(api):
+    client = app.app.test_client()
+
+    assert client.post('/upload-stream', data=b'abc').status_code == 400
+    assert client.post('/upload-stream?filename=setup.exe', data=b'MZ').status_code == 400
+    assert client.post('/upload-stream?filename=empty.txt', data=b'').status_code == 411
+    assert api.uploads == []
@@ -1,16 +1,33 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Request, Response, request, jsonify, render_template, stream_with_context
 from flask_cors import CORS
 from google import genai
 from google.genai import types
+import io
 import os
 import time
 import json
+import hashlib
+import heapq
+import sqlite3
+import random
+import uuid
+import shutil
+import tempfile
+import threading
+import zipfile
+from xml.etree import ElementTree
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait as wait_futures
+from concurrent.futures import TimeoutError as FuturesTimeoutError
 from dotenv import load_dotenv
 from werkzeug.utils import secure_filename
 import logging
+import click
 import mimetypes
 import requests as http_requests
-from docx import Document as DocxDocument
+from requests.adapters import HTTPAdapter
+from urllib.parse import urljoin
+from urllib3.exceptions import HTTPError as Urllib3HTTPError
 from openpyxl import load_workbook
 
 # Load environment variables
@@ -47,7 +64,60 @@ ALLOWED_EXTENSIONS = {
     'zip'
 }
 MAX_FILE_SIZE = 100 * 1024 * 1024  # 100MB
+UPLOAD_SPOOL_THRESHOLD = int(os.getenv('UPLOAD_SPOOL_THRESHOLD', str(8 * 1024 * 1024)))  # Uploads kept in memory below this size
 MAX_HISTORY = 7  # Conversation history limit - Límite de historial de conversación
+CHAT_MAX_SESSIONS = int(os.getenv('CHAT_MAX_SESSIONS', '10000'))  # Sessions kept in memory
+CHAT_MAX_HISTORY_BYTES = int(os.getenv('CHAT_MAX_HISTORY_BYTES', str(64 * 1024 * 1024)))  # Total history bytes in memory
+CHAT_SESSION_TTL = int(os.getenv('CHAT_SESSION_TTL', str(6 * 3600)))  # Idle session expiry in seconds
+CHAT_SESSION_SPILL = os.getenv('CHAT_SESSION_SPILL', 'false').lower() == 'true'  # Spill evicted sessions to SQLite
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', '1000'))  # Cached chat answers
+RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', '3600'))  # Seconds a cached answer stays valid
+CATALOG_CACHE_TTL = int(os.getenv('CATALOG_CACHE_TTL', '300'))  # Seconds store/document listings stay cached
+CATALOG_CACHE_SIZE = int(os.getenv('CATALOG_CACHE_SIZE', '256'))  # Cached listings (one per store + store list)
+RETRIEVAL_CACHE_SIZE = int(os.getenv('RETRIEVAL_CACHE_SIZE', '2000'))  # Cached documents.query results
+RETRIEVAL_CACHE_TTL = int(os.getenv('RETRIEVAL_CACHE_TTL', '600'))  # Seconds a retrieval result stays valid
+CATALOG_MAX_PAGE_SIZE = 1000  # Upper bound for page_size on listing endpoints
+CATALOG_FETCH_WORKERS = int(os.getenv('CATALOG_FETCH_WORKERS', '8'))  # Stores listed concurrently
+CATALOG_FETCH_TIMEOUT = int(os.getenv('CATALOG_FETCH_TIMEOUT', '60'))  # Seconds one store's documents may take, from the start of its fetch
+EXTRACTION_CACHE_SIZE = int(os.getenv('EXTRACTION_CACHE_SIZE', '256'))  # Extracted texts cached by content hash
+STORE_QUERY_WORKERS = int(os.getenv('STORE_QUERY_WORKERS', '16'))  # Concurrent documents.query calls (all requests)
+STORE_QUERY_MAX_DOCUMENTS = int(os.getenv('STORE_QUERY_MAX_DOCUMENTS', '500'))  # Documents one /store-query may fan out to
+STORE_QUERY_TIMEOUT = int(os.getenv('STORE_QUERY_TIMEOUT', '30'))  # Seconds to wait for all document queries
+FILE_HANDLE_CACHE_SIZE = int(os.getenv('FILE_HANDLE_CACHE_SIZE', '32'))  # Files API uploads kept for re-analysis
+FILE_HANDLE_CACHE_TTL = int(os.getenv('FILE_HANDLE_CACHE_TTL', str(6 * 3600)))  # Seconds an upload is reused (capped by its expiry)
+UPLOAD_WORKERS = int(os.getenv('UPLOAD_WORKERS', '8'))  # Upload worker pool size - Tamaño del pool de subidas
+MAX_PENDING_JOBS = int(os.getenv('MAX_PENDING_JOBS', '500'))  # Queued + running jobs limit
+JOB_RETENTION_SECONDS = 3600  # Finished jobs are kept for 1 hour - Retención de trabajos terminados
+UPLOAD_OPERATION_TIMEOUT = int(os.getenv('UPLOAD_OPERATION_TIMEOUT', '120'))  # Minimum seconds to wait for File Search import - Timeout de importación
+UPLOAD_TIMEOUT_PER_MB = float(os.getenv('UPLOAD_TIMEOUT_PER_MB', '3'))  # Extra import wait per MB of file
+BATCH_MAX_PARALLELISM = int(os.getenv('BATCH_MAX_PARALLELISM', '8'))  # Concurrent uploads per batch
+BATCH_MAX_FILES = int(os.getenv('BATCH_MAX_FILES', '2000'))  # Files per batch request
+URL_IMPORT_WORKERS = int(os.getenv('URL_IMPORT_WORKERS', '16'))  # Concurrent downloads per /import-urls job
+URL_IMPORT_PER_HOST = int(os.getenv('URL_IMPORT_PER_HOST', '4'))  # Concurrent downloads from one host
+URL_IMPORT_MAX_URLS = int(os.getenv('URL_IMPORT_MAX_URLS', '1000'))  # URLs per /import-urls request
+URL_DOWNLOAD_RETRIES = int(os.getenv('URL_DOWNLOAD_RETRIES', '3'))  # Resumes after a dropped connection
+URL_DOWNLOAD_TIMEOUT = 120  # Seconds to wait for a URL to respond (connect / between reads)
+URL_MAX_REDIRECTS = 5  # Redirect hops followed (each one re-validated) per download
+URL_CHUNK_MIN = 64 * 1024  # Adaptive download chunk bounds
+URL_CHUNK_MAX = 4 * 1024 * 1024
+SYNC_ROOT = os.getenv('SYNC_ROOT', '')  # Directory /sync may read from (empty = endpoint disabled)
+INVESTIGATION_WORKERS = int(os.getenv('INVESTIGATION_WORKERS', '2'))  # Investigations running at the same time
+INVESTIGATION_MAX_PARALLELISM = int(os.getenv('INVESTIGATION_MAX_PARALLELISM', '4'))  # Concurrent questions per investigation
+ENRICH_MAX_PARALLELISM = int(os.getenv('ENRICH_MAX_PARALLELISM', '8'))  # Concurrent analyses per enrichment job
+ENRICH_CHECKPOINT_EVERY = int(os.getenv('ENRICH_CHECKPOINT_EVERY', '25'))  # Results written back per checkpoint
+GEMINI_BATCH_MAX_REQUESTS = int(os.getenv('GEMINI_BATCH_MAX_REQUESTS', '500'))  # Requests packed into one Batch API job
+GEMINI_BATCH_TIMEOUT = int(os.getenv('GEMINI_BATCH_TIMEOUT', str(48 * 3600)))  # Seconds to wait for a batch job
+GEMINI_BATCH_POLL_INTERVAL = int(os.getenv('GEMINI_BATCH_POLL_INTERVAL', '120'))  # Max seconds between batch status checks
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', '3000'))  # Tokens of document text per analysis prompt
+PROMPT_TOKEN_BUDGETS = {  # Per-model overrides, e.g. "gemini-2.5-pro:8000,gemini-3-flash-preview:4000"
+    model.strip(): int(tokens)
+    for model, _, tokens in (item.partition(':') for item in os.getenv('PROMPT_TOKEN_BUDGETS', '').split(','))
+    if model.strip() and tokens.strip()
+}
+TOKEN_COUNT_CALIBRATION = os.getenv('TOKEN_COUNT_CALIBRATION', 'true').lower() == 'true'  # Learn chars/token per model via count_tokens
+GEMINI_RPM = int(os.getenv('GEMINI_RPM', '0'))  # Requests per minute shared by chat, metadata, investigation and enrichment calls (0 = unlimited)
+GEMINI_BURST = int(os.getenv('GEMINI_BURST', '4'))  # Requests allowed back to back before GEMINI_RPM applies
+GEMINI_MAX_RETRIES = int(os.getenv('GEMINI_MAX_RETRIES', '4'))  # Retries on 429 / 5xx
 
 # Complete MIME type mapping for Gemini File Search API
 # Based on official documentation: https://ai.google.dev/gemini-api/docs/file-search
@@ -140,6 +210,40 @@ MIME_TYPE_MAPPING = {
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE
 
+
+class HashingSpooledFile(tempfile.SpooledTemporaryFile):
+    """SpooledTemporaryFile that hashes (SHA-256) everything written to it"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self._sha256.update(data)
+        return super().write(data)
+
+    def content_hash(self):
+        return self._sha256.hexdigest()
+
+
+class SpooledUploadRequest(Request):
+    """Request that buffers multipart file parts in a SpooledTemporaryFile.
+
+    Parts stay in memory up to UPLOAD_SPOOL_THRESHOLD bytes and roll over
+    to an anonymous, uniquely named temp file in UPLOAD_FOLDER beyond that,
+    so the upload worker can stream them to the API without a second copy
+    on disk and concurrent uploads of the same filename never collide. The
+    content hash used for deduplication is computed while the part arrives.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingSpooledFile(
+            max_size=UPLOAD_SPOOL_THRESHOLD, prefix='upload-', dir=app.config['UPLOAD_FOLDER']
+        )
+
+
+app.request_class = SpooledUploadRequest
+
 # Ensure upload folder exists
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
@@ -151,74 +255,1199 @@ if not api_key:
 client = genai.Client(api_key=api_key)
 
 # Global state management - Gestión de estado global
-conversation_history = []
-file_search_store = None
-uploaded_files = []  # Track uploaded files with metadata
-PERSISTENCE_FILE = 'store_state.json'
+PERSISTENCE_FILE = 'store_state.json'  # Legacy JSON state, migrated to SQLite on first start
+DATABASE_FILE = os.getenv('STATE_DATABASE', 'store_state.db')
+
+
+class AppState:
+    """Thread-safe holder for the active store and tracked files.
+
+    Every mutation happens under one re-entrant lock together with its
+    persistence write, so concurrent request threads cannot lose entries or
+    persist a half-updated state. Tracked files live in an insertion-ordered
+    registry with secondary indexes by document ID and metadata key, so
+    lookups, metadata edits and deletes are O(1) per document.
+    Entries are never mutated in place: edits swap in a new dict, so
+    snapshots handed to readers stay consistent.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._store = None
+        self._reset_files(())
+
+    # ---- Active store ----
+
+    @property
+    def store(self):
+        """Current File Search store object, or None"""
+        return self._store
+
+    @property
+    def store_name(self):
+        store = self._store
+        return store.name if store else None
+
+    def ensure_store(self, create):
+        """Return the current store, calling create() once if there is none"""
+        with self._lock:
+            if self._store is None:
+                self._store = create()
+                save_state()
+            return self._store
+
+    def set_store(self, store, files=()):
+        """Switch the active store and replace the tracked file list.
+
+        Enrichment metadata saved for the new store (see record_enrichments)
+        is merged back into its tracked files.
+        """
+        with self._lock:
+            self._store = store
+            self._reset_files(files)
+            save_state()
+            enriched = load_enrichment_metadata(store.name) if store else {}
+            if enriched:
+                self.merge_metadata(enriched, store.name)
+
+    def restore(self, store, files):
+        """Load state read from persistence (no write back)"""
+        with self._lock:
+            self._store = store
+            self._reset_files(files)
+
+    def clear_store(self, store_name=None):
+        """Forget the active store (only if it matches store_name, when given)"""
+        with self._lock:
+            if self._store is None or (store_name and self._store.name != store_name):
+                return False
+            self._store = None
+            self._reset_files(())
+            save_state()
+            return True
+
+    # ---- Registry and indexes (caller holds the lock) ----
+
+    def _reset_files(self, files):
+        self._entries = {}  # entry key -> file_info, in insertion order
+        self._next_key = 0
+        self._by_document = {}  # document_id -> {entry key: file_info}
+        self._by_metadata_key = {}  # metadata key -> set of entry keys
+        self._snapshot = ()
+        for file_info in files:
+            self._insert(file_info)
+
+    def _insert(self, file_info):
+        entry_key = self._next_key
+        self._next_key += 1
+        self._entries[entry_key] = file_info
+        self._index(entry_key, file_info)
+
+    def _delete(self, entry_key):
+        file_info = self._entries.pop(entry_key)
+        self._unindex(entry_key, file_info)
+        return file_info
+
+    def _replace(self, entry_key, file_info):
+        """Swap an entry for an edited copy, keeping its position"""
+        self._unindex(entry_key, self._entries[entry_key])
+        self._entries[entry_key] = file_info
+        self._index(entry_key, file_info)
+
+    def _index(self, entry_key, file_info):
+        if file_info.get('document_id'):
+            self._by_document.setdefault(file_info['document_id'], {})[entry_key] = file_info
+        for key in file_info.get('custom_metadata') or {}:
+            self._by_metadata_key.setdefault(key, set()).add(entry_key)
+        self._snapshot = None
+
+    def _unindex(self, entry_key, file_info):
+        bucket = self._by_document.get(file_info.get('document_id'))
+        if bucket is not None:
+            bucket.pop(entry_key, None)
+            if not bucket:
+                del self._by_document[file_info['document_id']]
+        for key in file_info.get('custom_metadata') or {}:
+            keys = self._by_metadata_key.get(key)
+            if keys is not None:
+                keys.discard(entry_key)
+                if not keys:
+                    del self._by_metadata_key[key]
+        self._snapshot = None
+
+    # ---- Tracked files ----
+
+    def files(self):
+        """Snapshot of the tracked files"""
+        with self._lock:
+            if self._snapshot is None:
+                self._snapshot = tuple(self._entries.values())
+            return list(self._snapshot)
+
+    def file_count(self):
+        return len(self._entries)
+
+    def add_files(self, files):
+        """Track and persist new files"""
+        files = list(files)
+        with self._lock:
+            persist_files(files)
+            for file_info in files:
+                self._insert(file_info)
+
+    def add_file(self, file_info):
+        self.add_files([file_info])
+
+    def remove_file_at(self, index):
+        """Stop tracking the file at index; returns it, or None if out of range"""
+        with self._lock:
+            if index < 0 or index >= len(self._entries):
+                return None
+            entry_key = list(self._entries)[index]
+            delete_persisted_file(self._entries[entry_key])
+            return self._delete(entry_key)
+
+    def remove_document(self, document_id):
+        """Stop tracking every entry for a document; returns the removed count"""
+        with self._lock:
+            entry_keys = list(self._by_document.get(document_id, ()))
+            for entry_key in entry_keys:
+                delete_persisted_file(self._delete(entry_key))
+            return len(entry_keys)
+
+    def find_file(self, document_id):
+        """Tracked entry for a document, or None"""
+        with self._lock:
+            bucket = self._by_document.get(document_id)
+            return next(iter(bucket.values()), None) if bucket else None
+
+    def local_metadata(self, document_id):
+        """Locally edited metadata of a document, or None if untracked"""
+        file_info = self.find_file(document_id)
+        return file_info.get('custom_metadata') or {} if file_info is not None else None
+
+    def metadata_keys(self):
+        """Metadata keys used by at least one tracked file"""
+        with self._lock:
+            return sorted(self._by_metadata_key)
+
+    def documents_with_metadata_key(self, key):
+        """Document IDs of tracked files that define a metadata key"""
+        with self._lock:
+            return {
+                self._entries[entry_key].get('document_id')
+                for entry_key in self._by_metadata_key.get(key, ())
+            } - {None}
+
+    def update_metadata(self, document_id, metadata):
+        """Replace the local metadata of a document, tracking it if unknown"""
+        now = time.strftime('%Y-%m-%d %H:%M:%S')
+        with self._lock:
+            bucket = self._by_document.get(document_id)
+            if bucket:
+                entry_key, file_info = next(iter(bucket.items()))
+                updated = dict(file_info, custom_metadata=metadata, metadata_updated_at=now)
+                persist_file_metadata(updated)
+                self._replace(entry_key, updated)
+                return updated
+
+            # If not found in tracked files, add new entry
+            file_info = {
+                'document_id': document_id,
+                'custom_metadata': metadata,
+                'metadata_updated_at': now
+            }
+            persist_file(file_info)
+            self._insert(file_info)
+            return file_info
+
+    def merge_metadata(self, updates, store_name=None):
+        """Merge metadata into many documents at once (one transaction).
+
+        Args:
+            updates (dict): document_id -> metadata; new keys override existing ones
+            store_name (str, optional): Store the documents belong to; nothing
+                is merged unless it is the active store
+
+        Returns:
+            bool: False if store_name is not the active store
+        """
+        now = time.strftime('%Y-%m-%d %H:%M:%S')
+        with self._lock:
+            if store_name and store_name != self.store_name:
+                return False
+            changed = []
+            for document_id, metadata in updates.items():
+                bucket = self._by_document.get(document_id)
+                if bucket:
+                    entry_key, file_info = next(iter(bucket.items()))
+                    merged = {**(file_info.get('custom_metadata') or {}), **metadata}
+                    changed.append((entry_key, dict(file_info, custom_metadata=merged, metadata_updated_at=now)))
+                else:
+                    changed.append((None, {
+                        'document_id': document_id,
+                        'custom_metadata': dict(metadata),
+                        'metadata_updated_at': now
+                    }))
+            persist_files_metadata([file_info for _, file_info in changed])
+            for entry_key, file_info in changed:
+                if entry_key is None:
+                    self._insert(file_info)
+                else:
+                    self._replace(entry_key, file_info)
+            return True
+
+
+state = AppState()
+
 
 # ============================================
 # STATE PERSISTENCE FUNCTIONS - Funciones de persistencia de estado
+# SQLite (WAL mode): one row per file, metadata entry and investigation
 # ============================================
 
+_db_local = threading.local()  # One connection per thread
+_db_init_lock = threading.Lock()
+_db_initialized = False
+
+DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    document_id TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_files_document_id ON files(document_id);
+CREATE TABLE IF NOT EXISTS file_metadata (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    key TEXT NOT NULL,
+    value TEXT,
+    PRIMARY KEY (file_id, key)
+);
+CREATE TABLE IF NOT EXISTS investigations (
+    id TEXT PRIMARY KEY,
+    created_at TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_investigations_created_at ON investigations(created_at);
+CREATE TABLE IF NOT EXISTS content_hashes (
+    store_name TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    document_id TEXT NOT NULL,
+    filename TEXT,
+    size INTEGER,
+    PRIMARY KEY (store_name, sha256)
+);
+CREATE INDEX IF NOT EXISTS idx_content_hashes_document_id ON content_hashes(document_id);
+CREATE TABLE IF NOT EXISTS url_sources (
+    store_name TEXT NOT NULL,
+    url TEXT NOT NULL,
+    document_id TEXT NOT NULL,
+    filename TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    sha256 TEXT,
+    metadata TEXT,
+    chunking_config TEXT,
+    checked_at REAL,
+    PRIMARY KEY (store_name, url)
+);
+CREATE INDEX IF NOT EXISTS idx_url_sources_document_id ON url_sources(document_id);
+CREATE TABLE IF NOT EXISTS sync_manifest (
+    store_name TEXT NOT NULL,
+    source TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER,
+    mtime_ns INTEGER,
+    sha256 TEXT,
+    document_id TEXT,
+    synced_at REAL,
+    PRIMARY KEY (store_name, source, path)
+);
+CREATE INDEX IF NOT EXISTS idx_sync_manifest_document_id ON sync_manifest(document_id);
+CREATE TABLE IF NOT EXISTS enrichments (
+    store_name TEXT NOT NULL,
+    document_id TEXT NOT NULL,
+    schema_hash TEXT NOT NULL,
+    model TEXT,
+    enriched_at REAL,
+    metadata TEXT,
+    PRIMARY KEY (store_name, document_id)
+);
+CREATE INDEX IF NOT EXISTS idx_enrichments_document_id ON enrichments(document_id);
+CREATE TABLE IF NOT EXISTS chat_sessions (
+    session_id TEXT PRIMARY KEY,
+    messages TEXT NOT NULL,
+    updated_at REAL
+);
+"""
+
+
+def _db():
+    """Return this thread's SQLite connection, creating the schema on first use"""
+    conn = getattr(_db_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(DATABASE_FILE, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA foreign_keys=ON')
+        _db_local.conn = conn
+        _init_database(conn)
+    return conn
+
+
+def _init_database(conn):
+    """Create tables and run the one-time JSON migration (once per process)"""
+    global _db_initialized
+    with _db_init_lock:
+        if _db_initialized:
+            return
+        conn.executescript(DB_SCHEMA)
+        _add_missing_columns(conn)
+        _migrate_json_state(conn)
+        _db_initialized = True
+
+
+def _add_missing_columns(conn):
+    """Add columns introduced after a table was first created"""
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(enrichments)')}
+    if 'metadata' not in columns:
+        conn.execute('ALTER TABLE enrichments ADD COLUMN metadata TEXT')
+
+
+def _migrate_json_state(conn):
+    """Import a legacy store_state.json into the database - Migración única desde JSON
+
+    Runs only when the database has no settings or files yet. The JSON file
+    is renamed to store_state.json.migrated afterwards.
+    """
+    if not os.path.exists(PERSISTENCE_FILE):
+        return
+    has_rows = conn.execute(
+        'SELECT EXISTS(SELECT 1 FROM settings) OR EXISTS(SELECT 1 FROM files)'
+    ).fetchone()[0]
+    if has_rows:
+        return
+
+    try:
+        with open(PERSISTENCE_FILE, 'r') as f:
+            legacy = json.load(f)
+    except Exception as e:
+        logger.error(f"Could not read {PERSISTENCE_FILE} for migration: {e}")
+        return
+
+    with conn:
+        for file_info in legacy.pop('uploaded_files', []) or []:
+            _insert_file(conn, file_info)
+        for investigation in legacy.pop('investigations', []) or []:
+            _upsert_investigation(conn, investigation)
+        for key, value in legacy.items():
+            conn.execute(
+                'INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)',
+                (key, json.dumps(value))
+            )
+
+    os.replace(PERSISTENCE_FILE, PERSISTENCE_FILE + '.migrated')
+    logger.info(f"Migrated {PERSISTENCE_FILE} to SQLite database {DATABASE_FILE}")
+
+
+def _insert_file(conn, file_info):
+    """Insert a file row plus its metadata rows; sets file_info['file_id']"""
+    data = {k: v for k, v in file_info.items() if k not in ('custom_metadata', 'file_id')}
+    cursor = conn.execute(
+        'INSERT INTO files (document_id, data) VALUES (?, ?)',
+        (file_info.get('document_id'), json.dumps(data))
+    )
+    file_info['file_id'] = cursor.lastrowid
+    _write_file_metadata(conn, file_info)
+
+
+def _write_file_metadata(conn, file_info):
+    """Replace the metadata rows of one file"""
+    conn.execute('DELETE FROM file_metadata WHERE file_id = ?', (file_info['file_id'],))
+    conn.executemany(
+        'INSERT INTO file_metadata (file_id, key, value) VALUES (?, ?, ?)',
+        [(file_info['file_id'], key, json.dumps(value))
+         for key, value in (file_info.get('custom_metadata') or {}).items()]
+    )
+
+
+def _upsert_investigation(conn, investigation):
+    conn.execute(
+        'INSERT OR REPLACE INTO investigations (id, created_at, data) VALUES (?, ?, ?)',
+        (investigation['id'], investigation.get('created_at', ''), json.dumps(investigation))
+    )
+
+
+def _load_files(conn):
+    """Load all tracked files in insertion order, with their metadata"""
+    files = {}
+    for file_id, data in conn.execute('SELECT id, data FROM files ORDER BY id'):
+        file_info = json.loads(data)
+        file_info['custom_metadata'] = {}
+        file_info['file_id'] = file_id
+        files[file_id] = file_info
+    for file_id, key, value in conn.execute(
+            'SELECT file_id, key, value FROM file_metadata ORDER BY rowid'):
+        if file_id in files:
+            files[file_id]['custom_metadata'][key] = json.loads(value)
+    return list(files.values())
+
+
 def load_state():
-    """Load persisted state from JSON file on startup - Cargar estado persistido desde archivo JSON"""
-    global file_search_store, uploaded_files
+    """Load persisted state from the database on startup - Cargar estado persistido"""
     try:
-        if os.path.exists(PERSISTENCE_FILE):
-            with open(PERSISTENCE_FILE, 'r') as f:
-                state = json.load(f)
-                store_name = state.get('store_name')
-                uploaded_files = state.get('uploaded_files', [])
+        conn = _db()
+        store_name = load_state_value('store_name')
+        files = _load_files(conn)
+        operation_tracker.seed_latencies(files)
 
-                if store_name:
-                    # Verify the store still exists
-                    try:
-                        file_search_store = client.file_search_stores.get(name=store_name)
-                        logger.info(f"Restored file search store: {store_name} with {len(uploaded_files)} files")
-                    except Exception as e:
-                        logger.warning(f"Stored file search store not found: {e}")
-                        file_search_store = None
-                        uploaded_files = []
+        if store_name:
+            # Verify the store still exists
+            try:
+                store = client.file_search_stores.get(name=store_name)
+                state.restore(store, files)
+                logger.info(f"Restored file search store: {store_name} with {len(files)} files")
+            except Exception as e:
+                logger.warning(f"Stored file search store not found: {e}")
+                state.restore(None, [])
+        else:
+            state.restore(None, files)
     except Exception as e:
         logger.error(f"Error loading state: {e}")
 
 def save_state():
-    """Save current state to JSON file - Guardar estado actual a archivo JSON"""
+    """Save the whole current state (store + file list) - Guardar estado completo
+
+    Only needed when the active store or the whole file list changes
+    (create/switch/delete store). Single-file changes use persist_file(),
+    persist_file_metadata() and delete_persisted_file(). Called by AppState
+    while it holds its lock.
+    """
     try:
-        state = {
-            'store_name': file_search_store.name if file_search_store else None,
-            'uploaded_files': uploaded_files
-        }
-        with open(PERSISTENCE_FILE, 'w') as f:
-            json.dump(state, f, indent=2)
+        conn = _db()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)',
+                ('store_name', json.dumps(state.store_name))
+            )
+            conn.execute('DELETE FROM files')
+            for file_info in state.files():
+                _insert_file(conn, file_info)
         logger.info("State saved successfully")
     except Exception as e:
         logger.error(f"Error saving state: {e}")
 
+def persist_file(file_info):
+    """Persist one newly tracked file (single-row insert)"""
+    persist_files([file_info])
+
+def persist_files(files):
+    """Persist several newly tracked files in one transaction"""
+    try:
+        conn = _db()
+        with conn:
+            for file_info in files:
+                _insert_file(conn, file_info)
+    except Exception as e:
+        logger.error(f"Error persisting files: {e}")
+
+def persist_file_metadata(file_info):
+    """Persist the metadata (and bookkeeping fields) of an already tracked file"""
+    persist_files_metadata([file_info])
+
+def persist_files_metadata(files):
+    """Persist metadata of several files in one transaction (untracked ones are inserted)"""
+    try:
+        conn = _db()
+        with conn:
+            for file_info in files:
+                if file_info.get('file_id') is None:
+                    _insert_file(conn, file_info)
+                    continue
+                data = {k: v for k, v in file_info.items() if k not in ('custom_metadata', 'file_id')}
+                conn.execute(
+                    'UPDATE files SET document_id = ?, data = ? WHERE id = ?',
+                    (file_info.get('document_id'), json.dumps(data), file_info['file_id'])
+                )
+                _write_file_metadata(conn, file_info)
+    except Exception as e:
+        logger.error(f"Error persisting metadata: {e}")
+
+def delete_persisted_file(file_info):
+    """Remove one tracked file (and its metadata rows) from the database"""
+    if file_info.get('file_id') is None:
+        return
+    try:
+        conn = _db()
+        with conn:
+            conn.execute('DELETE FROM files WHERE id = ?', (file_info['file_id'],))
+    except Exception as e:
+        logger.error(f"Error deleting persisted file: {e}")
+
 def load_state_value(key, default=None):
-    """Load a specific value from state file"""
+    """Load a specific setting from the database"""
     try:
-        if os.path.exists(PERSISTENCE_FILE):
-            with open(PERSISTENCE_FILE, 'r') as f:
-                state = json.load(f)
-                return state.get(key, default)
+        row = _db().execute('SELECT value FROM settings WHERE key = ?', (key,)).fetchone()
+        if row is not None:
+            return json.loads(row[0])
     except Exception:
         pass
     return default
 
 def save_state_value(key, value):
-    """Save a specific key-value to state file"""
-    try:
-        state = {}
-        if os.path.exists(PERSISTENCE_FILE):
-            with open(PERSISTENCE_FILE, 'r') as f:
-                state = json.load(f)
-        state[key] = value
-        with open(PERSISTENCE_FILE, 'w') as f:
-            json.dump(state, f, indent=2)
+    """Save a specific setting to the database"""
+    try:
+        conn = _db()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)',
+                (key, json.dumps(value))
+            )
     except Exception as e:
         logger.error(f"Error saving state value {key}: {e}")
 
+def find_content_hash(store_name, sha256):
+    """Document already indexed in a store with this content, or None
+
+    Returns:
+        dict: {'document_id', 'filename', 'size'} or None
+    """
+    row = _db().execute(
+        'SELECT document_id, filename, size FROM content_hashes WHERE store_name = ? AND sha256 = ?',
+        (store_name, sha256)
+    ).fetchone()
+    return {'document_id': row[0], 'filename': row[1], 'size': row[2]} if row else None
+
+def record_content_hash(store_name, sha256, document_id, filename, size):
+    """Remember the content hash of a newly indexed document"""
+    try:
+        conn = _db()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO content_hashes (store_name, sha256, document_id, filename, size) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (store_name, sha256, document_id, filename, size)
+            )
+    except Exception as e:
+        logger.error(f"Error recording content hash: {e}")
+
+def forget_content_hashes(document_id=None, store_name=None):
+    """Drop hash index entries for a deleted document or a whole store"""
+    try:
+        conn = _db()
+        with conn:
+            if document_id:
+                conn.execute('DELETE FROM content_hashes WHERE document_id = ?', (document_id,))
+            if store_name:
+                conn.execute('DELETE FROM content_hashes WHERE store_name = ?', (store_name,))
+    except Exception as e:
+        logger.error(f"Error deleting content hashes: {e}")
+
+def add_dedup_bytes_saved(size):
+    """Add to the running total of bytes not re-uploaded thanks to deduplication"""
+    try:
+        conn = _db()
+        with conn:
+            conn.execute(
+                "INSERT INTO settings (key, value) VALUES ('dedup_bytes_saved', ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + excluded.value",
+                (size,)
+            )
+    except Exception as e:
+        logger.error(f"Error updating deduplication stats: {e}")
+
+URL_SOURCE_FIELDS = ('store_name', 'url', 'document_id', 'filename', 'etag', 'last_modified', 'sha256',
+                     'metadata', 'chunking_config', 'checked_at')
+
+
+def record_url_source(store_name, url, document_id, filename, headers, sha256, metadata, chunking_config):
+    """Remember the document imported from a URL and its HTTP validators (ETag / Last-Modified)"""
+    try:
+        conn = _db()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO url_sources '
+                '(store_name, url, document_id, filename, etag, last_modified, sha256, metadata, chunking_config, checked_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (store_name, url, document_id, filename, headers.get('ETag'), headers.get('Last-Modified'),
+                 sha256, json.dumps(metadata or {}), json.dumps(chunking_config or {}), time.time())
+            )
+    except Exception as e:
+        logger.error(f"Error recording URL source: {e}")
+
+def touch_url_source(store_name, url, headers):
+    """Mark a URL source as checked, keeping any validators the server sent this time"""
+    try:
+        conn = _db()
+        with conn:
+            conn.execute(
+                'UPDATE url_sources SET etag = COALESCE(?, etag), last_modified = COALESCE(?, last_modified), '
+                'checked_at = ? WHERE store_name = ? AND url = ?',
+                (headers.get('ETag'), headers.get('Last-Modified'), time.time(), store_name, url)
+            )
+    except Exception as e:
+        logger.error(f"Error updating URL source: {e}")
+
+def list_url_sources(store_name, urls=None, checked_before=None):
+    """URL sources of a store, optionally limited to some URLs or to entries not checked since a timestamp"""
+    query = f"SELECT {', '.join(URL_SOURCE_FIELDS)} FROM url_sources WHERE store_name = ?"
+    params = [store_name]
+    if checked_before is not None:
+        query += ' AND (checked_at IS NULL OR checked_at < ?)'
+        params.append(checked_before)
+    query += ' ORDER BY url'
+    sources = []
+    for row in _db().execute(query, params):
+        source = dict(zip(URL_SOURCE_FIELDS, row))
+        source['metadata'] = json.loads(source['metadata'] or '{}')
+        source['chunking_config'] = json.loads(source['chunking_config'] or '{}')
+        sources.append(source)
+    if urls is not None:
+        wanted = set(urls)
+        sources = [source for source in sources if source['url'] in wanted]
+    return sources
+
+def forget_url_sources(document_id=None, store_name=None):
+    """Drop URL sources of a deleted document or a whole store"""
+    try:
+        conn = _db()
+        with conn:
+            if document_id:
+                conn.execute('DELETE FROM url_sources WHERE document_id = ?', (document_id,))
+            if store_name:
+                conn.execute('DELETE FROM url_sources WHERE store_name = ?', (store_name,))
+    except Exception as e:
+        logger.error(f"Error deleting URL sources: {e}")
+
+SYNC_MANIFEST_FIELDS = ('path', 'size', 'mtime_ns', 'sha256', 'document_id')
+
+
+def load_sync_manifest(store_name, source):
+    """Manifest of a synced directory: relative path -> {size, mtime_ns, sha256, document_id}"""
+    rows = _db().execute(
+        f"SELECT {', '.join(SYNC_MANIFEST_FIELDS)} FROM sync_manifest WHERE store_name = ? AND source = ?",
+        (store_name, source)
+    )
+    return {row[0]: dict(zip(SYNC_MANIFEST_FIELDS, row)) for row in rows}
+
+def save_sync_manifest_entries(store_name, source, entries):
+    """Insert or replace manifest entries in one transaction"""
+    if not entries:
+        return
+    try:
+        conn = _db()
+        now = time.time()
+        with conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO sync_manifest '
+                '(store_name, source, path, size, mtime_ns, sha256, document_id, synced_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                [(store_name, source, e['path'], e['size'], e['mtime_ns'], e['sha256'], e['document_id'], now)
+                 for e in entries]
+            )
+    except Exception as e:
+        logger.error(f"Error saving sync manifest: {e}")
+
+def delete_sync_manifest_entries(store_name, source, paths):
+    """Drop manifest entries of files that are gone from the source directory"""
+    if not paths:
+        return
+    try:
+        conn = _db()
+        with conn:
+            conn.executemany(
+                'DELETE FROM sync_manifest WHERE store_name = ? AND source = ? AND path = ?',
+                [(store_name, source, path) for path in paths]
+            )
+    except Exception as e:
+        logger.error(f"Error deleting sync manifest entries: {e}")
+
+def forget_sync_manifest(document_id=None, store_name=None):
+    """Drop manifest entries of a deleted document or a whole store"""
+    try:
+        conn = _db()
+        with conn:
+            if document_id:
+                conn.execute('DELETE FROM sync_manifest WHERE document_id = ?', (document_id,))
+            if store_name:
+                conn.execute('DELETE FROM sync_manifest WHERE store_name = ?', (store_name,))
+    except Exception as e:
+        logger.error(f"Error deleting sync manifest: {e}")
+
+def load_enriched_documents(store_name, schema_hash):
+    """Document IDs of a store already enriched with a schema (rows without saved metadata are ignored)"""
+    rows = _db().execute(
+        'SELECT document_id FROM enrichments WHERE store_name = ? AND schema_hash = ? AND metadata IS NOT NULL',
+        (store_name, schema_hash)
+    )
+    return {row[0] for row in rows}
+
+def load_enrichment_metadata(store_name):
+    """Saved enrichment metadata of a store: document_id -> metadata"""
+    rows = _db().execute(
+        'SELECT document_id, metadata FROM enrichments WHERE store_name = ? AND metadata IS NOT NULL',
+        (store_name,)
+    )
+    return {document_id: json.loads(metadata) for document_id, metadata in rows}
+
+def record_enrichments(store_name, schema_hash, model, results):
+    """Save enrichment results of a store (one transaction).
+
+    Kept per store, apart from the active store's tracked files, so results
+    survive store switches and are merged back by AppState.set_store.
+
+    Args:
+        results (dict): document_id -> extracted metadata
+    """
+    if not results:
+        return
+    try:
+        conn = _db()
+        now = time.time()
+        with conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO enrichments '
+                '(store_name, document_id, schema_hash, model, enriched_at, metadata) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                [(store_name, document_id, schema_hash, model, now, json.dumps(metadata))
+                 for document_id, metadata in results.items()]
+            )
+    except Exception as e:
+        logger.error(f"Error recording enrichments: {e}")
+
+def forget_enrichments(document_id=None, store_name=None):
+    """Drop enrichment records of a deleted document or a whole store"""
+    try:
+        conn = _db()
+        with conn:
+            if document_id:
+                conn.execute('DELETE FROM enrichments WHERE document_id = ?', (document_id,))
+            if store_name:
+                conn.execute('DELETE FROM enrichments WHERE store_name = ?', (store_name,))
+    except Exception as e:
+        logger.error(f"Error deleting enrichments: {e}")
+
+def save_investigation(investigation):
+    """Insert or replace one investigation row"""
+    conn = _db()
+    with conn:
+        _upsert_investigation(conn, investigation)
+
+def load_investigation(investigation_id):
+    """Load one investigation by ID, or None"""
+    row = _db().execute('SELECT data FROM investigations WHERE id = ?', (investigation_id,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+def load_investigations():
+    """Load all investigations, newest first"""
+    rows = _db().execute('SELECT data FROM investigations ORDER BY created_at DESC')
+    return [json.loads(data) for (data,) in rows]
+
+def delete_investigation_record(investigation_id):
+    """Delete one investigation; returns False if it did not exist"""
+    conn = _db()
+    with conn:
+        cursor = conn.execute('DELETE FROM investigations WHERE id = ?', (investigation_id,))
+    return cursor.rowcount > 0
+
+# ============================================
+# CHAT SESSIONS - Historial de conversación por sesión
+# ============================================
+
+class SessionHistoryStore:
+    """Per-session conversation histories in a bounded in-memory LRU.
+
+    Sessions live in an OrderedDict ordered by last access, so lookup,
+    update and eviction are O(1). Memory is capped by session count and by
+    total message bytes; idle sessions expire after `ttl` seconds. When
+    `spill` is enabled, sessions evicted for space are written to the
+    chat_sessions table and reloaded on their next request.
+    """
+
+    def __init__(self, max_sessions, max_bytes, ttl, max_messages=MAX_HISTORY, spill=False):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self.spill = spill
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()  # session_id -> (messages tuple, size in bytes, last access)
+        self._bytes = 0
+
+    @staticmethod
+    def _size(messages):
+        return sum(len(m['content'].encode('utf-8')) for m in messages)
+
+    def get(self, session_id):
+        """History of a session (oldest first); empty for new or expired sessions"""
+        with self._lock:
+            messages = self._current(session_id)
+            if messages is not None:
+                return messages
+
+        messages = self._load_spilled(session_id)
+        if messages:
+            with self._lock:
+                if session_id not in self._sessions:
+                    self._put(session_id, tuple(messages))
+        return messages
+
+    def append_exchange(self, session_id, user_message, assistant_message):
+        """Add a user/assistant exchange; returns the new history length.
+
+        Read, append and write happen under one lock hold, so concurrent
+        exchanges on the same session are never lost.
+        """
+        with self._lock:
+            history = self._current(session_id)
+            if history is None:
+                history = self._load_spilled(session_id)
+            history = history + [
+                {'role': 'user', 'content': user_message},
+                {'role': 'assistant', 'content': assistant_message},
+            ]
+            messages = tuple(history[-self.max_messages:])
+            self._put(session_id, messages)
+        return len(messages)
+
+    def length(self, session_id):
+        return len(self.get(session_id))
+
+    def clear(self, session_id):
+        with self._lock:
+            self._drop(session_id)
+        self._delete_spilled(session_id)
+
+    def stats(self):
+        with self._lock:
+            return {'sessions': len(self._sessions), 'bytes': self._bytes}
+
+    def _current(self, session_id):
+        """In-memory history of a session, or None if not loaded. Caller must hold the lock."""
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            return None
+        messages, size, touched = entry
+        if time.time() - touched > self.ttl:
+            self._drop(session_id)
+            return []
+        self._sessions[session_id] = (messages, size, time.time())
+        self._sessions.move_to_end(session_id)
+        return list(messages)
+
+    def _put(self, session_id, messages):
+        """Insert/replace a session and evict. Caller must hold the lock."""
+        self._drop(session_id)
+        size = self._size(messages)
+        self._sessions[session_id] = (messages, size, time.time())
+        self._bytes += size
+        self._evict()
+
+    def _drop(self, session_id):
+        entry = self._sessions.pop(session_id, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def _evict(self):
+        """Expire idle sessions, then evict least recently used ones over the caps"""
+        now = time.time()
+        while self._sessions:
+            session_id, (messages, size, touched) = next(iter(self._sessions.items()))
+            expired = now - touched > self.ttl
+            over_cap = len(self._sessions) > self.max_sessions or self._bytes > self.max_bytes
+            if not (expired or over_cap):
+                break
+            self._sessions.popitem(last=False)
+            self._bytes -= size
+            if not expired and self.spill:
+                self._spill(session_id, messages)
+
+    def _spill(self, session_id, messages):
+        try:
+            conn = _db()
+            with conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO chat_sessions (session_id, messages, updated_at) VALUES (?, ?, ?)',
+                    (session_id, json.dumps(list(messages)), time.time())
+                )
+        except Exception as e:
+            logger.warning(f"Could not spill session {session_id}: {e}")
+
+    def _delete_spilled(self, session_id):
+        if not self.spill:
+            return
+        try:
+            conn = _db()
+            with conn:
+                conn.execute('DELETE FROM chat_sessions WHERE session_id = ?', (session_id,))
+        except Exception as e:
+            logger.warning(f"Could not clear spilled session {session_id}: {e}")
+
+    def _load_spilled(self, session_id):
+        if not self.spill:
+            return []
+        try:
+            row = _db().execute(
+                'SELECT messages, updated_at FROM chat_sessions WHERE session_id = ?', (session_id,)
+            ).fetchone()
+        except Exception as e:
+            logger.warning(f"Could not load spilled session {session_id}: {e}")
+            return []
+        if row is None:
+            return []
+        if time.time() - row[1] > self.ttl:
+            self._delete_spilled(session_id)
+            return []
+        return json.loads(row[0])
+
+
+chat_sessions = SessionHistoryStore(
+    max_sessions=CHAT_MAX_SESSIONS,
+    max_bytes=CHAT_MAX_HISTORY_BYTES,
+    ttl=CHAT_SESSION_TTL,
+    spill=CHAT_SESSION_SPILL
+)
+
+
+def get_session_id():
+    """Chat session ID from the X-Session-Id header, JSON body or query string"""
+    data = request.get_json(silent=True) or {}
+    session_id = (
+        request.headers.get('X-Session-Id')
+        or data.get('session_id')
+        or request.args.get('session_id')
+        or 'default'
+    )
+    return str(session_id)[:128]
+
+
+# ============================================
+# CACHES - Cachés con TTL e invalidación por store
+# ============================================
+
+class TTLCache:
+    """Thread-safe LRU cache with per-entry TTL, hit/miss counters and store tags.
+
+    Entries can be tagged with a store name so every entry derived from a
+    store is dropped at once when its documents change. on_evict(value), if
+    given, is called outside the lock for every value that leaves the cache
+    (expiry, capacity, replacement, delete or clear).
+    """
+
+    def __init__(self, max_entries, ttl, on_evict=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (value, expires_at, store)
+        self._by_store = {}  # store -> set of keys
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Cached value or None (counts a hit or a miss)"""
+        evicted = []
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.time():
+                if entry is not None:
+                    evicted.append(self._remove(key))
+                self.misses += 1
+                value = None
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                value = entry[0]
+        self._evicted(evicted)
+        return value
+
+    def set(self, key, value, store=None, ttl=None):
+        """Cache value for ttl seconds (default: the cache TTL)"""
+        evicted = []
+        with self._lock:
+            evicted.append(self._remove(key))
+            self._entries[key] = (value, time.time() + (self.ttl if ttl is None else ttl), store)
+            if store:
+                self._by_store.setdefault(store, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._remove(next(iter(self._entries))))
+        self._evicted(evicted)
+
+    def delete(self, key):
+        with self._lock:
+            evicted = [self._remove(key)]
+        self._evicted(evicted)
+
+    def invalidate_store(self, store):
+        """Drop every entry tagged with store; returns the number removed"""
+        with self._lock:
+            keys = self._by_store.pop(store, set())
+            evicted = [self._remove(key) for key in keys]
+        self._evicted(evicted)
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            evicted = [entry[0] for entry in self._entries.values()]
+            self._entries.clear()
+            self._by_store.clear()
+        self._evicted(evicted)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0
+            }
+
+    def _remove(self, key):
+        """Remove an entry and return its value (None if absent). Caller must hold the lock"""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        if entry[2]:
+            keys = self._by_store.get(entry[2])
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_store[entry[2]]
+        return entry[0]
+
+    def _evicted(self, values):
+        if self.on_evict is None:
+            return
+        for value in values:
+            if value is not None:
+                try:
+                    self.on_evict(value)
+                except Exception as e:
+                    logger.warning(f"Cache eviction callback failed: {e}")
+
+
+response_cache = TTLCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL)
+catalog_cache = TTLCache(CATALOG_CACHE_SIZE, CATALOG_CACHE_TTL)
+retrieval_cache = TTLCache(RETRIEVAL_CACHE_SIZE, RETRIEVAL_CACHE_TTL)
+STORES_CATALOG_KEY = 'stores'
+_store_versions = {}  # store name -> version, bumped whenever its documents change
+_store_versions_lock = threading.Lock()
+
+
+def store_of_document(document_name):
+    """Store resource name of a document name (fileSearchStores/x/documents/y)"""
+    return document_name.split('/documents/')[0] if document_name else None
+
+
+def store_version(store_name):
+    """Version of a store's documents; part of keys that must not outlive a change"""
+    with _store_versions_lock:
+        return _store_versions.get(store_name, 0)
+
+
+def notify_store_changed(store_name):
+    """Invalidate everything cached for a store after documents change"""
+    if not store_name:
+        return
+    # Results computed while the change happened carry the old version and are never served
+    with _store_versions_lock:
+        _store_versions[store_name] = _store_versions.get(store_name, 0) + 1
+    # Store sizes and document counts change with its documents
+    catalog_cache.delete(STORES_CATALOG_KEY)
+    catalog_cache.invalidate_store(store_name)
+    retrieval_cache.invalidate_store(store_name)
+    removed = response_cache.invalidate_store(store_name)
+    if removed:
+        logger.info(f"Invalidated {removed} cached chat response(s) for {store_name}")
+
+
+def cache_key(*parts):
+    """Stable hash of JSON-serializable key parts"""
+    raw = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def normalize_prompt(text):
+    """Lowercase, collapse whitespace and drop trailing punctuation for cache keys"""
+    return ' '.join(text.lower().split()).rstrip(' ?!.¿¡')
+
+
+# ============================================
+# RATE LIMITING - Control de cuota de la API de Gemini
+# ============================================
+
+class RateLimiter:
+    """Token bucket shared by concurrent Gemini calls.
+
+    `rate_per_minute` tokens are refilled continuously up to `burst`;
+    acquire() blocks until a token is available. A rate of 0 disables it.
+    """
+
+    def __init__(self, rate_per_minute, burst=1):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+gemini_rate_limiter = RateLimiter(GEMINI_RPM, GEMINI_BURST)
+
+
+def _is_retryable(error):
+    """Rate limit (429) and transient server errors are worth retrying"""
+    code = getattr(error, 'code', None)
+    return code in (429, 500, 503) or 'RESOURCE_EXHAUSTED' in str(error)
+
+
+def generate_content_with_retry(**kwargs):
+    """client.models.generate_content behind the shared rate limiter.
+
+    Retries 429 / 5xx responses with exponential backoff and jitter, up to
+    GEMINI_MAX_RETRIES times.
+    """
+    for attempt in range(GEMINI_MAX_RETRIES + 1):
+        gemini_rate_limiter.acquire()
+        try:
+            return client.models.generate_content(**kwargs)
+        except Exception as e:
+            if attempt >= GEMINI_MAX_RETRIES or not _is_retryable(e):
+                raise
+            delay = min(60.0, 2 ** attempt) * random.uniform(0.8, 1.2)
+            logger.warning(f"Gemini call failed ({str(e)[:80]}), retry {attempt + 1} in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def generate_content_stream_limited(**kwargs):
+    """client.models.generate_content_stream behind the shared rate limiter.
+
+    Not retried: tokens may already have been forwarded when an error arrives.
+    """
+    gemini_rate_limiter.acquire()
+    return client.models.generate_content_stream(**kwargs)
+
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
@@ -227,15 +1456,15 @@ def allowed_file(filename):
 # METADATA HELPER - Extracción y fusión de metadatos
 # ============================================
 
-def extract_document_metadata(doc, uploaded_files):
+def extract_document_metadata(doc, include_local=True):
     """Extract and merge Gemini + local metadata for a document.
 
     Gemini metadata is fetched from the API response. Local metadata
-    from uploaded_files takes precedence (allows editing without re-upload).
+    from the tracked files takes precedence (allows editing without re-upload).
 
     Args:
         doc: Document resource object from Gemini API
-        uploaded_files: List of locally tracked file dicts
+        include_local (bool): Merge locally edited metadata (O(1) index lookup)
 
     Returns:
         dict: Merged metadata with local values overriding Gemini values
@@ -250,11 +1479,8 @@ def extract_document_metadata(doc, uploaded_files):
                 custom_metadata[key] = getattr(metadata, 'numeric_value', 0)
 
     # Merge with local metadata - local overrides Gemini
-    for file_info in uploaded_files:
-        if file_info.get('document_id') == doc.name:
-            local_metadata = file_info.get('custom_metadata', {})
-            custom_metadata.update(local_metadata)
-            break
+    if include_local:
+        custom_metadata.update(state.local_metadata(doc.name) or {})
 
     return custom_metadata
 
@@ -284,33 +1510,271 @@ def get_mime_type(filename):
     logger.warning(f"Could not determine MIME type for {filename}, using default")
     return 'application/octet-stream'
 
-def extract_text_from_docx(file_path):
+# ============================================
+# TEXT EXTRACTION - Extracción de texto (DOCX, XLSX/XLSM, ODS)
+# Generators that stream paragraphs / rows, sampled down to a character budget
+# ============================================
+
+EXTRACT_MAX_CHARS = 12000  # Default character budget for extracted text
+EXTRACT_SCAN_MAX_CHARS = 2_000_000  # Characters read at most when sampling a long document
+XLSX_MAX_ROWS_PER_SHEET = 100  # Rows read per sheet, so every sheet gets a share of the budget
+
+_W_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+_ODF_TABLE_NS = '{urn:oasis:names:tc:opendocument:xmlns:table:1.0}'
+_ODF_TEXT_NS = '{urn:oasis:names:tc:opendocument:xmlns:text:1.0}'
+
+SPREADSHEET_MIME_TYPES = {
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',  # XLSX
+    'application/vnd.ms-excel.sheet.macroEnabled.12',  # XLSM
+    'application/vnd.ms-excel'  # XLS
+}
+WORD_MIME_TYPES = {
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document',  # DOCX
+    'application/msword'  # DOC (old format)
+}
+ODS_MIME_TYPE = 'application/vnd.oasis.opendocument.spreadsheet'
+TEXT_EXTRACTION_MIME_TYPES = SPREADSHEET_MIME_TYPES | WORD_MIME_TYPES | {ODS_MIME_TYPE}
+
+
+def _row_text(values):
+    """Join cell values with ' | ', dropping trailing empty cells; '' for empty rows"""
+    cells = ['' if value is None else str(value).strip() for value in values]
+    while cells and not cells[-1]:
+        cells.pop()
+    return ' | '.join(cells)
+
+
+def _is_heading_style(style_id):
+    """Heading / title paragraph styles (English and Spanish Word style IDs)"""
+    return style_id.lower().startswith(('heading', 'title', 'titulo', 'ttulo'))
+
+
+def iter_docx_text(file_path):
+    """Yield the paragraphs of a DOCX in document order, one table row per line.
+
+    word/document.xml is streamed with iterparse and cleared as it goes, so
+    memory stays flat regardless of document size. Merged table cells appear
+    once (continuation cells of vertical merges carry no text). Headings are
+    prefixed with '# ' so sample_text() can treat them as section starts.
+    """
+    with zipfile.ZipFile(file_path) as archive, archive.open('word/document.xml') as xml_file:
+        paragraph = []
+        heading = False  # Current paragraph has a heading style or outline level
+        cells = []  # Cells of the current table row
+        cell = []  # Paragraphs of the current cell
+        depth = 0  # Table nesting level
+        for event, element in ElementTree.iterparse(xml_file, events=('start', 'end')):
+            tag = element.tag
+            if event == 'start':
+                if tag == _W_NS + 'tbl':
+                    depth += 1
+                continue
+            if tag == _W_NS + 't':
+                paragraph.append(element.text or '')
+            elif tag == _W_NS + 'tab':
+                paragraph.append(' ')
+            elif tag == _W_NS + 'pStyle':
+                heading = heading or _is_heading_style(element.get(_W_NS + 'val', ''))
+            elif tag == _W_NS + 'outlineLvl':
+                heading = True
+            elif tag == _W_NS + 'p':
+                text = ''.join(paragraph).strip()
+                paragraph = []
+                if text:
+                    if depth:
+                        cell.append(text)
+                    else:
+                        yield f"# {text}" if heading else text
+                heading = False
+                element.clear()
+            elif tag == _W_NS + 'tc' and depth == 1:
+                cells.append(' '.join(cell))
+                cell = []
+                element.clear()
+            elif tag == _W_NS + 'tr' and depth == 1:
+                text = _row_text(cells)
+                cells = []
+                if text:
+                    yield text
+                element.clear()
+            elif tag == _W_NS + 'tbl':
+                depth -= 1
+                element.clear()
+
+
+def iter_xlsx_text(file_path, max_rows=XLSX_MAX_ROWS_PER_SHEET):
+    """Yield a header per sheet and its first max_rows non-empty rows (XLSX/XLSM).
+
+    Uses openpyxl's read-only mode, which streams the sheet XML row by row;
+    merged ranges only carry a value in their first cell, so they are not
+    repeated. The workbook is closed when the generator is exhausted or closed.
+    """
+    wb = load_workbook(filename=file_path, read_only=True, data_only=True)
+    try:
+        for sheet in wb.worksheets:
+            yield f"=== Sheet: {sheet.title} ==="
+            rows = 0
+            for row in sheet.iter_rows(values_only=True):
+                text = _row_text(row)
+                if text:
+                    yield text
+                    rows += 1
+                    if rows >= max_rows:
+                        break
+    finally:
+        # IMPORTANT: Always close the workbook to release file handle
+        wb.close()
+
+
+def iter_ods_text(file_path, max_rows=XLSX_MAX_ROWS_PER_SHEET):
+    """Yield a header per sheet and its first max_rows non-empty rows (ODS).
+
+    content.xml is streamed with iterparse. Repeated cells and rows
+    (number-columns/rows-repeated, used for merged or blank ranges that can
+    span a million rows) are emitted once instead of being expanded.
+    """
+    with zipfile.ZipFile(file_path) as archive, archive.open('content.xml') as xml_file:
+        cells = []
+        rows = 0
+        for event, element in ElementTree.iterparse(xml_file, events=('start', 'end')):
+            tag = element.tag
+            if event == 'start':
+                if tag == _ODF_TABLE_NS + 'table':
+                    rows = 0
+                    yield f"=== Sheet: {element.get(_ODF_TABLE_NS + 'name', '')} ==="
+                continue
+            if tag in (_ODF_TABLE_NS + 'table-cell', _ODF_TABLE_NS + 'covered-table-cell'):
+                if tag == _ODF_TABLE_NS + 'table-cell':
+                    cells.append(' '.join(
+                        ''.join(p.itertext()).strip() for p in element.iter(_ODF_TEXT_NS + 'p')
+                    ))
+                element.clear()
+            elif tag == _ODF_TABLE_NS + 'table-row':
+                text = _row_text(cells)
+                cells = []
+                element.clear()
+                if text and rows < max_rows:
+                    rows += 1
+                    yield text
+            elif tag == _ODF_TABLE_NS + 'table':
+                element.clear()
+
+
+def collect_text(lines, max_chars=EXTRACT_MAX_CHARS):
+    """Join lines until max_chars is reached, then close the generator.
+
+    Closing stops the underlying parse early, so only the part of the file
+    that fits the budget is ever read.
+    """
+    parts = []
+    total = 0
+    try:
+        for line in lines:
+            remaining = max_chars - total
+            if remaining <= 0:
+                break
+            parts.append(line[:remaining])
+            total += len(parts[-1]) + 1
+    finally:
+        lines.close()
+    return '\n'.join(parts)
+
+
+def _is_section_start(line):
+    return line.startswith(('=== Sheet:', '# '))
+
+
+def sample_text(lines, max_chars=EXTRACT_MAX_CHARS, scan_max_chars=EXTRACT_SCAN_MAX_CHARS):
+    """Representative excerpt of a document within max_chars, in one pass.
+
+    Text that fits is returned whole. Longer documents keep their head
+    (~45% of the budget), the first lines of every section - sheets and
+    headings, sharing ~35% evenly so late sheets are not lost - and the
+    tail (~20%), in document order with '[...]' marking the gaps. At most
+    scan_max_chars characters are read; the generator is closed afterwards.
+    """
+    head_budget = int(max_chars * 0.45)
+    tail_budget = int(max_chars * 0.2)
+    section_budget = max_chars - head_budget - tail_budget
+    everything, total = [], 0  # All lines, while they still fit max_chars
+    head, head_used, head_open = [], 0, True
+    sections = []  # Per section: [(index, text)], its start line first
+    section_used = 0  # Chars kept in the current section
+    tail, tail_used = deque(), 0
+    scanned = 0
+    try:
+        for index, line in enumerate(lines):
+            scanned += len(line) + 1
+            if scanned > scan_max_chars:
+                break
+            if everything is not None:
+                total += len(line) + 1
+                if total <= max_chars + 1:
+                    everything.append(line)
+                else:
+                    everything = None
+            if head_open and head_used + len(line) + 1 <= head_budget:
+                head.append((index, line))
+                head_used += len(line) + 1
+                continue
+            if head_open and not head:
+                # A single line longer than the head share: keep its start
+                head.append((index, line[:head_budget]))
+                head_open = False
+                continue
+            head_open = False
+            if _is_section_start(line):
+                sections.append([(index, line[:section_budget])])
+                section_used = len(line)
+            elif sections and section_used < section_budget:
+                sections[-1].append((index, line[:section_budget - section_used]))
+                section_used += len(line) + 1
+            tail.append((index, line))
+            tail_used += len(line) + 1
+            while tail_used > tail_budget and len(tail) > 1:
+                tail_used -= len(tail.popleft()[1]) + 1
+    finally:
+        lines.close()
+    if everything is not None:
+        return '\n'.join(everything)
+
+    kept = dict(head)
+    # Leave room for the '[...]' lines between the kept parts, so the final
+    # cut to max_chars never eats into the tail
+    gaps = len(sections) + 1
+    share = max(0, section_budget - 7 * gaps) // max(1, len(sections))
+    for section in sections:
+        used = 0
+        for index, text in section:
+            if used >= share:
+                break
+            kept.setdefault(index, text[:share - used])
+            used += len(kept[index]) + 1
+    for index, text in tail:
+        kept.setdefault(index, text[-tail_budget:])
+
+    parts, previous = [], -1
+    for index in sorted(kept):
+        if index != previous + 1:
+            parts.append('[...]')
+        parts.append(kept[index])
+        previous = index
+    return '\n'.join(parts)[:max_chars]
+
+
+def extract_text_from_docx(file_path, max_chars=EXTRACT_MAX_CHARS):
     """
     Extract text content from a DOCX file.
 
     Args:
         file_path (str): Path to the DOCX file
+        max_chars (int): Character budget; longer documents are sampled (see sample_text)
 
     Returns:
         str: Extracted text content
     """
     try:
-        doc = DocxDocument(file_path)
-        paragraphs = []
-
-        # Extract all paragraphs
-        for para in doc.paragraphs:
-            if para.text.strip():
-                paragraphs.append(para.text)
-
-        # Extract text from tables
-        for table in doc.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    if cell.text.strip():
-                        paragraphs.append(cell.text)
-
-        text = '\n'.join(paragraphs)
+        text = sample_text(iter_docx_text(file_path), max_chars)
         logger.info(f"Extracted {len(text)} characters from DOCX")
         return text
 
@@ -318,49 +1782,556 @@ def extract_text_from_docx(file_path):
         logger.error(f"Error extracting text from DOCX: {str(e)}")
         return ""
 
-def extract_text_from_xlsx(file_path):
+
+def extract_text_from_xlsx(file_path, max_chars=EXTRACT_MAX_CHARS):
     """
-    Extract text content from an XLSX file.
+    Extract text content from an XLSX or XLSM file.
 
     Args:
-        file_path (str): Path to the XLSX file
+        file_path (str): Path to the workbook
+        max_chars (int): Character budget; longer documents are sampled (see sample_text)
 
     Returns:
         str: Extracted text content
     """
-    wb = None
     try:
-        wb = load_workbook(filename=file_path, read_only=True, data_only=True)
-        text_parts = []
-
-        for sheet_name in wb.sheetnames:
-            sheet = wb[sheet_name]
-            text_parts.append(f"=== Sheet: {sheet_name} ===")
-
-            # Read up to 100 rows to avoid overwhelming the model
-            max_rows = min(sheet.max_row, 100) if sheet.max_row else 100
-
-            for row in sheet.iter_rows(min_row=1, max_row=max_rows, values_only=True):
-                # Convert row values to strings, skip empty rows
-                row_text = ' | '.join([str(cell) if cell is not None else '' for cell in row])
-                if row_text.strip():
-                    text_parts.append(row_text)
-
-        text = '\n'.join(text_parts)
-        logger.info(f"Extracted {len(text)} characters from XLSX ({len(wb.sheetnames)} sheets)")
+        text = sample_text(iter_xlsx_text(file_path), max_chars)
+        logger.info(f"Extracted {len(text)} characters from XLSX")
         return text
 
     except Exception as e:
         logger.error(f"Error extracting text from XLSX: {str(e)}")
         return ""
-    finally:
-        # IMPORTANT: Always close the workbook to release file handle
-        if wb is not None:
-            try:
-                wb.close()
-                logger.info("XLSX workbook closed successfully")
-            except Exception as close_error:
-                logger.warning(f"Error closing workbook: {close_error}")
+
+
+def extract_text_from_ods(file_path, max_chars=EXTRACT_MAX_CHARS):
+    """
+    Extract text content from an ODS (OpenDocument spreadsheet) file.
+
+    Args:
+        file_path (str): Path to the ODS file
+        max_chars (int): Character budget; longer documents are sampled (see sample_text)
+
+    Returns:
+        str: Extracted text content
+    """
+    try:
+        text = sample_text(iter_ods_text(file_path), max_chars)
+        logger.info(f"Extracted {len(text)} characters from ODS")
+        return text
+
+    except Exception as e:
+        logger.error(f"Error extracting text from ODS: {str(e)}")
+        return ""
+
+
+def extract_document_text(file_path, mime_type, max_chars=EXTRACT_MAX_CHARS):
+    """Extract text from a format Gemini cannot read directly (see TEXT_EXTRACTION_MIME_TYPES)"""
+    if mime_type in WORD_MIME_TYPES:
+        return extract_text_from_docx(file_path, max_chars)
+    if mime_type in SPREADSHEET_MIME_TYPES:
+        return extract_text_from_xlsx(file_path, max_chars)
+    if mime_type == ODS_MIME_TYPE:
+        return extract_text_from_ods(file_path, max_chars)
+    return ""
+
+
+# ============================================
+# TOKEN BUDGET - Presupuesto de tokens por modelo
+# Document text in analysis prompts is sized in tokens, not characters
+# ============================================
+
+class TokenEstimator:
+    """Local token estimates from a characters-per-token ratio per model.
+
+    Ratios start at default_ratio and, when calibration is enabled, are
+    learned once per model from the SDK's count_tokens on a real document
+    text, so budgets hold for languages and formats (tables, numbers) that
+    tokenize denser than English prose.
+    """
+
+    def __init__(self, default_ratio=4.0, calibrate=True, min_sample_chars=2000):
+        self.default_ratio = default_ratio
+        self.calibration = calibrate
+        self.min_sample_chars = min_sample_chars
+        self._ratios = {}  # model -> chars per token (None: calibration failed)
+        self._lock = threading.Lock()
+
+    def chars_per_token(self, model):
+        with self._lock:
+            return self._ratios.get(model) or self.default_ratio
+
+    def estimate(self, text, model):
+        """Estimated tokens of a text"""
+        return int(len(text) / self.chars_per_token(model)) + 1
+
+    def chars_for(self, tokens, model):
+        """Characters that fit a token budget"""
+        return int(tokens * self.chars_per_token(model))
+
+    def calibrate(self, model, text):
+        """Learn the model's ratio from text with count_tokens (once per model).
+
+        Returns:
+            bool: True if the ratio changed and budgets should be recomputed
+        """
+        if not self.calibration or len(text) < self.min_sample_chars:
+            return False
+        with self._lock:
+            if model in self._ratios:
+                return False
+            self._ratios[model] = None  # Claimed: one count_tokens call per model
+        try:
+            total_tokens = client.models.count_tokens(model=model, contents=text).total_tokens
+        except Exception as e:
+            logger.warning(f"Could not count tokens for {model}, using the local estimate: {str(e)[:80]}")
+            return False
+        if not total_tokens:
+            return False
+        ratio = len(text) / total_tokens
+        with self._lock:
+            self._ratios[model] = ratio
+        logger.info(f"Token ratio for {model}: {ratio:.2f} characters per token")
+        return abs(ratio - self.default_ratio) / self.default_ratio > 0.1
+
+
+token_estimator = TokenEstimator(calibrate=TOKEN_COUNT_CALIBRATION)
+
+
+def prompt_token_budget(model):
+    """Tokens of document text allowed in one analysis prompt for a model"""
+    return PROMPT_TOKEN_BUDGETS.get(model, PROMPT_TOKEN_BUDGET)
+
+
+def prompt_text_chars(model):
+    """Characters of document text that fit the model's prompt budget"""
+    return token_estimator.chars_for(prompt_token_budget(model), model)
+
+
+# ============================================
+# ANALYSIS INPUT CACHE - Caché de texto extraído y archivos subidos
+# Keyed by content hash: re-analyzing the same bytes skips extraction / upload
+# ============================================
+
+def fit_document_text(file_path, mime_type, model, content_hash=None):
+    """Extracted text of a file sampled to the model's prompt token budget.
+
+    The first long text seen for a model calibrates its token ratio; if the
+    ratio moves, the text is re-sampled with the corrected budget.
+    """
+    text = cached_document_text(file_path, mime_type, content_hash, prompt_text_chars(model))
+    if token_estimator.calibrate(model, text):
+        text = cached_document_text(file_path, mime_type, content_hash, prompt_text_chars(model))
+    logger.info(f"Document text for {model}: {len(text)} characters, "
+                f"~{token_estimator.estimate(text, model)} tokens (budget {prompt_token_budget(model)})")
+    return text
+
+
+def _delete_cached_api_file(uploaded_file):
+    """Eviction callback: delete the Files API upload in the background.
+
+    The client is bound now, so uploads evicted by an API key change are
+    deleted from the project that owns them.
+    """
+    upload_executor.submit(_delete_api_file, uploaded_file, client)
+
+
+extraction_cache = TTLCache(EXTRACTION_CACHE_SIZE, FILE_HANDLE_CACHE_TTL)
+file_handle_cache = TTLCache(FILE_HANDLE_CACHE_SIZE, FILE_HANDLE_CACHE_TTL, on_evict=_delete_cached_api_file)
+# Striped by key so concurrent requests for the same bytes upload them once
+_file_upload_locks = [threading.Lock() for _ in range(32)]
+
+
+def uploaded_file_hash(file_storage, saved_path):
+    """SHA-256 of a request file: taken from the spooled upload buffer, or hashed from disk"""
+    content_hash = getattr(file_storage.stream, 'content_hash', None)
+    return content_hash() if content_hash else _hash_file(saved_path)
+
+
+def cached_document_text(file_path, mime_type, content_hash, max_chars=EXTRACT_MAX_CHARS):
+    """Extracted (and sampled) text of a file, cached by content hash and budget"""
+    key = cache_key('text', content_hash, mime_type, max_chars)
+    text = extraction_cache.get(key) if content_hash else None
+    if text is None:
+        text = extract_document_text(file_path, mime_type, max_chars)
+        if text and content_hash:
+            extraction_cache.set(key, text)
+    else:
+        logger.info(f"Extracted text cache hit ({len(text)} characters)")
+    return text
+
+
+def _file_handle_ttl(uploaded_file):
+    """Cache TTL for a Files API upload: FILE_HANDLE_CACHE_TTL, minus a margin before the file expires"""
+    expiration = getattr(uploaded_file, 'expiration_time', None)
+    if expiration is None:
+        return FILE_HANDLE_CACHE_TTL
+    return max(0, min(FILE_HANDLE_CACHE_TTL, expiration.timestamp() - time.time() - 300))
+
+
+def cached_files_api_upload(file_path, filename, mime_type, content_hash):
+    """Files API upload of a file, reused while the same bytes are analyzed again.
+
+    The upload stays in the Files API until it is evicted from
+    file_handle_cache (capacity or TTL), which deletes it. Callers must not
+    delete it themselves; call forget_files_api_upload() if it turns out
+    to be unusable.
+
+    Returns:
+        File: Files API file (uri, mime_type, name)
+    """
+    key = cache_key('file', content_hash, mime_type)
+    with _file_upload_locks[int(key[:8], 16) % len(_file_upload_locks)]:
+        uploaded_file = file_handle_cache.get(key)
+        if uploaded_file is not None:
+            logger.info(f"Reusing Files API upload {uploaded_file.name} for {filename}")
+            return uploaded_file
+        uploaded_file = client.files.upload(
+            file=file_path,
+            config={'mime_type': mime_type, 'display_name': filename}
+        )
+        file_handle_cache.set(key, uploaded_file, ttl=_file_handle_ttl(uploaded_file))
+        return uploaded_file
+
+
+def forget_files_api_upload(content_hash, mime_type):
+    """Drop (and delete) a cached Files API upload, e.g. after the API rejected it"""
+    file_handle_cache.delete(cache_key('file', content_hash, mime_type))
+
+# ============================================
+# OPERATION TRACKER - Seguimiento de operaciones largas
+# ============================================
+
+def _refresh_operation(operation):
+    return client.operations.get(operation)
+
+
+def _operation_done(operation):
+    return bool(operation.done)
+
+
+class OperationTracker:
+    """Single background poller for all pending long-running operations.
+
+    Each tracked operation gets its own polling schedule: the first check is
+    placed near the expected completion time for its MIME type (learned from
+    past imports), later checks back off exponentially with jitter. One
+    daemon thread multiplexes every pending operation, so waiting uploads do
+    not park request or worker threads in sleep loops. Other long-running
+    resources (e.g. Batch API jobs) are tracked with their own refresh and
+    is_done functions.
+    """
+
+    def __init__(self, min_interval=0.5, max_interval=15.0, backoff=1.6, jitter=0.2, alpha=0.3):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self.alpha = alpha  # EWMA weight of the newest latency sample
+        self._cond = threading.Condition()
+        self._heap = []  # (next_poll_at, seq, entry)
+        self._seq = 0
+        self._latency = {}  # mime_type -> estimated seconds until done
+        self._thread = None
+
+    def estimate(self, mime_type):
+        """Expected processing seconds for a MIME type, or None if unknown"""
+        with self._cond:
+            return self._latency.get(mime_type)
+
+    def record_latency(self, mime_type, seconds):
+        """Feed an observed processing time into the per-MIME estimate"""
+        if not mime_type or seconds is None:
+            return
+        with self._cond:
+            previous = self._latency.get(mime_type)
+            if previous is None:
+                self._latency[mime_type] = float(seconds)
+            else:
+                self._latency[mime_type] = (1 - self.alpha) * previous + self.alpha * float(seconds)
+
+    def seed_latencies(self, files):
+        """Learn initial estimates from persisted uploaded_files timings"""
+        for file_info in files:
+            self.record_latency(file_info.get('mime_type'), file_info.get('processing_seconds'))
+
+    def track(self, operation, mime_type=None, timeout=UPLOAD_OPERATION_TIMEOUT,
+              refresh=None, is_done=None, max_interval=None):
+        """Start tracking an operation.
+
+        Args:
+            operation: Operation returned by the SDK
+            mime_type (str): MIME type used for latency estimates
+            timeout (float): Seconds before the Future fails with TimeoutError
+            refresh (callable, optional): Returns the current state of the
+                resource (default: client.operations.get)
+            is_done (callable, optional): True once the resource is finished
+                (default: operation.done)
+            max_interval (float, optional): Longest delay between checks
+
+        Returns:
+            Future: Resolves with the finished operation
+        """
+        future = Future()
+        now = time.monotonic()
+        entry = {
+            'operation': operation,
+            'mime_type': mime_type,
+            'future': future,
+            'started': now,
+            'deadline': now + timeout,
+            'timeout': timeout,
+            'interval': self.min_interval,
+            'max_interval': max_interval or self.max_interval,
+            'refresh': refresh or _refresh_operation,
+            'is_done': is_done or _operation_done
+        }
+        if entry['is_done'](operation):
+            future.set_result(operation)
+            return future
+
+        estimate = self.estimate(mime_type)
+        first_delay = self.min_interval
+        if estimate:
+            first_delay = min(entry['max_interval'], max(self.min_interval, estimate * 0.8))
+        self._schedule(entry, now + first_delay)
+        return future
+
+    def wait(self, operation, mime_type=None, timeout=UPLOAD_OPERATION_TIMEOUT):
+        """Block until an operation finishes; raises TimeoutError after timeout"""
+        return self.track(operation, mime_type, timeout).result()
+
+    def _schedule(self, entry, when):
+        with self._cond:
+            self._seq += 1
+            heapq.heappush(self._heap, (when, self._seq, entry))
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='operation-poller', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _next_interval(self, entry):
+        interval = min(entry['max_interval'], entry['interval'] * self.backoff)
+        entry['interval'] = interval
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                when = self._heap[0][0]
+                now = time.monotonic()
+                if when > now:
+                    self._cond.wait(timeout=when - now)
+                    continue
+                _, _, entry = heapq.heappop(self._heap)
+
+            try:
+                self._poll(entry)
+            except Exception as e:
+                # Never let one entry kill the poller thread; fail its Future instead
+                logger.error(f"Error tracking operation: {e}")
+                if not entry['future'].done():
+                    entry['future'].set_exception(e)
+
+    def _poll(self, entry):
+        future = entry['future']
+        try:
+            entry['operation'] = entry['refresh'](entry['operation'])
+        except Exception as e:
+            logger.warning(f"Error polling operation: {e}")
+
+        now = time.monotonic()
+        if entry['is_done'](entry['operation']):
+            self.record_latency(entry['mime_type'], now - entry['started'])
+            future.set_result(entry['operation'])
+        elif now >= entry['deadline']:
+            logger.error(f"File processing timeout after {entry['timeout']:.0f}s")
+            future.set_exception(TimeoutError(
+                f"File processing timeout after {entry['timeout']:.0f} seconds. "
+                "The file may still be processing in the background."
+            ))
+        else:
+            when = min(entry['deadline'], now + self._next_interval(entry))
+            self._schedule(entry, when)
+
+
+operation_tracker = OperationTracker()
+
+
+def upload_operation_timeout(file_size, mime_type=None):
+    """Seconds to wait for an import: grows with file size and the MIME type's observed latency"""
+    timeout = UPLOAD_OPERATION_TIMEOUT + UPLOAD_TIMEOUT_PER_MB * (file_size or 0) / (1024 * 1024)
+    estimate = operation_tracker.estimate(mime_type)
+    if estimate:
+        timeout = max(timeout, 3 * estimate)
+    return timeout
+
+
+def chain_future(future, func, executor=None):
+    """Return a Future resolved with func(future.result()).
+
+    func runs on the given executor (or inline in the callback thread), so
+    post-processing never blocks the operation poller.
+    """
+    chained = Future()
+
+    def on_done(done):
+        def run():
+            try:
+                chained.set_result(func(done.result()))
+            except Exception as e:
+                chained.set_exception(e)
+
+        if executor is not None:
+            executor.submit(run)
+        else:
+            run()
+
+    future.add_done_callback(on_done)
+    return chained
+
+
+def gather_futures(futures):
+    """Return a Future resolved with the list of futures once all of them are done"""
+    futures = list(futures)
+    gathered = Future()
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def on_done(_):
+        with lock:
+            remaining[0] -= 1
+            finished = remaining[0] == 0
+        if finished:
+            gathered.set_result(futures)
+
+    if not futures:
+        gathered.set_result(futures)
+    for future in futures:
+        future.add_done_callback(on_done)
+    return gathered
+
+
+# ============================================
+# BACKGROUND JOBS - Trabajos en segundo plano
+# ============================================
+
+jobs = {}  # job_id -> job record
+jobs_lock = threading.Lock()
+upload_executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix='upload-worker')
+investigation_executor = ThreadPoolExecutor(max_workers=INVESTIGATION_WORKERS, thread_name_prefix='investigation-worker')
+
+
+class JobQueueFullError(Exception):
+    """Raised when MAX_PENDING_JOBS jobs are already queued or running"""
+
+
+def _prune_jobs():
+    """Drop finished jobs older than JOB_RETENTION_SECONDS. Caller must hold jobs_lock."""
+    cutoff = time.time() - JOB_RETENTION_SECONDS
+    expired = [
+        job_id for job_id, job in jobs.items()
+        if job['status'] in ('completed', 'failed') and job['updated_at'] < cutoff
+    ]
+    for job_id in expired:
+        del jobs[job_id]
+
+
+def create_job(job_type, **details):
+    """Register a new queued job - Registrar un nuevo trabajo en cola
+
+    Args:
+        job_type (str): Kind of job, e.g. 'upload'
+        **details: Extra fields stored in the job record (filename, store_name...)
+
+    Returns:
+        dict: Copy of the job record
+
+    Raises:
+        JobQueueFullError: If too many jobs are pending
+    """
+    with jobs_lock:
+        _prune_jobs()
+        pending = sum(1 for job in jobs.values() if job['status'] in ('queued', 'running'))
+        if pending >= MAX_PENDING_JOBS:
+            raise JobQueueFullError(f'Too many pending jobs ({pending}). Try again later.')
+
+        now = time.time()
+        job = {
+            'id': str(uuid.uuid4()),
+            'type': job_type,
+            'status': 'queued',
+            'created_at': now,
+            'updated_at': now,
+            'result': None,
+            'error': None
+        }
+        job.update(details)
+        jobs[job['id']] = job
+        return dict(job)
+
+
+def update_job(job_id, **fields):
+    """Update fields of a job record (thread-safe)"""
+    with jobs_lock:
+        job = jobs.get(job_id)
+        if job is not None:
+            job.update(fields)
+            job['updated_at'] = time.time()
+
+
+def get_job(job_id):
+    """Return a copy of a job record, or None if unknown or expired"""
+    with jobs_lock:
+        job = jobs.get(job_id)
+        return dict(job) if job is not None else None
+
+
+def complete_job_with(job_id, future):
+    """Record a Future's result or error on a job once it resolves"""
+    def finish(done):
+        try:
+            update_job(job_id, status='completed', result=done.result())
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {str(e)}")
+            update_job(job_id, status='failed', error=str(e))
+
+    future.add_done_callback(finish)
+
+
+def submit_job(executor, job_id, func, *args, **kwargs):
+    """Run func in the given executor, recording its result or error on the job.
+
+    func may return a Future; the job then completes when that Future does.
+    """
+    def runner():
+        update_job(job_id, status='running')
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {str(e)}")
+            update_job(job_id, status='failed', error=str(e))
+            return
+
+        # A returned Future means the job continues asynchronously (e.g. waiting on
+        # the operation tracker) and the worker can be released right away
+        if isinstance(result, Future):
+            complete_job_with(job_id, result)
+        else:
+            update_job(job_id, status='completed', result=result)
+
+    return executor.submit(runner)
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    """Get the status of a background job - Estado de un trabajo en segundo plano"""
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({'error': f'Job not found: {job_id}'}), 404
+    return jsonify({'success': True, 'job': job})
 
 # ============================================
 # MAIN ROUTES - Rutas principales
@@ -372,271 +2343,1346 @@ def index():
 
 # ============================================
 # FILE UPLOAD WITH PERSISTENCE - Carga de archivos con persistencia
-# Timeout de 120 segundos configurado
+# Processed in the upload worker pool - Procesado en el pool de subidas
+# Timeout de importación según tamaño (UPLOAD_OPERATION_TIMEOUT + UPLOAD_TIMEOUT_PER_MB)
+# ============================================
+
+def _build_upload_config(filename, custom_metadata, chunking_config):
+    """Build the upload_to_file_search_store config for a file.
+
+    Args:
+        filename (str): Display name for the document
+        custom_metadata (dict): Custom metadata to attach
+        chunking_config (dict): Chunking configuration from the UI
+
+    Returns:
+        dict: Upload config (display_name, custom_metadata, chunking_config)
+    """
+    # Build upload config WITHOUT MIME type (will be auto-detected)
+    upload_config = {
+        'display_name': filename
+    }
+
+    # Add custom metadata if provided
+    if custom_metadata:
+        metadata_list = []
+        for key, value in custom_metadata.items():
+            if isinstance(value, (int, float)):
+                metadata_list.append({"key": key, "numeric_value": value})
+            else:
+                metadata_list.append({"key": key, "string_value": str(value)})
+        upload_config['custom_metadata'] = metadata_list
+
+    # Add chunking config if provided
+    if chunking_config and chunking_config.get('enabled'):
+        upload_config['chunking_config'] = {
+            'white_space_config': {
+                'max_tokens_per_chunk': chunking_config.get('max_tokens_per_chunk', 200),
+                'max_overlap_tokens': chunking_config.get('max_overlap_tokens', 20)
+            }
+        }
+
+    return upload_config
+
+
+def _start_upload_operation(source, filename, mime_type, upload_config, target_store_name):
+    """Start the File Search import for a file without waiting for it.
+
+    Tries the direct upload first and falls back to Files API + importFile.
+    source is a local path or a binary stream (spooled upload, request body);
+    streams are sent with an explicit MIME type since the SDK cannot guess it.
+
+    Returns:
+        tuple: (operation, uploaded_api_file) - uploaded_api_file is None
+            unless the fallback was used
+    """
+    # TRY DIRECT UPLOAD FIRST (upload_to_file_search_store)
+    try:
+        logger.info(f"Attempting direct upload for {filename} (MIME type will be auto-detected)")
+        operation = client.file_search_stores.upload_to_file_search_store(
+            file=source,
+            file_search_store_name=target_store_name,
+            config=upload_config if isinstance(source, str) else dict(upload_config, mime_type=mime_type)
+        )
+        return operation, None
+    except Exception as upload_error:
+        # FALLBACK: Use Files API + importFile for problematic files (CSV, large files, etc.)
+        logger.warning(f"Direct upload failed: {upload_error}")
+        logger.info(f"Falling back to Files API + importFile method for {filename}")
+        if not isinstance(source, str):
+            # Re-read the stream from the start (a request body cannot be rewound)
+            try:
+                source.seek(0)
+            except (OSError, io.UnsupportedOperation):
+                raise upload_error
+
+    uploaded_api_file = None
+    try:
+        # Upload to Files API with explicit MIME type
+        uploaded_api_file = client.files.upload(
+            file=source,
+            config={
+                'mime_type': mime_type,  # Files API DOES accept mime_type
+                'display_name': filename
+            }
+        )
+        logger.info(f"File uploaded to Files API: {uploaded_api_file.name}")
+
+        # Import to File Search Store (importFile has different config schema)
+        import_config_fallback = {}
+
+        # importFile accepts custom_metadata and chunking_config, but NOT display_name
+        if upload_config.get('custom_metadata'):
+            import_config_fallback['custom_metadata'] = upload_config['custom_metadata']
+        if upload_config.get('chunking_config'):
+            import_config_fallback['chunking_config'] = upload_config['chunking_config']
+
+        operation = client.file_search_stores.import_file(
+            file_search_store_name=target_store_name,
+            file_name=uploaded_api_file.name,
+            config=import_config_fallback if import_config_fallback else None
+        )
+        logger.info(f"Importing {filename} into File Search Store via importFile")
+        return operation, uploaded_api_file
+
+    except Exception as fallback_error:
+        logger.error(f"Fallback method also failed: {fallback_error}")
+        if uploaded_api_file:
+            _delete_api_file(uploaded_api_file)
+        raise fallback_error
+
+
+def _operation_document_id(operation):
+    """Return the document ID of a finished import operation, raising on operation error"""
+    # Check for operation errors
+    if hasattr(operation, 'error') and operation.error:
+        error_msg = getattr(operation.error, 'message', str(operation.error))
+        logger.error(f"Upload operation failed: {error_msg}")
+        raise Exception(f'Upload failed: {error_msg}')
+
+    # Extract document ID from operation response
+    document_id = None
+    if hasattr(operation, 'response') and operation.response:
+        document_id = getattr(operation.response, 'name', None)
+    return document_id
+
+
+def _delete_api_file(uploaded_api_file, api_client=None):
+    """Best-effort cleanup of a temporary Files API upload"""
+    try:
+        (api_client or client).files.delete(name=uploaded_api_file.name)
+        logger.info(f"Cleaned up temporary file: {uploaded_api_file.name}")
+    except Exception:
+        pass
+
+
+def _build_file_info(filename, file_size, mime_type, custom_metadata, chunking_config, document_id,
+                     processing_seconds=None, content_hash=None, source=None):
+    """Build the uploaded_files tracking entry for an imported file"""
+    file_info = {
+        'sha256': content_hash,
+        'filename': filename,
+        'size': file_size,
+        'mime_type': mime_type,  # Store MIME type for debugging
+        'uploaded_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'custom_metadata': custom_metadata,
+        'chunking_config': chunking_config if chunking_config.get('enabled') else None,
+        'document_id': document_id,
+        'processing_seconds': processing_seconds  # Feeds the operation tracker estimates
+    }
+    if source:
+        file_info['source'] = source  # e.g. 'url' for documents imported from the web
+    return file_info
+
+
+def _process_upload(source, filename, file_size, custom_metadata, chunking_config, target_store_name,
+                    origin=None):
+    """Upload a file to a File Search store and hand the import to the operation tracker.
+
+    Runs in the upload worker pool, off the request path (or in the request
+    thread for /upload-stream). The worker is released as soon as the import
+    operation has started; the returned Future resolves when the operation
+    tracker sees it finish.
+
+    Args:
+        source (str or IOBase): Local path or binary stream; removed/closed afterwards
+        filename (str): Secure filename used as display name
+        file_size (int): Size in bytes
+        custom_metadata (dict): Custom metadata to attach
+        chunking_config (dict): Chunking configuration from the UI
+        target_store_name (str): File Search store resource name
+        origin (str, optional): Recorded as the tracked file's 'source' (e.g. 'url')
+
+    Returns:
+        Future: Resolves with the upload result (document_id, store_name, mime_type...)
+    """
+    try:
+        # Detect MIME type explicitly (CRITICAL for CSV, XLSX, etc.)
+        mime_type = get_mime_type(filename)
+        logger.info(f"Detected MIME type: {mime_type} for {filename}")
+
+        upload_config = _build_upload_config(filename, custom_metadata, chunking_config)
+        operation, uploaded_api_file = _start_upload_operation(
+            source, filename, mime_type, upload_config, target_store_name
+        )
+        content_hash = source.content_hash() if hasattr(source, 'content_hash') else None
+    finally:
+        # Clean up local copy - the bytes are already uploaded
+        _release_upload_source(source)
+
+    started = time.monotonic()
+
+    def finalize(finished_operation):
+        try:
+            document_id = _operation_document_id(finished_operation)
+        except Exception:
+            # Clean up API file if uploaded in fallback
+            if uploaded_api_file:
+                _delete_api_file(uploaded_api_file)
+            raise
+
+        # Track uploaded file - IMPORTANT: also saved to persistence - Guardar estado
+        state.add_file(_build_file_info(
+            filename, file_size, mime_type, custom_metadata, chunking_config, document_id,
+            processing_seconds=round(time.monotonic() - started, 2), content_hash=content_hash,
+            source=origin
+        ))
+        if content_hash:
+            record_content_hash(target_store_name, content_hash, document_id, filename, file_size)
+
+        notify_store_changed(target_store_name)
+        logger.info(f"File {filename} successfully uploaded and imported")
+
+        return {
+            'message': f'File "{filename}" uploaded and processed successfully',
+            'filename': filename,
+            'file_size': file_size,
+            'mime_type': mime_type,
+            'store_name': target_store_name,
+            'document_id': document_id
+        }
+
+    def cleanup_on_timeout(future):
+        if uploaded_api_file and isinstance(future.exception(), TimeoutError):
+            _delete_api_file(uploaded_api_file)
+
+    # Wait for operation to complete - timeout scaled to the file size
+    logger.info("Waiting for file import to complete")
+    tracked = operation_tracker.track(operation, mime_type, timeout=upload_operation_timeout(file_size, mime_type))
+    tracked.add_done_callback(cleanup_on_timeout)
+    return chain_future(tracked, finalize, upload_executor)
+
+
+def _release_upload_source(source):
+    """Remove a temporary upload file or close an upload stream"""
+    if isinstance(source, str):
+        if os.path.exists(source):
+            os.remove(source)
+    else:
+        source.close()
+
+
+def _detach_upload_stream(file_storage):
+    """Take over the spooled buffer of an uploaded file so it outlives the request.
+
+    Flask closes request files when the request ends; the upload worker
+    needs the buffer until the bytes are sent.
+
+    Returns:
+        tuple: (stream positioned at 0, size in bytes)
+    """
+    stream = file_storage.stream
+    file_storage.stream = io.BytesIO()
+    size = stream.seek(0, os.SEEK_END)
+    stream.seek(0)
+    return stream, size
+
+
+class RequestBodyStream(io.RawIOBase):
+    """Forward-only reader over a request body of known length.
+
+    Answers the SDK's size probe (seek to end, tell, seek back) from
+    Content-Length, then hands out the body chunk by chunk as it arrives,
+    so the upload to the API starts before the client has finished sending.
+    """
+
+    def __init__(self, stream, length):
+        self._stream = stream
+        self._length = length
+        self._position = 0
+        self._probing_end = False
+        self._sha256 = hashlib.sha256()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._length if self._probing_end else self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_END and offset == 0:
+            self._probing_end = True
+            return self._length
+        if whence == io.SEEK_SET and offset == self._position:
+            self._probing_end = False
+            return self._position
+        raise io.UnsupportedOperation('Request body can only be read forward')
+
+    def read(self, size=-1):
+        remaining = self._length - self._position
+        size = remaining if size is None or size < 0 else min(size, remaining)
+        parts = []
+        # Fill the whole chunk: resumable uploads expect full-size chunks
+        while size > 0:
+            data = self._stream.read(size)
+            if not data:
+                break
+            parts.append(data)
+            self._sha256.update(data)
+            size -= len(data)
+            self._position += len(data)
+        return b''.join(parts)
+
+    def content_hash(self):
+        """SHA-256 of the body, once it has been read completely"""
+        return self._sha256.hexdigest() if self._position == self._length else None
+
+    def drain(self, chunk_size=1024 * 1024):
+        """Read the rest of the body without keeping it; returns its SHA-256"""
+        while self.read(chunk_size):
+            pass
+        return self.content_hash()
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def find_duplicate_upload(store_name, content_hash):
+    """Document already indexed in store_name with the same content, or None.
+
+    Hash entries whose document was deleted outside this app are dropped.
+    """
+    if not store_name or not content_hash:
+        return None
+    existing = find_content_hash(store_name, content_hash)
+    if existing is None:
+        return None
+    try:
+        client.file_search_stores.documents.get(name=existing['document_id'])
+    except Exception:
+        logger.info(f"Dropping stale content hash for {existing['document_id']}")
+        forget_content_hashes(document_id=existing['document_id'])
+        return None
+    return existing
+
+
+def duplicate_upload_response(existing, filename, file_size, store_name, custom_metadata, on_duplicate):
+    """Short-circuit an upload whose content is already indexed in the store.
+
+    With on_duplicate='update_metadata' the new metadata is merged into the
+    existing document's local metadata instead of re-indexing the file.
+
+    Returns:
+        dict: JSON payload with the existing document_id and bytes_saved
+    """
+    document_id = existing['document_id']
+    metadata_updated = False
+    if on_duplicate == 'update_metadata' and custom_metadata:
+        state.update_metadata(document_id, {**(state.local_metadata(document_id) or {}), **custom_metadata})
+        notify_store_changed(store_name)
+        metadata_updated = True
+
+    add_dedup_bytes_saved(file_size)
+    logger.info(f"Skipped duplicate upload {filename}: same content as {document_id} ({file_size} bytes saved)")
+    return {
+        'success': True,
+        'duplicate': True,
+        'message': f'File "{filename}" is already indexed as "{existing["filename"]}"',
+        'document_id': document_id,
+        'existing_filename': existing['filename'],
+        'filename': filename,
+        'file_size': file_size,
+        'store_name': store_name,
+        'bytes_saved': file_size,
+        'metadata_updated': metadata_updated
+    }
+
+
+def _resolve_upload_store(store_name_param):
+    """Return the store name to upload into, creating the default store if needed"""
+    if store_name_param:
+        # Use the specified store
+        logger.info(f"Using specified store: {store_name_param}")
+        return store_name_param
+
+    def create_default_store():
+        # Create new default store if none exists
+        logger.info("Creating new file search store")
+        return client.file_search_stores.create(
+            config={'display_name': 'RAG-App-Store'}
+        )
+
+    return state.ensure_store(create_default_store).name
+
+
+@app.route('/upload', methods=['POST'])
+def upload_file():
+    """Queue a file for upload and return a job ID right away - Encolar subida de archivo
+
+    The upload, the Files API fallback and the operation polling run in the
+    upload worker pool. Poll GET /jobs/<job_id> for the result.
+
+    Content already indexed in the target store (same SHA-256) is not
+    uploaded again: the response is 200 with duplicate=true and the existing
+    document_id. Form field on_duplicate: 'skip' (default), 'update_metadata'
+    (merge the new metadata into the existing document) or 'upload' (always
+    upload).
+    """
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file provided'}), 400
+
+    file = request.files['file']
+
+    if file.filename == '':
+        return jsonify({'error': 'No file selected'}), 400
+
+    if not allowed_file(file.filename):
+        return jsonify({'error': 'File type not supported'}), 400
+
+    stream = None
+
+    try:
+        # Get custom metadata and chunking config from request
+        metadata_json = request.form.get('metadata', '{}')
+        chunking_json = request.form.get('chunking_config', '{}')
+        store_name_param = request.form.get('store_name', '')
+        custom_metadata = json.loads(metadata_json)
+        chunking_config = json.loads(chunking_json)
+
+        # Hand the spooled upload buffer to the worker (no copy into uploads/)
+        filename = secure_filename(file.filename)
+        stream, file_size = _detach_upload_stream(file)
+        logger.info(f"File received: {filename}, size: {file_size} bytes")
+
+        # Determine which store to use
+        target_store_name = _resolve_upload_store(store_name_param)
+
+        # Same content already indexed in this store: skip the upload
+        on_duplicate = request.form.get('on_duplicate', 'skip')
+        if on_duplicate != 'upload':
+            existing = find_duplicate_upload(target_store_name, stream.content_hash())
+            if existing:
+                stream.close()
+                return jsonify(duplicate_upload_response(
+                    existing, filename, file_size, target_store_name, custom_metadata, on_duplicate
+                ))
+
+        job = create_job('upload', filename=filename, store_name=target_store_name)
+        submit_job(
+            upload_executor, job['id'], _process_upload,
+            stream, filename, file_size, custom_metadata, chunking_config, target_store_name
+        )
+        logger.info(f"Queued upload job {job['id']} for {filename}")
+
+        return jsonify({
+            'success': True,
+            'message': f'File "{filename}" queued for processing',
+            'job_id': job['id'],
+            'status': job['status'],
+            'status_url': f"/jobs/{job['id']}",
+            'filename': filename,
+            'file_size': file_size,
+            'store_name': target_store_name
+        }), 202
+
+    except JobQueueFullError as e:
+        logger.warning(f"Upload rejected: {str(e)}")
+        if stream is not None:
+            stream.close()
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        logger.error(f"Error uploading file: {str(e)}")
+        # Release the buffer if it was not handed to a worker
+        if stream is not None:
+            stream.close()
+        return jsonify({'error': f'Error uploading file: {str(e)}'}), 500
+
+
+@app.route('/upload-stream', methods=['POST'])
+def upload_stream():
+    """Upload a raw request body, forwarding it to the API as it arrives - Subida en streaming
+
+    The body is the file itself (any Content-Type), so no multipart parsing
+    or temp buffer is involved: the SDK reads it in fixed-size chunks while
+    the client is still sending. Returns 202 once the bytes are uploaded;
+    the import is then tracked like /upload.
+
+    Query params (or X-Filename / X-Metadata / X-Chunking-Config / X-Store-Name /
+    X-Content-SHA256 / X-On-Duplicate headers):
+        filename (str): Original filename (required)
+        metadata (JSON string, optional): Custom metadata
+        chunking_config (JSON string, optional): Chunking configuration
+        store_name (str, optional): Target store; defaults to the current store
+        sha256 (str, optional): Content hash; known content is not uploaded again.
+            The body is still received and hashed: a mismatch is rejected
+            with 400 and nothing is uploaded.
+        on_duplicate (str, optional): skip, update_metadata or upload (see /upload)
+    """
+    def param(name, header):
+        return request.args.get(name) or request.headers.get(header, '')
+
+    filename = secure_filename(param('filename', 'X-Filename'))
+    if not filename:
+        return jsonify({'error': 'No filename provided'}), 400
+    if not allowed_file(filename):
+        return jsonify({'error': 'File type not supported'}), 400
+
+    file_size = request.content_length
+    if not file_size:
+        return jsonify({'error': 'Content-Length is required'}), 411
+    if file_size > MAX_FILE_SIZE:
+        return jsonify({'error': f'File too large (max {MAX_FILE_SIZE // (1024 * 1024)} MB)'}), 413
+
+    try:
+        custom_metadata = json.loads(param('metadata', 'X-Metadata') or '{}')
+        chunking_config = json.loads(param('chunking_config', 'X-Chunking-Config') or '{}')
+        target_store_name = _resolve_upload_store(param('store_name', 'X-Store-Name'))
+
+        body = RequestBodyStream(request.stream, file_size)
+
+        # The body is hashed while it is forwarded, so only a client-supplied
+        # hash can short-circuit the upload here. It is never trusted: the body
+        # is drained and hashed (not uploaded) and must match before the
+        # existing document is returned or its metadata touched.
+        on_duplicate = param('on_duplicate', 'X-On-Duplicate') or 'skip'
+        claimed_hash = param('sha256', 'X-Content-SHA256').lower()
+        if on_duplicate != 'upload':
+            existing = find_duplicate_upload(target_store_name, claimed_hash)
+            if existing:
+                if body.drain() != claimed_hash:
+                    return jsonify({'error': 'Body does not match the supplied SHA-256'}), 400
+                return jsonify(duplicate_upload_response(
+                    existing, filename, file_size, target_store_name, custom_metadata, on_duplicate
+                ))
+
+        job = create_job('upload', filename=filename, store_name=target_store_name)
+        update_job(job['id'], status='running')
+        logger.info(f"Streaming upload {filename} ({file_size} bytes) as job {job['id']}")
+
+        # Blocks only while the body is being received and forwarded
+        try:
+            tracked = _process_upload(
+                body, filename, file_size, custom_metadata, chunking_config, target_store_name
+            )
+        except Exception as e:
+            update_job(job['id'], status='failed', error=str(e))
+            raise
+        complete_job_with(job['id'], tracked)
+
+        return jsonify({
+            'success': True,
+            'message': f'File "{filename}" uploaded, processing',
+            'job_id': job['id'],
+            'status': 'running',
+            'status_url': f"/jobs/{job['id']}",
+            'filename': filename,
+            'file_size': file_size,
+            'store_name': target_store_name
+        }), 202
+
+    except JobQueueFullError as e:
+        logger.warning(f"Upload rejected: {str(e)}")
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        logger.error(f"Error streaming upload: {str(e)}")
+        return jsonify({'error': f'Error uploading file: {str(e)}'}), 500
+
+# ============================================
+# BATCH UPLOAD - Carga de múltiples archivos en lote
+# ============================================
+
+def _extract_zip_members(zip_path, dest_dir, max_files):
+    """Extract supported files from a zip archive into dest_dir.
+
+    Directory structure is flattened and names are sanitized (no zip-slip).
+    Members that are unsupported, empty or larger than MAX_FILE_SIZE are skipped.
+    Each member is hashed (SHA-256) while it is written out.
+
+    Returns:
+        tuple: (list of (filepath, filename, size, sha256), list of skipped names)
+    """
+    extracted = []
+    skipped = []
+    with zipfile.ZipFile(zip_path) as archive:
+        for member in archive.infolist():
+            if member.is_dir():
+                continue
+            filename = secure_filename(os.path.basename(member.filename))
+            if not filename or not allowed_file(filename) or filename.lower().endswith('.zip'):
+                skipped.append(member.filename)
+                continue
+            if member.file_size == 0 or member.file_size > MAX_FILE_SIZE:
+                skipped.append(member.filename)
+                continue
+            if len(extracted) >= max_files:
+                skipped.append(member.filename)
+                continue
+
+            filepath = os.path.join(dest_dir, f"{len(extracted)}_{filename}")
+            sha256 = hashlib.sha256()
+            with archive.open(member) as src, open(filepath, 'wb') as dst:
+                for block in iter(lambda: src.read(1024 * 1024), b''):
+                    sha256.update(block)
+                    dst.write(block)
+            extracted.append((filepath, filename, member.file_size, sha256.hexdigest()))
+    return extracted, skipped
+
+
+def _process_upload_batch(job_id, batch_dir, entries, custom_metadata, chunking_config,
+                          target_store_name, parallelism):
+    """Upload many saved files concurrently and poll their operations together.
+
+    Uploads are started by a pool of `parallelism` threads and every import
+    operation is handed to the shared operation tracker; the worker is
+    released once every upload has started. Tracked files are added to the
+    state database in one transaction for the whole batch, and each file's
+    content hash is recorded so later uploads of the same bytes are
+    deduplicated.
+
+    Args:
+        job_id (str): Batch job ID (for progress updates)
+        batch_dir (str): Folder holding the batch files (removed at the end)
+        entries (list): (filepath, filename, size, sha256) tuples
+        custom_metadata (dict): Metadata applied to every file
+        chunking_config (dict): Chunking configuration applied to every file
+        target_store_name (str): File Search store resource name
+        parallelism (int): Max concurrent uploads
+
+    Returns:
+        Future: Resolves with the batch summary and per-file results
+    """
+    results = [None] * len(entries)
+    started = {}  # index -> (tracked future, uploaded_api_file, mime_type)
+
+    def start(index):
+        filepath, filename, file_size, _ = entries[index]
+        mime_type = get_mime_type(filename)
+        upload_config = _build_upload_config(filename, custom_metadata, chunking_config)
+        operation, uploaded_api_file = _start_upload_operation(
+            filepath, filename, mime_type, upload_config, target_store_name
+        )
+        start_time = time.monotonic()
+        tracked = chain_future(
+            operation_tracker.track(operation, mime_type, timeout=upload_operation_timeout(file_size, mime_type)),
+            lambda finished: (finished, round(time.monotonic() - start_time, 2))
+        )
+        return tracked, uploaded_api_file, mime_type
+
+    def collect(_):
+        try:
+            new_files = []
+            for index, (tracked, uploaded_api_file, mime_type) in started.items():
+                _, filename, file_size, content_hash = entries[index]
+                try:
+                    finished_operation, processing_seconds = tracked.result()
+                    document_id = _operation_document_id(finished_operation)
+                    new_files.append(_build_file_info(
+                        filename, file_size, mime_type, custom_metadata, chunking_config, document_id,
+                        processing_seconds=processing_seconds, content_hash=content_hash
+                    ))
+                    results[index] = {
+                        'filename': filename,
+                        'success': True,
+                        'file_size': file_size,
+                        'mime_type': mime_type,
+                        'document_id': document_id
+                    }
+                except Exception as e:
+                    results[index] = {'filename': filename, 'success': False, 'error': str(e)}
+                    if uploaded_api_file:
+                        _delete_api_file(uploaded_api_file)
+
+            # Track and persist once per batch - Guardar estado una sola vez
+            if new_files:
+                state.add_files(new_files)
+                for file_info in new_files:
+                    record_content_hash(target_store_name, file_info['sha256'], file_info['document_id'],
+                                        file_info['filename'], file_info['size'])
+                notify_store_changed(target_store_name)
+
+            succeeded = sum(1 for r in results if r['success'])
+            logger.info(f"Batch {job_id} finished: {succeeded}/{len(entries)} files imported")
+
+            return {
+                'message': f'{succeeded} of {len(entries)} files uploaded and processed successfully',
+                'store_name': target_store_name,
+                'total': len(entries),
+                'succeeded': succeeded,
+                'failed': len(entries) - succeeded,
+                'files': results
+            }
+        finally:
+            shutil.rmtree(batch_dir, ignore_errors=True)
+
+    try:
+        # 1. Start all uploads with bounded parallelism
+        with ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix='batch-upload') as executor:
+            futures = {executor.submit(start, i): i for i in range(len(entries))}
+            for future in as_completed(futures):
+                index = futures[future]
+                filename = entries[index][1]
+                try:
+                    started[index] = future.result()
+                except Exception as e:
+                    logger.error(f"Batch upload failed for {filename}: {str(e)}")
+                    results[index] = {'filename': filename, 'success': False, 'error': str(e)}
+                update_job(job_id, started=len(started), failed=sum(1 for r in results if r))
+    except BaseException:
+        shutil.rmtree(batch_dir, ignore_errors=True)
+        raise
+
+    # 2. The operation tracker polls every pending operation together; results
+    #    are collected when the last one finishes, without holding this worker
+    logger.info(f"Batch {job_id}: waiting for {len(started)} import operation(s)")
+    return chain_future(gather_futures([tracked for tracked, _, _ in started.values()]), collect)
+
+
+@app.route('/upload-batch', methods=['POST'])
+def upload_batch():
+    """Queue many files (or zip archives) for concurrent upload - Subida en lote
+
+    Form fields:
+        files: One or more files; zip archives are expanded unless extract_zip=false
+        metadata (JSON string, optional): Metadata applied to every file
+        chunking_config (JSON string, optional): Chunking configuration
+        store_name (optional): Target store; defaults to the current store
+        parallelism (int, optional): Concurrent uploads, capped at BATCH_MAX_PARALLELISM
+
+    Returns 202 with a job_id; poll GET /jobs/<job_id> for per-file results.
+    """
+    files = request.files.getlist('files') or request.files.getlist('file')
+    files = [f for f in files if f.filename]
+    if not files:
+        return jsonify({'error': 'No files provided'}), 400
+
+    try:
+        parallelism = int(request.form.get('parallelism', BATCH_MAX_PARALLELISM))
+    except (ValueError, TypeError):
+        parallelism = BATCH_MAX_PARALLELISM
+    parallelism = max(1, min(BATCH_MAX_PARALLELISM, parallelism))
+    extract_zip = request.form.get('extract_zip', 'true').lower() != 'false'
+
+    batch_dir = tempfile.mkdtemp(prefix='batch_', dir=app.config['UPLOAD_FOLDER'])
+
+    try:
+        custom_metadata = json.loads(request.form.get('metadata', '{}'))
+        chunking_config = json.loads(request.form.get('chunking_config', '{}'))
+
+        # Save every file (expanding zips) into the batch folder
+        entries = []
+        skipped = []
+        for file in files:
+            filename = secure_filename(file.filename)
+            if not filename or not allowed_file(filename):
+                skipped.append(file.filename)
+                continue
+            if len(entries) >= BATCH_MAX_FILES:
+                skipped.append(file.filename)
+                continue
+
+            filepath = os.path.join(batch_dir, f"{len(entries)}_{filename}")
+            file.save(filepath)
+
+            if extract_zip and filename.lower().endswith('.zip'):
+                try:
+                    extracted, zip_skipped = _extract_zip_members(
+                        filepath, batch_dir, BATCH_MAX_FILES - len(entries)
+                    )
+                except zipfile.BadZipFile:
+                    os.remove(filepath)
+                    skipped.append(file.filename)
+                    continue
+                os.remove(filepath)
+                entries.extend(extracted)
+                skipped.extend(zip_skipped)
+            else:
+                entries.append((filepath, filename, os.path.getsize(filepath),
+                                uploaded_file_hash(file, filepath)))
+
+        if not entries:
+            shutil.rmtree(batch_dir, ignore_errors=True)
+            return jsonify({'error': 'No supported files in batch', 'skipped': skipped}), 400
+
+        target_store_name = _resolve_upload_store(request.form.get('store_name', ''))
+
+        job = create_job('upload_batch', store_name=target_store_name, total=len(entries),
+                         started=0, failed=0)
+        submit_job(
+            upload_executor, job['id'], _process_upload_batch, job['id'], batch_dir, entries,
+            custom_metadata, chunking_config, target_store_name, parallelism
+        )
+        logger.info(f"Queued batch job {job['id']} with {len(entries)} files (parallelism={parallelism})")
+
+        return jsonify({
+            'success': True,
+            'message': f'{len(entries)} files queued for processing',
+            'job_id': job['id'],
+            'status': job['status'],
+            'status_url': f"/jobs/{job['id']}",
+            'total': len(entries),
+            'skipped': skipped,
+            'parallelism': parallelism,
+            'store_name': target_store_name
+        }), 202
+
+    except JobQueueFullError as e:
+        logger.warning(f"Batch upload rejected: {str(e)}")
+        shutil.rmtree(batch_dir, ignore_errors=True)
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        logger.error(f"Error in batch upload: {str(e)}")
+        shutil.rmtree(batch_dir, ignore_errors=True)
+        return jsonify({'error': f'Error uploading files: {str(e)}'}), 500
+
 # ============================================
+# IMPORT FROM URL - Importar desde URL
+# Pooled connections, per-host limits and resumable downloads
+# ============================================
+
+class URLImportError(Exception):
+    """Raised for URLs that cannot be imported (invalid, internal network, too large)"""
+
+
+class HostLimiter:
+    """Caps concurrent downloads per host so bulk imports stay polite to each server"""
+
+    def __init__(self, per_host):
+        self._per_host = max(1, per_host)
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    def slot(self, host):
+        """Semaphore for host; use as a context manager around the download"""
+        with self._lock:
+            semaphore = self._slots.get(host)
+            if semaphore is None:
+                semaphore = self._slots[host] = threading.BoundedSemaphore(self._per_host)
+            return semaphore
+
+
+def _build_http_session():
+    """Shared requests.Session with a connection pool sized for URL_IMPORT_WORKERS"""
+    session = http_requests.Session()
+    adapter = HTTPAdapter(pool_connections=URL_IMPORT_WORKERS, pool_maxsize=URL_IMPORT_WORKERS)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    # Uncompressed transfers keep byte offsets valid for Range resumes
+    session.headers['Accept-Encoding'] = 'identity'
+    return session
+
+
+http_session = _build_http_session()
+url_host_limiter = HostLimiter(URL_IMPORT_PER_HOST)
+
+_RESUMABLE_ERRORS = (
+    http_requests.exceptions.ConnectionError,
+    http_requests.exceptions.ChunkedEncodingError,
+    http_requests.exceptions.Timeout,
+    Urllib3HTTPError
+)
+
+
+def validate_import_url(url):
+    """Check that url is HTTP(S) and does not point to a private/internal network.
+
+    Returns:
+        str: Hostname of the URL
+
+    Raises:
+        URLImportError: If the URL is not importable (SSRF protection)
+    """
+    if not url.startswith(('http://', 'https://')):
+        raise URLImportError('URL must start with http:// or https://')
+
+    # SSRF protection: block private/internal IPs
+    from urllib.parse import urlparse
+    import socket
+    import ipaddress
+    try:
+        hostname = urlparse(url).hostname
+        if not hostname:
+            raise URLImportError('Invalid URL')
+        ip = socket.gethostbyname(hostname)
+        addr = ipaddress.ip_address(ip)
+        if addr.is_private or addr.is_loopback or addr.is_link_local:
+            raise URLImportError('URLs pointing to private/internal networks are not allowed')
+    except (socket.gaierror, ValueError) as e:
+        raise URLImportError(f'Cannot resolve hostname: {str(e)}')
+    return hostname
+
+
+def url_filename(url, content_type=None):
+    """Secure filename for a downloaded URL, with an extension guessed from Content-Type if missing"""
+    filename = secure_filename(url.split('/')[-1].split('?')[0]) or 'downloaded_file'
+    if '.' not in filename and content_type:
+        extension = mimetypes.guess_extension(content_type.split(';')[0].strip())
+        if extension:
+            filename += extension
+    return filename
+
+
+def _get_following_redirects(url, headers):
+    """GET url, following redirects by hand so every hop passes validate_import_url.
+
+    Automatic redirects would let a public URL bounce the download to a
+    private or internal address (SSRF).
+
+    Returns:
+        tuple: (streamed response, final URL after redirects)
 
-@app.route('/upload', methods=['POST'])
-def upload_file():
-    global file_search_store, uploaded_files
+    Raises:
+        URLImportError: If a redirect target is not importable or there are too many hops
+    """
+    for _ in range(URL_MAX_REDIRECTS + 1):
+        resp = http_session.get(url, headers=headers, timeout=URL_DOWNLOAD_TIMEOUT, stream=True,
+                                allow_redirects=False)
+        if not resp.is_redirect:
+            return resp, url
+        location = urljoin(url, resp.headers['Location'])
+        resp.close()
+        validate_import_url(location)
+        logger.info(f"Following redirect {url} -> {location}")
+        url = location
+    raise URLImportError(f'Too many redirects (more than {URL_MAX_REDIRECTS})')
 
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file provided'}), 400
 
-    file = request.files['file']
+def _read_response_body(resp, buffer, size, max_size):
+    """Append a streamed response body to buffer with adaptive chunk sizes.
 
-    if file.filename == '':
-        return jsonify({'error': 'No file selected'}), 400
+    Chunks double while reads return quickly (fewer, larger writes on fast
+    links) and halve when a read stalls, between URL_CHUNK_MIN and URL_CHUNK_MAX.
 
-    if not allowed_file(file.filename):
-        return jsonify({'error': 'File type not supported'}), 400
+    Returns:
+        int: Total bytes in buffer
+    """
+    chunk_size = URL_CHUNK_MIN
+    while True:
+        read_started = time.monotonic()
+        chunk = resp.raw.read(chunk_size, decode_content=True)
+        if not chunk:
+            return size
+        size += len(chunk)
+        if size > max_size:
+            raise URLImportError(f'File exceeds {max_size // (1024 * 1024)} MB limit')
+        buffer.write(chunk)
+
+        elapsed = time.monotonic() - read_started
+        if elapsed < 0.05 and chunk_size < URL_CHUNK_MAX:
+            chunk_size *= 2
+        elif elapsed > 1.0 and chunk_size > URL_CHUNK_MIN:
+            chunk_size //= 2
+
+
+def download_url(url, max_size=MAX_FILE_SIZE, conditional_headers=None):
+    """Download a URL into a spooled buffer, hashing it on the way.
+
+    Uses the pooled http_session. When the connection drops mid-transfer the
+    download resumes with an HTTP Range request (guarded by If-Range with the
+    ETag/Last-Modified of the first response) up to URL_DOWNLOAD_RETRIES
+    times; servers that ignore the range make it start over. Redirects are
+    followed by hand and every hop is re-validated (see _get_following_redirects);
+    resumes go straight to the final URL.
+
+    Args:
+        url (str): Validated HTTP(S) URL
+        max_size (int): Maximum size in bytes
+        conditional_headers (dict, optional): If-None-Match / If-Modified-Since
+            sent with the first request
 
-    filepath = None
+    Returns:
+        tuple: (HashingSpooledFile positioned at 0, size in bytes, response headers);
+            the buffer is None when the server answered 304 Not Modified
 
+    Raises:
+        URLImportError: If the file is too large or a redirect is not importable
+        requests.exceptions.RequestException: On HTTP errors or when retries are exhausted
+            (connection errors raised by urllib3 while reading the body are re-raised as is)
+    """
+    def new_buffer():
+        return HashingSpooledFile(max_size=UPLOAD_SPOOL_THRESHOLD, prefix='url-', dir=app.config['UPLOAD_FOLDER'])
+
+    buffer = new_buffer()
+    size = 0
+    headers = None
+    resumable = False
+    attempt = 0
     try:
-        # Save file temporarily
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
+        while True:
+            request_headers = dict(conditional_headers or {}) if headers is None else {}
+            if size and resumable:
+                request_headers['Range'] = f'bytes={size}-'
+                validator = headers.get('ETag', '')
+                if not validator or validator.startswith('W/'):
+                    validator = headers.get('Last-Modified')
+                if validator:
+                    request_headers['If-Range'] = validator
+            elif size:
+                # Not resumable: start over
+                buffer.close()
+                buffer, size = new_buffer(), 0
 
-        # Get file size
-        file_size = os.path.getsize(filepath)
-        logger.info(f"File saved: {filename}, size: {file_size} bytes")
+            try:
+                resp, url = _get_following_redirects(url, request_headers)
+                with resp:
+                    resp.raise_for_status()
+                    if resp.status_code == 304:
+                        buffer.close()
+                        return None, 0, resp.headers
+                    if size and not (resp.status_code == 206 and
+                                     resp.headers.get('Content-Range', '').startswith(f'bytes {size}-')):
+                        # Range ignored or the source changed in between: start over
+                        logger.info(f"Server ignored range request for {url}, restarting download")
+                        buffer.close()
+                        buffer, size = new_buffer(), 0
+
+                    if not size:
+                        headers = resp.headers
+                        declared = int(headers.get('Content-Length') or 0)
+                        if declared > max_size:
+                            raise URLImportError(f'File exceeds {max_size // (1024 * 1024)} MB limit')
+                        resumable = headers.get('Content-Encoding', 'identity') == 'identity'
+                        expected = declared if resumable else 0
+                    else:
+                        expected = size + int(resp.headers.get('Content-Length') or 0)
 
-        # Get custom metadata and chunking config from request
-        metadata_json = request.form.get('metadata', '{}')
-        chunking_json = request.form.get('chunking_config', '{}')
-        store_name_param = request.form.get('store_name', '')
-        custom_metadata = json.loads(metadata_json)
-        chunking_config = json.loads(chunking_json)
+                    size = _read_response_body(resp, buffer, size, max_size)
+                    if expected and size < expected:
+                        raise http_requests.exceptions.ConnectionError(
+                            f'Connection closed after {size} of {expected} bytes'
+                        )
+                break
+            except _RESUMABLE_ERRORS as e:
+                size = buffer.tell()  # Bytes received before the connection dropped
+                attempt += 1
+                if attempt > URL_DOWNLOAD_RETRIES:
+                    raise
+                logger.warning(f"Download of {url} interrupted at {size} bytes ({str(e)}), "
+                               f"retry {attempt}/{URL_DOWNLOAD_RETRIES}")
+                time.sleep(min(2 ** attempt, 10) * random.uniform(0.5, 1.0))
+    except BaseException:
+        buffer.close()
+        raise
+
+    buffer.seek(0)
+    return buffer, size, headers
+
+
+def _import_url_entry(url, custom_metadata, chunking_config, target_store_name, on_duplicate, claim_hash):
+    """Download one URL and start its ingestion into the store.
+
+    Runs in the /import-urls download pool: the per-host slot is held only
+    while downloading, then the buffer goes straight to _process_upload.
+    claim_hash(content_hash, url) returns the URL of an earlier entry of the
+    same job with identical content (still importing), or None.
 
-        # Determine which store to use
-        target_store = None
-        if store_name_param:
-            # Use the specified store
-            logger.info(f"Using specified store: {store_name_param}")
-            target_store_name = store_name_param
-        elif file_search_store is None:
-            # Create new default store if none exists
-            logger.info("Creating new file search store")
-            file_search_store = client.file_search_stores.create(
-                config={'display_name': 'RAG-App-Store'}
+    Returns:
+        dict or Future: Duplicate payload, or a Future resolving with the upload result
+    """
+    hostname = validate_import_url(url)
+    with url_host_limiter.slot(hostname):
+        buffer, file_size, headers = download_url(url)
+    filename = url_filename(url, headers.get('Content-Type'))
+    metadata_dict = dict(custom_metadata, source_url=url)
+    content_hash = buffer.content_hash()
+    logger.info(f"Downloaded {filename} ({file_size} bytes) from {url}")
+
+    if on_duplicate != 'upload':
+        first_url = claim_hash(content_hash, url)
+        if first_url:
+            buffer.close()
+            add_dedup_bytes_saved(file_size)
+            logger.info(f"Skipped {url}: same content as {first_url} ({file_size} bytes saved)")
+            return {
+                'duplicate': True,
+                'message': f'Same content as {first_url}',
+                'duplicate_of': first_url,
+                'filename': filename,
+                'file_size': file_size,
+                'store_name': target_store_name,
+                'bytes_saved': file_size,
+                'source_url': url
+            }
+        existing = find_duplicate_upload(target_store_name, content_hash)
+        if existing:
+            buffer.close()
+            payload = duplicate_upload_response(
+                existing, filename, file_size, target_store_name, metadata_dict, on_duplicate
             )
-            target_store_name = file_search_store.name
-        else:
-            # Use existing default store
-            target_store_name = file_search_store.name
+            payload['source_url'] = url
+            return payload
 
-        # Detect MIME type explicitly (CRITICAL for CSV, XLSX, etc.)
-        mime_type = get_mime_type(filename)
-        logger.info(f"Detected MIME type: {mime_type} for {filename}")
+    tracked = _process_upload(
+        buffer, filename, file_size, metadata_dict, chunking_config, target_store_name, origin='url'
+    )
 
-        # Build upload config WITHOUT MIME type (will be auto-detected)
-        upload_config = {
-            'display_name': filename
-        }
+    def remember_source(result):
+        # Validators let /refresh-urls send conditional GETs later
+        if result['document_id']:
+            record_url_source(target_store_name, url, result['document_id'], filename, headers,
+                              content_hash, metadata_dict, chunking_config)
+        return result
 
-        # Add custom metadata if provided
-        if custom_metadata:
-            metadata_list = []
-            for key, value in custom_metadata.items():
-                if isinstance(value, (int, float)):
-                    metadata_list.append({"key": key, "numeric_value": value})
-                else:
-                    metadata_list.append({"key": key, "string_value": str(value)})
-            upload_config['custom_metadata'] = metadata_list
-
-        # Add chunking config if provided
-        if chunking_config and chunking_config.get('enabled'):
-            upload_config['chunking_config'] = {
-                'white_space_config': {
-                    'max_tokens_per_chunk': chunking_config.get('max_tokens_per_chunk', 200),
-                    'max_overlap_tokens': chunking_config.get('max_overlap_tokens', 20)
-                }
-            }
+    return chain_future(tracked, remember_source)
 
-        # TRY DIRECT UPLOAD FIRST (upload_to_file_search_store)
-        uploaded_api_file = None
-        try:
-            logger.info(f"Attempting direct upload for {filename} (MIME type will be auto-detected)")
-            operation = client.file_search_stores.upload_to_file_search_store(
-                file=filepath,
-                file_search_store_name=target_store_name,
-                config=upload_config
-            )
-        except Exception as upload_error:
-            # FALLBACK: Use Files API + importFile for problematic files (CSV, large files, etc.)
-            logger.warning(f"Direct upload failed: {upload_error}")
-            logger.info(f"Falling back to Files API + importFile method for {filename}")
 
+def _interleave_by_host(urls):
+    """Indexes of urls reordered round-robin by host, so one large site does not hold every worker"""
+    from urllib.parse import urlparse
+    by_host = OrderedDict()
+    for index, url in enumerate(urls):
+        by_host.setdefault(urlparse(url).hostname, []).append(index)
+    order = []
+    queues = list(by_host.values())
+    depth = 0
+    while len(order) < len(urls):
+        for queue in queues:
+            if depth < len(queue):
+                order.append(queue[depth])
+        depth += 1
+    return order
+
+
+def _run_url_tasks(job_id, urls, task, parallelism, counts, progress_counter, counter_of):
+    """Run task(index) for every URL in a download pool and collect per-URL results.
+
+    URLs are interleaved by host. task returns a result dict when the URL is
+    done, or a Future when its import is still running; the worker moves on
+    to the next URL either way. Job counters are updated as URLs finish:
+    progress_counter when task returns, counter_of(result) on success and
+    'failed' on errors.
+
+    Returns:
+        Future: Resolves with the list of per-URL results once every import has finished
+    """
+    results = [None] * len(urls)
+    pending = []
+    counts_lock = threading.Lock()
+
+    def count(counter):
+        with counts_lock:
+            counts[counter] += 1
+            update_job(job_id, **counts)
+
+    def record(index, result=None, error=None):
+        if error is not None:
+            logger.error(f"URL job {job_id} failed for {urls[index]}: {error}")
+            results[index] = {'url': urls[index], 'success': False, 'error': error}
+            count('failed')
+        else:
+            results[index] = dict(result, url=urls[index], success=True)
+            count(counter_of(result))
+
+    def on_finished(index):
+        def done(future):
             try:
-                # Upload to Files API with explicit MIME type
-                uploaded_api_file = client.files.upload(
-                    file=filepath,
-                    config={
-                        'mime_type': mime_type,  # Files API DOES accept mime_type
-                        'display_name': filename
-                    }
-                )
-                logger.info(f"File uploaded to Files API: {uploaded_api_file.name}")
+                record(index, future.result())
+            except Exception as e:
+                record(index, error=str(e))
+        return done
 
-                # Import to File Search Store (importFile has different config schema)
-                import_config_fallback = {}
+    with ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix='url-worker') as executor:
+        futures = {executor.submit(task, index): index for index in _interleave_by_host(urls)}
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                outcome = future.result()
+            except Exception as e:
+                record(index, error=str(e))
+                continue
+            count(progress_counter)
+            if isinstance(outcome, Future):
+                outcome.add_done_callback(on_finished(index))
+                pending.append(outcome)
+            else:
+                record(index, outcome)
 
-                # importFile accepts custom_metadata and chunking_config, but NOT display_name
-                if upload_config.get('custom_metadata'):
-                    import_config_fallback['custom_metadata'] = upload_config['custom_metadata']
-                if upload_config.get('chunking_config'):
-                    import_config_fallback['chunking_config'] = upload_config['chunking_config']
+    logger.info(f"URL job {job_id}: downloads finished, waiting for {len(pending)} import operation(s)")
+    # on_finished callbacks were registered first, so every result is recorded by then
+    return chain_future(gather_futures(pending), lambda _: results)
 
-                operation = client.file_search_stores.import_file(
-                    file_search_store_name=target_store_name,
-                    file_name=uploaded_api_file.name,
-                    config=import_config_fallback if import_config_fallback else None
-                )
-                logger.info(f"Importing {filename} into File Search Store via importFile")
-
-            except Exception as fallback_error:
-                logger.error(f"Fallback method also failed: {fallback_error}")
-                raise fallback_error
-
-        # Wait for operation to complete with INCREASED TIMEOUT - 120 segundos
-        logger.info("Waiting for file import to complete")
-        max_wait = 120  # 2 minutes timeout - Timeout de 120 segundos
-        wait_time = 0
-        while not operation.done and wait_time < max_wait:
-            time.sleep(3)
-            operation = client.operations.get(operation)
-            wait_time += 3
-            if wait_time % 15 == 0:  # Log progress every 15 seconds
-                logger.info(f"Still waiting... ({wait_time}s elapsed)")
-
-        if not operation.done:
-            logger.error(f"File processing timeout after {max_wait}s")
-            return jsonify({'error': f'File processing timeout after {max_wait} seconds. The file may still be processing in the background.'}), 500
-
-        # Extract document ID from operation response
-        document_id = None
-        if hasattr(operation, 'response') and operation.response:
-            document_id = getattr(operation.response, 'name', None)
 
-        # Check for operation errors
-        if hasattr(operation, 'error') and operation.error:
-            logger.error(f"Upload operation failed: {operation.error.message}")
-            return jsonify({'error': f'Upload failed: {operation.error.message}'}), 500
+def _process_url_import(job_id, entries, chunking_config, target_store_name, parallelism, on_duplicate):
+    """Download many URLs concurrently and pipeline each into store ingestion.
 
-        # Track uploaded file
-        file_info = {
-            'filename': filename,
-            'size': file_size,
-            'mime_type': mime_type,  # Store MIME type for debugging
-            'uploaded_at': time.strftime('%Y-%m-%d %H:%M:%S'),
-            'custom_metadata': custom_metadata,
-            'chunking_config': chunking_config if chunking_config.get('enabled') else None,
-            'document_id': document_id
+    Downloads run in a pool of `parallelism` threads (at most URL_IMPORT_PER_HOST
+    per host); each finished download starts its File Search import right away
+    and the operation is handed to the shared operation tracker. The worker
+    is released once every download has finished; the returned Future
+    resolves when the last import does.
+
+    Args:
+        job_id (str): Import job ID (for progress updates)
+        entries (list): (url, metadata dict) tuples
+        chunking_config (dict): Chunking configuration applied to every file
+        target_store_name (str): File Search store resource name
+        parallelism (int): Max concurrent downloads
+        on_duplicate (str): skip, update_metadata or upload (see /upload)
+
+    Returns:
+        Future: Resolves with the import summary and per-URL results
+    """
+    counts = {'downloaded': 0, 'imported': 0, 'duplicates': 0, 'failed': 0}
+    claimed_hashes = {}  # content hash -> first URL of this job with that content
+    claim_lock = threading.Lock()
+
+    def claim_hash(content_hash, url):
+        with claim_lock:
+            if content_hash in claimed_hashes:
+                return claimed_hashes[content_hash]
+            claimed_hashes[content_hash] = url
+            return None
+
+    def task(index):
+        url, metadata = entries[index]
+        return _import_url_entry(url, metadata, chunking_config, target_store_name, on_duplicate, claim_hash)
+
+    def summarize(results):
+        succeeded = sum(1 for r in results if r['success'])
+        logger.info(f"URL import {job_id} finished: {succeeded}/{len(entries)} URLs imported")
+        return {
+            'message': f'{succeeded} of {len(entries)} URLs imported successfully',
+            'store_name': target_store_name,
+            'total': len(entries),
+            'succeeded': succeeded,
+            'failed': len(entries) - succeeded,
+            'duplicates': counts['duplicates'],
+            'files': results
         }
-        uploaded_files.append(file_info)
 
-        # IMPORTANT: Save state to persistence - Guardar estado
-        save_state()
+    return chain_future(_run_url_tasks(
+        job_id, [url for url, _ in entries], task, parallelism, counts,
+        'downloaded', lambda result: 'duplicates' if result.get('duplicate') else 'imported'
+    ), summarize)
 
-        # Clean up local file
-        os.remove(filepath)
-        logger.info(f"File {filename} successfully uploaded and imported")
+
+@app.route('/import-urls', methods=['POST'])
+def import_from_urls():
+    """Queue many URLs for concurrent download and import - Importación masiva de URLs
+
+    JSON body:
+        urls (list): URLs, or {"url": ..., "metadata": {...}} objects
+        metadata (dict, optional): Metadata applied to every URL (per-URL metadata wins)
+        chunking_config (dict, optional): Chunking configuration
+        store_name (str, optional): Target store; defaults to the current store
+        parallelism (int, optional): Concurrent downloads, capped at URL_IMPORT_WORKERS
+        on_duplicate (str, optional): skip (default), update_metadata or upload
+
+    Returns 202 with a job_id; poll GET /jobs/<job_id> for progress and per-URL results.
+    """
+    data = request.json or {}
+    raw_urls = data.get('urls') or []
+    if not isinstance(raw_urls, list) or not raw_urls:
+        return jsonify({'error': 'urls must be a non-empty list'}), 400
+    if len(raw_urls) > URL_IMPORT_MAX_URLS:
+        return jsonify({'error': f'Too many URLs (max {URL_IMPORT_MAX_URLS})'}), 400
+
+    common_metadata = data.get('metadata') or {}
+    if not isinstance(common_metadata, dict):
+        return jsonify({'error': 'metadata must be an object'}), 400
+
+    entries = []
+    rejected = []
+    for item in raw_urls:
+        if isinstance(item, dict):
+            url, metadata = str(item.get('url', '')).strip(), item.get('metadata') or {}
+        else:
+            url, metadata = str(item).strip(), {}
+        if not url.startswith(('http://', 'https://')) or not isinstance(metadata, dict):
+            rejected.append(url)
+            continue
+        entries.append((url, {**common_metadata, **metadata}))
+    if not entries:
+        return jsonify({'error': 'No valid http(s) URLs provided', 'rejected': rejected}), 400
+
+    try:
+        parallelism = int(data.get('parallelism', URL_IMPORT_WORKERS))
+    except (ValueError, TypeError):
+        parallelism = URL_IMPORT_WORKERS
+    parallelism = max(1, min(URL_IMPORT_WORKERS, parallelism))
+
+    try:
+        target_store_name = _resolve_upload_store(data.get('store_name', ''))
+        job = create_job('import_urls', store_name=target_store_name, total=len(entries),
+                         downloaded=0, imported=0, duplicates=0, failed=0)
+        submit_job(
+            upload_executor, job['id'], _process_url_import, job['id'], entries,
+            data.get('chunking_config') or {}, target_store_name, parallelism,
+            data.get('on_duplicate', 'skip')
+        )
+        logger.info(f"Queued URL import job {job['id']} with {len(entries)} URLs (parallelism={parallelism})")
 
         return jsonify({
             'success': True,
-            'message': f'File "{filename}" uploaded and processed successfully',
-            'filename': filename,
-            'file_size': file_size,
-            'mime_type': mime_type,
-            'store_name': target_store_name,
-            'document_id': document_id,
-            'uploaded_files': uploaded_files
-        })
+            'message': f'{len(entries)} URLs queued for import',
+            'job_id': job['id'],
+            'status': job['status'],
+            'status_url': f"/jobs/{job['id']}",
+            'total': len(entries),
+            'rejected': rejected,
+            'parallelism': parallelism,
+            'store_name': target_store_name
+        }), 202
 
+    except JobQueueFullError as e:
+        logger.warning(f"URL import rejected: {str(e)}")
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
-        logger.error(f"Error uploading file: {str(e)}")
-        # Clean up file if it exists
-        if filepath and os.path.exists(filepath):
-            os.remove(filepath)
-        # Clean up API file if uploaded in fallback
-        if uploaded_api_file:
-            try:
-                client.files.delete(uploaded_api_file.name)
-                logger.info(f"Cleaned up temporary file: {uploaded_api_file.name}")
-            except:
-                pass
-        return jsonify({'error': f'Error uploading file: {str(e)}'}), 500
+        logger.error(f"Error queuing URL import: {str(e)}")
+        return jsonify({'error': f'Error importing URLs: {str(e)}'}), 500
 
-# ============================================
-# IMPORT FROM URL - Importar desde URL
-# ============================================
 
 @app.route('/import-url', methods=['POST'])
 def import_from_url():
     """Download a file from URL and import into File Search Store"""
-    global file_search_store, uploaded_files
 
     data = request.json
     url = data.get('url', '').strip()
     store_name = data.get('store_name', '')
     custom_metadata = data.get('metadata', {})
+    on_duplicate = data.get('on_duplicate', 'skip')
 
     if not url:
         return jsonify({'error': 'URL is required'}), 400
 
-    if not url.startswith(('http://', 'https://')):
-        return jsonify({'error': 'URL must start with http:// or https://'}), 400
-
-    # SSRF protection: block private/internal IPs
-    from urllib.parse import urlparse
-    import socket
-    import ipaddress
     try:
-        parsed = urlparse(url)
-        hostname = parsed.hostname
-        if not hostname:
-            return jsonify({'error': 'Invalid URL'}), 400
-        ip = socket.gethostbyname(hostname)
-        addr = ipaddress.ip_address(ip)
-        if addr.is_private or addr.is_loopback or addr.is_link_local:
-            return jsonify({'error': 'URLs pointing to private/internal networks are not allowed'}), 400
-    except (socket.gaierror, ValueError) as e:
-        return jsonify({'error': f'Cannot resolve hostname: {str(e)}'}), 400
+        hostname = validate_import_url(url)
+    except URLImportError as e:
+        return jsonify({'error': str(e)}), 400
 
-    filepath = None
-    max_size = 100 * 1024 * 1024  # 100 MB
+    buffer = None
     try:
-        # Download file from URL
+        # Download file from URL (pooled connection, resumable)
         logger.info(f"Downloading file from URL: {url}")
-        resp = http_requests.get(url, timeout=120, stream=True)
-        resp.raise_for_status()
+        try:
+            with url_host_limiter.slot(hostname):
+                buffer, file_size, headers = download_url(url)
+        except URLImportError as e:
+            return jsonify({'error': str(e)}), 400
+        content_hash = buffer.content_hash()
 
         # Determine filename
-        filename = url.split('/')[-1].split('?')[0] or 'downloaded_file'
-        filename = secure_filename(filename)
-        if not filename or filename == '':
-            filename = 'downloaded_file'
-
-        # Save to temp with real-time size check
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        downloaded_size = 0
-        with open(filepath, 'wb') as f:
-            for chunk in resp.iter_content(chunk_size=8192):
-                downloaded_size += len(chunk)
-                if downloaded_size > max_size:
-                    f.close()
-                    os.remove(filepath)
-                    return jsonify({'error': 'File exceeds 100 MB limit'}), 400
-                f.write(chunk)
-
-        file_size = os.path.getsize(filepath)
+        filename = url_filename(url, headers.get('Content-Type'))
         mime_type = get_mime_type(filename)
         logger.info(f"Downloaded {filename} ({file_size} bytes, {mime_type})")
 
         # Determine target store
-        target_store = file_search_store
-        target_store_name = file_search_store.name if file_search_store else None
+        target_store = state.store
+        target_store_name = target_store.name if target_store else None
 
         if store_name:
             try:
@@ -648,33 +3694,49 @@ def import_from_url():
         if not target_store:
             return jsonify({'error': 'No active store. Create one first.'}), 400
 
+        # Build metadata dict
+        metadata_dict = {}
+        if isinstance(custom_metadata, list):
+            for item in custom_metadata:
+                metadata_dict[item.get('key', '')] = item.get('value', '')
+        elif isinstance(custom_metadata, dict):
+            metadata_dict = custom_metadata
+        metadata_dict['source_url'] = url
+
+        # Same content already indexed in this store: skip the upload
+        if on_duplicate != 'upload':
+            existing = find_duplicate_upload(target_store_name, content_hash)
+            if existing:
+                payload = duplicate_upload_response(
+                    existing, filename, file_size, target_store_name, metadata_dict, on_duplicate
+                )
+                payload['source_url'] = url
+                return jsonify(payload)
+
         # Upload to File Search Store
         operation = client.file_search_stores.upload_to_file_search_store(
-            file=filepath,
+            file=buffer,
             file_search_store_name=target_store_name,
             config={
                 'display_name': filename,
+                'mime_type': mime_type
             }
         )
+        buffer.close()  # Bytes are uploaded
 
-        # Wait for operation
-        max_wait = 120
-        wait_time = 0
-        while not operation.done and wait_time < max_wait:
-            time.sleep(5)
-            wait_time += 5
-            operation = client.operations.get(operation)
-            if wait_time % 15 == 0:
-                logger.info(f"Import from URL: still waiting... ({wait_time}s elapsed)")
-
-        if not operation.done:
+        # Wait for operation (shared operation tracker)
+        import_started = time.monotonic()
+        try:
+            operation = operation_tracker.wait(operation, mime_type,
+                                               timeout=upload_operation_timeout(file_size, mime_type))
+        except TimeoutError:
             return jsonify({'error': 'Upload timed out. The file may still be processing.'}), 408
+        processing_seconds = round(time.monotonic() - import_started, 2)
 
         # Check for operation error
         if hasattr(operation, 'error') and operation.error:
             error_msg = getattr(operation.error, 'message', str(operation.error))
             logger.error(f"Import URL operation failed: {error_msg}")
-            os.remove(filepath)
             return jsonify({'error': f'Import failed: {error_msg}'}), 500
 
         # Get document ID
@@ -682,61 +3744,677 @@ def import_from_url():
         if hasattr(operation, 'response') and operation.response:
             document_id = getattr(operation.response, 'name', None)
 
-        # Build metadata dict
-        metadata_dict = {}
-        if isinstance(custom_metadata, list):
-            for item in custom_metadata:
-                metadata_dict[item.get('key', '')] = item.get('value', '')
-        elif isinstance(custom_metadata, dict):
-            metadata_dict = custom_metadata
-        metadata_dict['source_url'] = url
+        # Track file
+        file_info = {
+            'filename': filename,
+            'size': file_size,
+            'uploaded_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'custom_metadata': metadata_dict,
+            'document_id': document_id,
+            'mime_type': mime_type,
+            'processing_seconds': processing_seconds,
+            'source': 'url',
+            'sha256': content_hash
+        }
+        state.add_file(file_info)
+        if document_id:
+            record_content_hash(target_store_name, content_hash, document_id, filename, file_size)
+            record_url_source(target_store_name, url, document_id, filename, headers, content_hash, metadata_dict, {})
+        notify_store_changed(target_store_name)
+
+        return jsonify({
+            'success': True,
+            'message': f'File "{filename}" imported from URL successfully',
+            'filename': filename,
+            'file_size': file_size,
+            'mime_type': mime_type,
+            'source_url': url,
+            'document_id': document_id,
+            'store_name': target_store_name
+        })
+
+    except http_requests.exceptions.RequestException as e:
+        logger.error(f"Error downloading from URL: {str(e)}")
+        return jsonify({'error': f'Error downloading file: {str(e)}'}), 400
+    except Exception as e:
+        logger.error(f"Error importing from URL: {str(e)}")
+        return jsonify({'error': f'Error importing file: {str(e)}'}), 500
+    finally:
+        if buffer is not None:
+            buffer.close()
+
+# ============================================
+# URL REFRESH - Actualización de documentos importados desde URL
+# Conditional GETs (ETag / Last-Modified); only changed sources are re-imported
+# ============================================
+
+def _conditional_headers(source):
+    """If-None-Match / If-Modified-Since headers from a URL source's stored validators"""
+    headers = {}
+    if source.get('etag'):
+        headers['If-None-Match'] = source['etag']
+    if source.get('last_modified'):
+        headers['If-Modified-Since'] = source['last_modified']
+    return headers
+
+
+def discard_document(store_name, document_id):
+    """Delete a superseded or removed document and every local record of it.
+
+    Used when a refresh or sync replaces a document; records already
+    pointing at the replacement are left alone. If the API delete fails the
+    local records are kept, so a later refresh or sync can retry it.
+
+    Returns:
+        bool: True if the API delete succeeded
+    """
+    try:
+        client.file_search_stores.documents.delete(name=document_id, config={'force': True})
+        logger.info(f"Deleted document: {document_id}")
+    except Exception as e:
+        logger.warning(f"Could not delete document {document_id}: {str(e)}")
+        return False
+    state.remove_document(document_id)
+    forget_content_hashes(document_id=document_id)
+    forget_url_sources(document_id=document_id)
+    forget_sync_manifest(document_id=document_id)
+    forget_enrichments(document_id=document_id)
+    notify_store_changed(store_name)
+    return True
+
+
+def _refresh_url_source(source, force=False):
+    """Re-check one URL source and replace its document only if the content changed.
+
+    Sends a conditional GET with the stored validators; a 304, or a body with
+    the same SHA-256 as the indexed copy, leaves the document untouched.
+    Changed content is imported as a new document with the same metadata and
+    chunking configuration, and the old document is deleted once that import
+    has succeeded.
+
+    Returns:
+        dict or Future: Unchanged result, or a Future resolving with the update result
+    """
+    store_name, url, old_document_id = source['store_name'], source['url'], source['document_id']
+    hostname = validate_import_url(url)
+    with url_host_limiter.slot(hostname):
+        buffer, file_size, headers = download_url(
+            url, conditional_headers=None if force else _conditional_headers(source)
+        )
+
+    unchanged = {'status': 'unchanged', 'document_id': old_document_id, 'store_name': store_name}
+    if buffer is None:
+        touch_url_source(store_name, url, headers)
+        return dict(unchanged, reason='not_modified')
+    content_hash = buffer.content_hash()
+    if content_hash == source['sha256'] and not force:
+        buffer.close()
+        touch_url_source(store_name, url, headers)
+        return dict(unchanged, reason='same_content', file_size=file_size)
+
+    # Keep metadata edited in the app since the last import
+    filename = url_filename(url, headers.get('Content-Type'))
+    local_metadata = state.local_metadata(old_document_id)
+    metadata = dict(local_metadata if local_metadata is not None else source['metadata'], source_url=url)
+    logger.info(f"Source changed: {url}, re-importing as {filename}")
+    tracked = _process_upload(
+        buffer, filename, file_size, metadata, source['chunking_config'], store_name, origin='url'
+    )
+
+    def replace(result):
+        # Without a new document the old one stays indexed and tracked for the next refresh
+        if not result['document_id']:
+            raise Exception(f'Re-import of {url} returned no document')
+        record_url_source(store_name, url, result['document_id'], filename, headers,
+                          content_hash, metadata, source['chunking_config'])
+        discard_document(store_name, old_document_id)
+        return dict(result, status='updated', replaced_document_id=old_document_id)
+
+    return chain_future(tracked, replace)
+
+
+def _process_url_refresh(job_id, sources, parallelism, force):
+    """Refresh many URL sources concurrently (same download pool as /import-urls).
+
+    Args:
+        job_id (str): Refresh job ID (for progress updates)
+        sources (list): URL source rows from list_url_sources()
+        parallelism (int): Max concurrent requests
+        force (bool): Skip the conditional GET and re-import every source
+
+    Returns:
+        Future: Resolves with the refresh summary and per-URL results
+    """
+    counts = {'checked': 0, 'unchanged': 0, 'updated': 0, 'failed': 0}
+
+    def summarize(results):
+        logger.info(f"URL refresh {job_id} finished: {counts['updated']} updated, "
+                    f"{counts['unchanged']} unchanged, {counts['failed']} failed")
+        return {
+            'message': f"{counts['updated']} of {len(sources)} URLs changed and were re-imported",
+            'total': len(sources),
+            'updated': counts['updated'],
+            'unchanged': counts['unchanged'],
+            'failed': counts['failed'],
+            'files': results
+        }
+
+    return chain_future(_run_url_tasks(
+        job_id, [source['url'] for source in sources],
+        lambda index: _refresh_url_source(sources[index], force),
+        parallelism, counts, 'checked', lambda result: result['status']
+    ), summarize)
+
+
+@app.route('/url-sources', methods=['GET'])
+def get_url_sources():
+    """List documents imported from URLs with their stored validators - Fuentes URL
+
+    Query params:
+        store_name (str, optional): Store to list; defaults to the current store
+    """
+    store_name = request.args.get('store_name') or state.store_name
+    if not store_name:
+        return jsonify({'error': 'No active store. Create one first.'}), 400
+    try:
+        sources = list_url_sources(store_name)
+        return jsonify({'success': True, 'store_name': store_name, 'total': len(sources), 'sources': sources})
+    except Exception as e:
+        logger.error(f"Error listing URL sources: {str(e)}")
+        return jsonify({'error': f'Error listing URL sources: {str(e)}'}), 500
+
+
+@app.route('/refresh-urls', methods=['POST'])
+def refresh_urls():
+    """Re-check URL-imported documents and re-import only the changed ones - Actualizar URLs
+
+    JSON body (all optional):
+        store_name (str): Store to refresh; defaults to the current store
+        urls (list): Only refresh these source URLs
+        max_age (int): Skip sources checked less than max_age seconds ago
+        force (bool): Re-import every source without a conditional GET
+        parallelism (int): Concurrent requests, capped at URL_IMPORT_WORKERS
+
+    Returns 202 with a job_id; poll GET /jobs/<job_id> for per-URL results.
+    """
+    data = request.json or {}
+    store_name = data.get('store_name') or state.store_name
+    if not store_name:
+        return jsonify({'error': 'No active store. Create one first.'}), 400
+
+    urls = data.get('urls')
+    if urls is not None and not isinstance(urls, list):
+        return jsonify({'error': 'urls must be a list'}), 400
+    try:
+        max_age = float(data.get('max_age') or 0)
+        parallelism = int(data.get('parallelism', URL_IMPORT_WORKERS))
+    except (ValueError, TypeError):
+        return jsonify({'error': 'max_age and parallelism must be numbers'}), 400
+    parallelism = max(1, min(URL_IMPORT_WORKERS, parallelism))
+    force = _is_true(data.get('force', False))
+
+    try:
+        sources = list_url_sources(
+            store_name, urls=urls, checked_before=time.time() - max_age if max_age > 0 else None
+        )
+        if not sources:
+            return jsonify({
+                'success': True,
+                'message': 'No URL sources to refresh',
+                'total': 0,
+                'store_name': store_name
+            })
+
+        job = create_job('refresh_urls', store_name=store_name, total=len(sources),
+                         checked=0, unchanged=0, updated=0, failed=0)
+        submit_job(upload_executor, job['id'], _process_url_refresh, job['id'], sources, parallelism, force)
+        logger.info(f"Queued URL refresh job {job['id']} for {len(sources)} sources (force={force})")
+
+        return jsonify({
+            'success': True,
+            'message': f'{len(sources)} URLs queued for refresh',
+            'job_id': job['id'],
+            'status': job['status'],
+            'status_url': f"/jobs/{job['id']}",
+            'total': len(sources),
+            'parallelism': parallelism,
+            'store_name': store_name
+        }), 202
+
+    except JobQueueFullError as e:
+        logger.warning(f"URL refresh rejected: {str(e)}")
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        logger.error(f"Error queuing URL refresh: {str(e)}")
+        return jsonify({'error': f'Error refreshing URLs: {str(e)}'}), 500
+
+# ============================================
+# DIRECTORY SYNC - Sincronización de carpetas
+# Manifest-based diff (size + mtime, then SHA-256); only changes hit the API
+# ============================================
+
+class SyncInProgressError(Exception):
+    """Raised when the same directory is already being synced into the same store"""
+
+
+_syncs_running = set()  # (store_name, source) pairs
+_syncs_lock = threading.Lock()
+
+
+def resolve_sync_path(path):
+    """Absolute path of a directory under SYNC_ROOT.
+
+    Raises:
+        ValueError: If sync is disabled or the path escapes SYNC_ROOT
+    """
+    if not SYNC_ROOT:
+        raise ValueError('Directory sync is disabled. Set SYNC_ROOT to enable it.')
+    root = os.path.realpath(SYNC_ROOT)
+    resolved = os.path.realpath(os.path.join(root, path or ''))
+    if os.path.commonpath([root, resolved]) != root:
+        raise ValueError('Path must be inside SYNC_ROOT')
+    return resolved
+
+
+def _scan_sync_directory(root):
+    """Yield (relative path, absolute path, size, mtime_ns) for supported files under root.
+
+    Uses os.scandir so sizes and mtimes come from the directory walk itself.
+    Hidden entries, symlinks, zip archives and files that are empty or larger
+    than MAX_FILE_SIZE are skipped.
+    """
+    pending = [root]
+    while pending:
+        with os.scandir(pending.pop()) as entries:
+            for entry in entries:
+                if entry.name.startswith('.') or entry.is_symlink():
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                    continue
+                if not allowed_file(entry.name) or entry.name.lower().endswith('.zip'):
+                    continue
+                stat = entry.stat(follow_symlinks=False)
+                if stat.st_size == 0 or stat.st_size > MAX_FILE_SIZE:
+                    continue
+                relative = os.path.relpath(entry.path, root).replace(os.sep, '/')
+                yield relative, entry.path, stat.st_size, stat.st_mtime_ns
+
+
+def _hash_file(path):
+    """SHA-256 of a file, or None if it cannot be read"""
+    sha256 = hashlib.sha256()
+    try:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                sha256.update(block)
+    except OSError:
+        return None
+    return sha256.hexdigest()
+
+
+def _plan_sync(source, store_name, manifest, parallelism, verify):
+    """Diff a directory against its manifest.
+
+    Files whose size and mtime match the manifest are not read at all; the
+    rest are hashed (in parallel) and compared by content, so a touched but
+    identical file only refreshes its manifest entry. A new file with the
+    content of a vanished one is treated as a rename and keeps its document.
+
+    Returns:
+        dict: unchanged (count), touched, renamed, uploads, missing and failed lists
+    """
+    if verify:
+        # Entries whose document no longer exists in the store are re-uploaded
+        live = {doc['name'] for doc in get_store_documents(store_name, refresh=True)}
+        for entry in manifest.values():
+            if entry['document_id'] not in live:
+                entry['document_id'] = None
+
+    seen = set()
+    candidates = []
+    unchanged = 0
+    for relative, path, size, mtime_ns in _scan_sync_directory(source):
+        seen.add(relative)
+        entry = manifest.get(relative)
+        if entry and entry['document_id'] and entry['size'] == size and entry['mtime_ns'] == mtime_ns:
+            unchanged += 1
+        else:
+            candidates.append((relative, path, size, mtime_ns))
+
+    with ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix='sync-hash') as executor:
+        hashes = list(executor.map(lambda candidate: _hash_file(candidate[1]), candidates))
+
+    missing = {path: entry for path, entry in manifest.items() if path not in seen}
+    vanished_by_hash = {entry['sha256']: path for path, entry in missing.items()
+                        if entry['sha256'] and entry['document_id']}
+    plan = {'unchanged': unchanged, 'touched': [], 'renamed': [], 'uploads': [], 'failed': []}
+    for (relative, path, size, mtime_ns), sha256 in zip(candidates, hashes):
+        entry = manifest.get(relative)
+        new_entry = {'path': relative, 'size': size, 'mtime_ns': mtime_ns, 'sha256': sha256, 'document_id': None}
+        if sha256 is None:
+            plan['failed'].append({'path': relative, 'action': 'read', 'success': False,
+                                   'error': 'File could not be read'})
+        elif entry and entry['document_id'] and entry['sha256'] == sha256:
+            plan['touched'].append(dict(new_entry, document_id=entry['document_id']))
+        elif not entry and sha256 in vanished_by_hash:
+            old_path = vanished_by_hash.pop(sha256)
+            plan['renamed'].append(dict(new_entry, document_id=missing.pop(old_path)['document_id'],
+                                        renamed_from=old_path))
+        else:
+            plan['uploads'].append((path, new_entry, entry['document_id'] if entry else None))
+    plan['missing'] = list(missing.values())
+    return plan
+
+
+def sync_directory(source, store_name, delete_missing=True, dry_run=False, parallelism=BATCH_MAX_PARALLELISM,
+                   custom_metadata=None, chunking_config=None, verify=False, progress_job_id=None):
+    """Sync a local directory into a File Search store - Sincronizar carpeta con un store
+
+    New and changed files are uploaded concurrently (with a 'source_path'
+    metadata entry), documents of changed files are replaced once their new
+    version is imported, and documents whose file disappeared are deleted.
+    The manifest (sync_manifest table) records size, mtime, hash and
+    document of every synced file, so an unchanged tree costs one directory
+    walk and one query.
+
+    Args:
+        source (str): Directory to sync
+        store_name (str): File Search store resource name
+        delete_missing (bool): Delete documents whose source file is gone
+        dry_run (bool): Only report what would change
+        parallelism (int): Concurrent hashes / uploads
+        custom_metadata (dict): Metadata applied to every uploaded file
+        chunking_config (dict): Chunking configuration for uploaded files
+        verify (bool): Check manifest documents still exist in the store
+        progress_job_id (str, optional): Job to report progress on
+
+    Returns:
+        Future: Resolves with the sync summary and per-change results
+
+    Raises:
+        SyncInProgressError: If this directory is already syncing into this store
+    """
+    source = os.path.realpath(source)
+    key = (store_name, source)
+    with _syncs_lock:
+        if key in _syncs_running:
+            raise SyncInProgressError(f'A sync of {source} into {store_name} is already running')
+        _syncs_running.add(key)
+
+    def release(_):
+        with _syncs_lock:
+            _syncs_running.discard(key)
+
+    try:
+        summary = _run_sync(source, store_name, delete_missing, dry_run, parallelism,
+                            custom_metadata or {}, chunking_config or {}, verify, progress_job_id)
+    except BaseException:
+        release(None)
+        raise
+    summary.add_done_callback(release)
+    return summary
+
+
+def _run_sync(source, store_name, delete_missing, dry_run, parallelism, custom_metadata, chunking_config,
+              verify, progress_job_id):
+    started = time.monotonic()
+    plan = _plan_sync(source, store_name, load_sync_manifest(store_name, source), parallelism, verify)
+    results = list(plan['failed'])
+    counts = {
+        'unchanged': plan['unchanged'] + len(plan['touched']),
+        'renamed': len(plan['renamed']),
+        'uploaded': 0,
+        'deleted': 0,
+        'failed': len(plan['failed'])
+    }
+    logger.info(f"Sync plan for {source}: {counts['unchanged']} unchanged, {len(plan['uploads'])} to upload, "
+                f"{len(plan['renamed'])} renamed, {len(plan['missing'])} missing")
+
+    def summarize(_=None):
+        summary = {
+            'message': f"{'Dry run: ' if dry_run else ''}{len(plan['uploads'])} to upload, "
+                       f"{len(plan['missing']) if delete_missing else 0} to delete, {counts['unchanged']} unchanged",
+            'store_name': store_name,
+            'source': source,
+            'dry_run': dry_run,
+            'to_upload': len(plan['uploads']),
+            'to_delete': len(plan['missing']) if delete_missing else 0,
+            'elapsed_seconds': round(time.monotonic() - started, 2),
+            'files': results
+        }
+        summary.update(counts)
+        return summary
+
+    if dry_run:
+        results.extend({'path': entry['path'], 'action': 'upload' if not old_document_id else 'update'}
+                       for _, entry, old_document_id in plan['uploads'])
+        results.extend({'path': entry['path'], 'action': 'rename', 'renamed_from': entry['renamed_from']}
+                       for entry in plan['renamed'])
+        if delete_missing:
+            results.extend({'path': entry['path'], 'action': 'delete', 'document_id': entry['document_id']}
+                           for entry in plan['missing'])
+        done = Future()
+        done.set_result(summarize())
+        return done
+
+    # 1. Manifest-only changes, one transaction
+    save_sync_manifest_entries(store_name, source, plan['touched'] + plan['renamed'])
+    delete_sync_manifest_entries(store_name, source, [entry['renamed_from'] for entry in plan['renamed']])
+    for entry in plan['renamed']:
+        local_metadata = state.local_metadata(entry['document_id'])
+        if local_metadata is not None:
+            state.update_metadata(entry['document_id'], dict(local_metadata, source_path=entry['path']))
+        results.append({'path': entry['path'], 'action': 'rename', 'success': True,
+                        'renamed_from': entry['renamed_from'], 'document_id': entry['document_id']})
+
+    counts_lock = threading.Lock()
+
+    def record(result, counter):
+        with counts_lock:
+            results.append(result)
+            counts[counter] += 1
+            if progress_job_id:
+                update_job(progress_job_id, **counts)
+
+    def upload(path, entry, old_document_id):
+        filename = secure_filename(os.path.basename(path)) or 'file'
+        metadata = dict(custom_metadata, source_path=entry['path'])
+        tracked = _process_upload(
+            open(path, 'rb'), filename, entry['size'], metadata, chunking_config, store_name, origin='sync'
+        )
+
+        def finish(result):
+            # Without a new document the old manifest entry and document stay, so the next sync retries
+            if not result['document_id']:
+                raise Exception(f"Import of {entry['path']} returned no document")
+            save_sync_manifest_entries(store_name, source, [dict(entry, document_id=result['document_id'])])
+            record_content_hash(store_name, entry['sha256'], result['document_id'], filename, entry['size'])
+            if old_document_id:
+                discard_document(store_name, old_document_id)
+            return result
+
+        return chain_future(tracked, finish)
 
-        # Track file
-        uploaded_files.append({
-            'filename': filename,
-            'size': file_size,
-            'uploaded_at': time.strftime('%Y-%m-%d %H:%M:%S'),
-            'custom_metadata': metadata_dict,
-            'document_id': document_id,
-            'source': 'url'
-        })
-        save_state()
+    def on_uploaded(entry, old_document_id):
+        action = 'update' if old_document_id else 'upload'
+
+        def done(future):
+            try:
+                result = future.result()
+                record({'path': entry['path'], 'action': action, 'success': True,
+                        'document_id': result['document_id']}, 'uploaded')
+            except Exception as e:
+                logger.error(f"Sync upload failed for {entry['path']}: {str(e)}")
+                record({'path': entry['path'], 'action': action, 'success': False, 'error': str(e)}, 'failed')
+        return done
+
+    def delete(entry):
+        if discard_document(store_name, entry['document_id']):
+            return entry
+        raise Exception(f"Could not delete {entry['document_id']}")
+
+    # 2. Deletions and uploads share the pool; imports are tracked in the background
+    pending = []
+    deleted_paths = []
+    with ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix='sync-worker') as executor:
+        deletions = {executor.submit(delete, entry): entry for entry in plan['missing'] if delete_missing}
+        uploads = {executor.submit(upload, *item): item for item in plan['uploads']}
+        for future in as_completed(deletions):
+            entry = deletions[future]
+            try:
+                future.result()
+                deleted_paths.append(entry['path'])
+                record({'path': entry['path'], 'action': 'delete', 'success': True,
+                        'document_id': entry['document_id']}, 'deleted')
+            except Exception as e:
+                record({'path': entry['path'], 'action': 'delete', 'success': False, 'error': str(e)}, 'failed')
+        for future in as_completed(uploads):
+            _, entry, old_document_id = uploads[future]
+            try:
+                tracked = future.result()
+            except Exception:
+                on_uploaded(entry, old_document_id)(future)
+                continue
+            tracked.add_done_callback(on_uploaded(entry, old_document_id))
+            pending.append(tracked)
+    delete_sync_manifest_entries(store_name, source, deleted_paths)
+
+    return chain_future(gather_futures(pending), summarize)
+
+
+@app.route('/sync', methods=['POST'])
+def sync_folder():
+    """Sync a directory under SYNC_ROOT into a store - Sincronizar carpeta
+
+    JSON body (all optional):
+        path (str): Directory relative to SYNC_ROOT (default: SYNC_ROOT itself)
+        store_name (str): Target store; defaults to the current store
+        delete (bool): Delete documents whose file is gone (default true)
+        dry_run (bool): Only report what would change
+        verify (bool): Re-list the store to catch documents deleted elsewhere
+        metadata (dict): Metadata applied to uploaded files
+        chunking_config (dict): Chunking configuration
+        parallelism (int): Concurrent uploads, capped at BATCH_MAX_PARALLELISM
+
+    Returns 202 with a job_id; poll GET /jobs/<job_id> for the summary.
+    """
+    data = request.json or {}
+    try:
+        source = resolve_sync_path(data.get('path', ''))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 403 if not SYNC_ROOT else 400
+    if not os.path.isdir(source):
+        return jsonify({'error': f"Directory not found: {data.get('path', '')}"}), 400
 
-        # Clean up
-        os.remove(filepath)
+    try:
+        parallelism = int(data.get('parallelism', BATCH_MAX_PARALLELISM))
+    except (ValueError, TypeError):
+        parallelism = BATCH_MAX_PARALLELISM
+    parallelism = max(1, min(BATCH_MAX_PARALLELISM, parallelism))
+
+    try:
+        target_store_name = _resolve_upload_store(data.get('store_name', ''))
+        with _syncs_lock:
+            if (target_store_name, source) in _syncs_running:
+                return jsonify({'error': 'A sync of this directory into this store is already running'}), 409
+
+        job = create_job('sync', store_name=target_store_name, path=data.get('path', ''))
+        submit_job(
+            upload_executor, job['id'], sync_directory, source, target_store_name,
+            delete_missing=_is_true(data.get('delete', True)), dry_run=_is_true(data.get('dry_run', False)),
+            parallelism=parallelism, custom_metadata=data.get('metadata') or {},
+            chunking_config=data.get('chunking_config') or {}, verify=_is_true(data.get('verify', False)),
+            progress_job_id=job['id']
+        )
+        logger.info(f"Queued sync job {job['id']} for {source}")
 
         return jsonify({
             'success': True,
-            'message': f'File "{filename}" imported from URL successfully',
-            'filename': filename,
-            'file_size': file_size,
-            'mime_type': mime_type,
-            'source_url': url,
-            'document_id': document_id,
+            'message': 'Sync queued',
+            'job_id': job['id'],
+            'status': job['status'],
+            'status_url': f"/jobs/{job['id']}",
             'store_name': target_store_name
-        })
+        }), 202
 
-    except http_requests.exceptions.RequestException as e:
-        logger.error(f"Error downloading from URL: {str(e)}")
-        if filepath and os.path.exists(filepath):
-            os.remove(filepath)
-        return jsonify({'error': f'Error downloading file: {str(e)}'}), 400
+    except JobQueueFullError as e:
+        logger.warning(f"Sync rejected: {str(e)}")
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
-        logger.error(f"Error importing from URL: {str(e)}")
-        if filepath and os.path.exists(filepath):
-            os.remove(filepath)
-        return jsonify({'error': f'Error importing file: {str(e)}'}), 500
+        logger.error(f"Error queuing sync: {str(e)}")
+        return jsonify({'error': f'Error syncing directory: {str(e)}'}), 500
+
+
+@app.cli.command('sync-dir')
+@click.argument('path', type=click.Path(exists=True, file_okay=False))
+@click.option('--store', 'store_name', default='', help='Target store (default: current store)')
+@click.option('--delete/--no-delete', default=True, help='Delete documents whose file is gone')
+@click.option('--dry-run', is_flag=True, help='Only report what would change')
+@click.option('--verify', is_flag=True, help='Re-list the store to catch documents deleted elsewhere')
+@click.option('--parallelism', default=BATCH_MAX_PARALLELISM, type=int, help='Concurrent uploads')
+def sync_dir_command(path, store_name, delete, dry_run, verify, parallelism):
+    """Sync a local directory into a File Search store (not limited to SYNC_ROOT)"""
+    load_state()
+    target_store_name = _resolve_upload_store(store_name)
+    summary = sync_directory(
+        path, target_store_name, delete_missing=delete, dry_run=dry_run,
+        parallelism=max(1, parallelism), verify=verify
+    ).result()
+    for result in summary['files']:
+        if dry_run or not result.get('success', True):
+            click.echo(f"{result['action']:>7} {result['path']} {result.get('error', '')}".rstrip())
+    click.echo(json.dumps({k: v for k, v in summary.items() if k != 'files'}, indent=2))
 
 # ============================================
 # CHAT WITH RAG & CITATIONS - Chat con RAG y citaciones
 # Incluye MAX_HISTORY = 7 para límite de conversación
 # ============================================
 
-@app.route('/chat', methods=['POST'])
-def chat():
-    global conversation_history
+ALLOWED_CHAT_MODELS = [
+    'gemini-3.1-pro-preview',
+    'gemini-3-flash-preview',
+    'gemini-3.1-flash-lite-preview',
+    'gemini-2.5-pro',
+    'gemini-2.5-flash',
+    'gemini-2.5-flash-lite',
+]
 
-    data = request.json
+
+def build_metadata_filter(metadata_filters):
+    """Build an AIP-160 filter string (key=value pairs joined with AND), or None
+
+    Docs: https://google.aip.dev/160
+    """
+    filter_parts = []
+    for filter_item in metadata_filters or []:
+        key = filter_item.get('key', '')
+        value = filter_item.get('value', '')
+
+        if not key or not value:
+            continue
+
+        # Determine if value is numeric or string
+        try:
+            float(value)
+            # Numeric: no quotes
+            filter_parts.append(f'{key}={value}')
+        except (ValueError, TypeError):
+            # String: wrap in quotes
+            escaped_value = str(value).replace('"', '\\"')
+            filter_parts.append(f'{key}="{escaped_value}"')
+
+    return " AND ".join(filter_parts) if filter_parts else None
+
+
+def _prepare_chat_request(data):
+    """Validate a chat request and build the prompt and generation config.
+
+    Shared by /chat and /chat/stream.
+
+    Returns:
+        tuple: (chat_request dict, None) or (None, (error response, status))
+    """
     user_message = data.get('message', '')
     metadata_filters = data.get('metadata_filters', [])  # Array de filtros del frontend
     system_prompt = data.get('system_prompt', '')
@@ -747,192 +4425,285 @@ def chat():
     media_resolution = data.get('media_resolution', None)  # "low", "medium", "high"
 
     # Model selection with whitelist
-    ALLOWED_CHAT_MODELS = [
-        'gemini-3.1-pro-preview',
-        'gemini-3-flash-preview',
-        'gemini-3.1-flash-lite-preview',
-        'gemini-2.5-pro',
-        'gemini-2.5-flash',
-        'gemini-2.5-flash-lite',
-    ]
     model = data.get('model', 'gemini-3-flash-preview')
     if model not in ALLOWED_CHAT_MODELS:
         model = 'gemini-3-flash-preview'
 
     if not user_message:
-        return jsonify({'error': 'No message provided'}), 400
+        return None, (jsonify({'error': 'No message provided'}), 400)
 
-    if file_search_store is None:
-        return jsonify({'error': 'Please upload a file first'}), 400
+    current_store = state.store
+    if current_store is None:
+        return None, (jsonify({'error': 'Please upload a file first'}), 400)
 
-    try:
-        # Build conversation context (last MAX_HISTORY messages) - Contexto de conversación
-        # Note: user message is added to history AFTER successful API call
-        context_messages = conversation_history[-MAX_HISTORY:]
+    # Build conversation context (last MAX_HISTORY messages) - Contexto de conversación
+    # Note: user message is added to history AFTER successful API call
+    session_id = get_session_id()
+    context_messages = chat_sessions.get(session_id)[-MAX_HISTORY:]
 
-        # Create prompt with conversation history
-        prompt_parts = []
+    # Create prompt with conversation history
+    prompt_parts = []
 
-        # Add system prompt at the beginning if provided
-        if system_prompt:
-            prompt_parts.append(f"System Instructions: {system_prompt}\n")
+    # Add system prompt at the beginning if provided
+    if system_prompt:
+        prompt_parts.append(f"System Instructions: {system_prompt}\n")
 
-        for msg in context_messages[:-1]:  # All except current message
-            if msg['role'] == 'user':
-                prompt_parts.append(f"User: {msg['content']}")
-            else:
-                prompt_parts.append(f"Assistant: {msg['content']}")
+    for msg in context_messages[:-1]:  # All except current message
+        if msg['role'] == 'user':
+            prompt_parts.append(f"User: {msg['content']}")
+        else:
+            prompt_parts.append(f"Assistant: {msg['content']}")
 
-        # Add current question
-        prompt_parts.append(f"User: {user_message}")
-        prompt_parts.append("Assistant:")
+    # Add current question
+    prompt_parts.append(f"User: {user_message}")
+    prompt_parts.append("Assistant:")
 
-        full_prompt = "\n\n".join(prompt_parts)
+    full_prompt = "\n\n".join(prompt_parts)
 
-        logger.info(f"Querying with message: {user_message}")
-        if metadata_filters:
-            logger.info(f"Using metadata filters: {metadata_filters}")
+    logger.info(f"Querying with message: {user_message}")
+    if metadata_filters:
+        logger.info(f"Using metadata filters: {metadata_filters}")
 
-        # Build file search config
-        file_search_kwargs = {'file_search_store_names': [file_search_store.name]}
-        if top_k is not None:
-            try:
-                file_search_kwargs['top_k'] = int(top_k)
-                logger.info(f"Using top_k={top_k} for File Search")
-            except (ValueError, TypeError):
-                logger.warning(f"Invalid top_k value: {top_k}, ignoring")
-        file_search_config = types.FileSearch(**file_search_kwargs)
-
-        # Add metadata filters if provided - AIP-160 string format
-        if metadata_filters and len(metadata_filters) > 0:
-            # Build AIP-160 filter string: key=value pairs joined with AND
-            # Docs: https://google.aip.dev/160
-            filter_parts = []
-
-            for filter_item in metadata_filters:
-                key = filter_item.get('key', '')
-                value = filter_item.get('value', '')
-
-                if not key or not value:
-                    continue
+    # Build file search config
+    file_search_kwargs = {'file_search_store_names': [current_store.name]}
+    if top_k is not None:
+        try:
+            file_search_kwargs['top_k'] = int(top_k)
+            logger.info(f"Using top_k={top_k} for File Search")
+        except (ValueError, TypeError):
+            logger.warning(f"Invalid top_k value: {top_k}, ignoring")
+    file_search_config = types.FileSearch(**file_search_kwargs)
+
+    # Add metadata filters if provided - AIP-160 string format
+    metadata_filter_string = build_metadata_filter(metadata_filters)
+    if metadata_filter_string:
+        file_search_config.metadata_filter = metadata_filter_string
+        logger.info(f"Applied metadata filter: {metadata_filter_string}")
+
+    # Query with File Search
+    logger.info(f"Chat using model: {model}")
+    # Build generation config
+    gen_config = {
+        'tools': [types.Tool(file_search=file_search_config)]
+    }
+
+    # Add structured output if enabled (Gemini 3+ only)
+    if structured_output and response_schema:
+        gen_config['response_mime_type'] = 'application/json'
+        gen_config['response_schema'] = response_schema
+        logger.info("Structured output enabled with schema")
+
+    # Add thinking_level if provided (Gemini 3+)
+    if thinking_level in ('low', 'high'):
+        gen_config['thinking_config'] = types.ThinkingConfig(thinking_budget=-1 if thinking_level == 'high' else 0)
+        logger.info(f"Thinking level set to: {thinking_level}")
+
+    # Add media_resolution if provided
+    if media_resolution in ('low', 'medium', 'high'):
+        gen_config['media_resolution'] = media_resolution
+        logger.info(f"Media resolution set to: {media_resolution}")
+
+    # Response cache key: same question, context and retrieval settings -> same answer
+    response_cache_key = cache_key(
+        normalize_prompt(user_message), current_store.name, metadata_filter_string,
+        file_search_kwargs.get('top_k'), model, system_prompt,
+        [(m['role'], m['content']) for m in context_messages[:-1]],
+        response_schema if structured_output else None, thinking_level, media_resolution
+    )
 
-                # Determine if value is numeric or string
-                try:
-                    numeric_value = float(value)
-                    # Numeric: no quotes
-                    filter_parts.append(f'{key}={value}')
-                except (ValueError, TypeError):
-                    # String: wrap in quotes
-                    escaped_value = str(value).replace('"', '\\"')
-                    filter_parts.append(f'{key}="{escaped_value}"')
-
-            if filter_parts:
-                metadata_filter_string = " AND ".join(filter_parts)
-                file_search_config.metadata_filter = metadata_filter_string
-                logger.info(f"Applied metadata filter: {metadata_filter_string}")
-
-        # Query with File Search
-        logger.info(f"Chat using model: {model}")
-        # Build generation config
-        gen_config = {
-            'tools': [types.Tool(file_search=file_search_config)]
-        }
+    return {
+        'session_id': session_id,
+        'user_message': user_message,
+        'store_name': current_store.name,
+        'cache_key': None if data.get('no_cache') else response_cache_key,
+        'model': model,
+        'full_prompt': full_prompt,
+        'config': types.GenerateContentConfig(**gen_config),
+        'metadata_filters': metadata_filters,
+        'is_structured': bool(structured_output and response_schema)
+    }, None
 
-        # Add structured output if enabled (Gemini 3+ only)
-        if structured_output and response_schema:
-            gen_config['response_mime_type'] = 'application/json'
-            gen_config['response_schema'] = response_schema
-            logger.info("Structured output enabled with schema")
 
-        # Add thinking_level if provided (Gemini 3+)
-        if thinking_level in ('low', 'high'):
-            gen_config['thinking_config'] = types.ThinkingConfig(thinking_budget=-1 if thinking_level == 'high' else 0)
-            logger.info(f"Thinking level set to: {thinking_level}")
+def extract_citations(candidate):
+    """Extract citation metadata from a candidate's grounding metadata - Extracción de citaciones
 
-        # Add media_resolution if provided
-        if media_resolution in ('low', 'medium', 'high'):
-            gen_config['media_resolution'] = media_resolution
-            logger.info(f"Media resolution set to: {media_resolution}")
+    Returns:
+        dict or None: {'citations': [...], 'citation_count': n}
+    """
+    if not (hasattr(candidate, 'grounding_metadata') and candidate.grounding_metadata):
+        return None
+
+    grounding = candidate.grounding_metadata
+
+    # Extract citation information
+    citations = []
+    if hasattr(grounding, 'grounding_chunks') and grounding.grounding_chunks:
+        for chunk in grounding.grounding_chunks:
+            if hasattr(chunk, 'retrieved_context'):
+                ctx = chunk.retrieved_context
+                citation = {}
+                if hasattr(ctx, 'title'):
+                    citation['title'] = ctx.title
+                if hasattr(ctx, 'uri'):
+                    citation['uri'] = ctx.uri
+                if hasattr(ctx, 'text'):
+                    citation['text'] = ctx.text
+                citations.append(citation)
+
+    return {
+        'citations': citations,
+        'citation_count': len(citations)
+    }
 
-        response = client.models.generate_content(
-            model=model,
-            contents=full_prompt,
-            config=types.GenerateContentConfig(**gen_config)
-        )
 
-        assistant_message = response.text
+@app.route('/chat', methods=['POST'])
+def chat():
+    data = request.json
+    chat_request, error = _prepare_chat_request(data)
+    if error:
+        return error
 
-        # Add both messages to history only after successful API call
-        conversation_history.append({
-            'role': 'user',
-            'content': user_message
-        })
-        conversation_history.append({
-            'role': 'assistant',
-            'content': assistant_message
-        })
+    try:
+        cached = response_cache.get(chat_request['cache_key']) if chat_request['cache_key'] else None
+        if cached:
+            logger.info("Chat response served from cache")
+            assistant_message = cached['response']
+            metadata = cached['metadata']
+        else:
+            response = generate_content_with_retry(
+                model=chat_request['model'],
+                contents=chat_request['full_prompt'],
+                config=chat_request['config']
+            )
 
-        # Keep only last MAX_HISTORY messages
-        if len(conversation_history) > MAX_HISTORY:
-            conversation_history = conversation_history[-MAX_HISTORY:]
+            assistant_message = response.text
 
-        # Extract grounding metadata (citations) - Extracción de citaciones
-        metadata = None
-        if response.candidates and len(response.candidates) > 0:
-            candidate = response.candidates[0]
-            if hasattr(candidate, 'grounding_metadata') and candidate.grounding_metadata:
-                grounding = candidate.grounding_metadata
-
-                # Extract citation information
-                citations = []
-                if hasattr(grounding, 'grounding_chunks') and grounding.grounding_chunks:
-                    for chunk in grounding.grounding_chunks:
-                        if hasattr(chunk, 'retrieved_context'):
-                            ctx = chunk.retrieved_context
-                            citation = {}
-                            if hasattr(ctx, 'title'):
-                                citation['title'] = ctx.title
-                            if hasattr(ctx, 'uri'):
-                                citation['uri'] = ctx.uri
-                            if hasattr(ctx, 'text'):
-                                citation['text'] = ctx.text
-                            citations.append(citation)
-
-                metadata = {
-                    'citations': citations,
-                    'citation_count': len(citations)
-                }
+            # Extract grounding metadata (citations) - Extracción de citaciones
+            metadata = None
+            if response.candidates and len(response.candidates) > 0:
+                metadata = extract_citations(response.candidates[0])
+
+            if chat_request['cache_key'] and assistant_message:
+                response_cache.set(
+                    chat_request['cache_key'],
+                    {'response': assistant_message, 'metadata': metadata},
+                    store=chat_request['store_name']
+                )
+
+        # Add both messages to history only after successful API call
+        # (keeps only the last MAX_HISTORY messages)
+        conversation_length = chat_sessions.append_exchange(
+            chat_request['session_id'], chat_request['user_message'], assistant_message
+        )
 
         logger.info(f"Response generated successfully with {len(metadata['citations']) if metadata else 0} citations")
 
+        metadata_filters = chat_request['metadata_filters']
         return jsonify({
             'success': True,
             'response': assistant_message,
-            'is_structured': bool(structured_output and response_schema),
+            'is_structured': chat_request['is_structured'],
             'metadata': metadata,
-            'conversation_length': len(conversation_history),
-            'model_used': model,
+            'conversation_length': conversation_length,
+            'model_used': chat_request['model'],
             'metadata_filters_applied': metadata_filters if metadata_filters else None,
-            'filters_count': len(metadata_filters) if metadata_filters else 0
+            'filters_count': len(metadata_filters) if metadata_filters else 0,
+            'cached': bool(cached)
         })
 
     except Exception as e:
         logger.error(f"Error in chat: {str(e)}")
         return jsonify({'error': f'Error processing message: {str(e)}'}), 500
 
+
+def _sse_event(event, payload):
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """Streaming RAG chat via Server-Sent Events - Chat con respuesta en streaming
+
+    Same request body as /chat. Emits `token` events ({"text": ...}) as the
+    model generates, then one `done` event with the citations and the same
+    fields /chat returns (minus the full response text), or an `error` event.
+    """
+    data = request.json
+    chat_request, error = _prepare_chat_request(data)
+    if error:
+        return error
+
+    def generate():
+        text_parts = []
+        metadata = None
+        try:
+            cached = response_cache.get(chat_request['cache_key']) if chat_request['cache_key'] else None
+            if cached:
+                logger.info("Chat stream served from cache")
+                assistant_message = cached['response']
+                metadata = cached['metadata']
+                yield _sse_event('token', {'text': assistant_message})
+            else:
+                stream = generate_content_stream_limited(
+                    model=chat_request['model'],
+                    contents=chat_request['full_prompt'],
+                    config=chat_request['config']
+                )
+                for chunk in stream:
+                    if chunk.text:
+                        text_parts.append(chunk.text)
+                        yield _sse_event('token', {'text': chunk.text})
+                    # Grounding metadata arrives with the final chunks
+                    if chunk.candidates:
+                        metadata = extract_citations(chunk.candidates[0]) or metadata
+
+                assistant_message = ''.join(text_parts)
+                if chat_request['cache_key'] and assistant_message:
+                    response_cache.set(
+                        chat_request['cache_key'],
+                        {'response': assistant_message, 'metadata': metadata},
+                        store=chat_request['store_name']
+                    )
+            conversation_length = chat_sessions.append_exchange(
+                chat_request['session_id'], chat_request['user_message'], assistant_message
+            )
+            logger.info(f"Streamed response with {metadata['citation_count'] if metadata else 0} citations")
+
+            metadata_filters = chat_request['metadata_filters']
+            yield _sse_event('done', {
+                'success': True,
+                'is_structured': chat_request['is_structured'],
+                'metadata': metadata,
+                'conversation_length': conversation_length,
+                'model_used': chat_request['model'],
+                'metadata_filters_applied': metadata_filters if metadata_filters else None,
+                'filters_count': len(metadata_filters) if metadata_filters else 0,
+                'cached': bool(cached)
+            })
+
+        except Exception as e:
+            logger.error(f"Error in chat stream: {str(e)}")
+            yield _sse_event('error', {'error': f'Error processing message: {str(e)}'})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 # ============================================
 # FILE MANAGEMENT ENDPOINTS - Endpoints de gestión de archivos
 # ============================================
 
 @app.route('/delete-file/<int:file_index>', methods=['DELETE'])
 def delete_file(file_index):
-    global uploaded_files
-
     try:
-        if file_index < 0 or file_index >= len(uploaded_files):
+        files = state.files()
+        if file_index < 0 or file_index >= len(files):
             return jsonify({'error': 'Invalid file index'}), 400
 
-        file_info = uploaded_files[file_index]
+        file_info = files[file_index]
 
         # Delete from Files API
         if file_info.get('file_api_name'):
@@ -942,17 +4713,16 @@ def delete_file(file_index):
             except Exception as e:
                 logger.warning(f"Could not delete from Files API: {str(e)}")
 
-        # Remove from tracking
-        deleted_file = uploaded_files.pop(file_index)
-        logger.info(f"Removed file from tracking: {deleted_file['filename']}")
-
-        # Save state to persistence
-        save_state()
+        # Remove from tracking (and persistence)
+        deleted_file = state.remove_file_at(file_index)
+        if deleted_file is None:
+            return jsonify({'error': 'Invalid file index'}), 400
+        logger.info(f"Removed file from tracking: {deleted_file.get('filename')}")
 
         return jsonify({
             'success': True,
-            'message': f"File '{deleted_file['filename']}' deleted successfully",
-            'uploaded_files': uploaded_files
+            'message': f"File '{deleted_file.get('filename')}' deleted successfully",
+            'uploaded_files': state.files()
         })
 
     except Exception as e:
@@ -962,7 +4732,8 @@ def delete_file(file_index):
 @app.route('/store-info', methods=['GET'])
 def get_store_info():
     try:
-        if file_search_store is None:
+        current_store = state.store
+        if current_store is None:
             return jsonify({
                 'success': True,
                 'store_exists': False,
@@ -970,7 +4741,7 @@ def get_store_info():
             })
 
         # Get store details
-        store_details = client.file_search_stores.get(name=file_search_store.name)
+        store_details = client.file_search_stores.get(name=current_store.name)
 
         store_info = {
             'success': True,
@@ -979,7 +4750,7 @@ def get_store_info():
             'display_name': getattr(store_details, 'display_name', 'N/A'),
             'create_time': getattr(store_details, 'create_time', 'N/A'),
             'update_time': getattr(store_details, 'update_time', 'N/A'),
-            'document_count': len(uploaded_files)
+            'document_count': state.file_count()
         }
 
         return jsonify(store_info)
@@ -988,61 +4759,242 @@ def get_store_info():
         logger.error(f"Error getting store info: {str(e)}")
         return jsonify({'error': f'Error getting store info: {str(e)}'}), 500
 
+# ============================================
+# STORE CATALOG - Catálogo de stores y documentos en caché
+# ============================================
+
+STORE_SORT_FIELDS = ('display_name', 'name', 'create_time', 'size_bytes', 'active_documents_count')
+DOCUMENT_SORT_FIELDS = ('display_name', 'name', 'create_time', 'size_bytes', 'state', 'mime_type')
+
+
+def _format_store(store):
+    """Store resource as the JSON dict the UI expects (snake and camel case keys)"""
+    store_size = int(getattr(store, 'size_bytes', 0) or 0)
+    return {
+        'name': store.name,
+        'display_name': getattr(store, 'display_name', 'N/A'),
+        'displayName': getattr(store, 'display_name', 'N/A'),
+        'create_time': str(getattr(store, 'create_time', 'N/A')),
+        'createTime': str(getattr(store, 'create_time', 'N/A')),
+        'size_bytes': store_size,
+        'sizeBytes': store_size,
+        'active_documents_count': getattr(store, 'active_documents_count', 0),
+        'activeDocumentsCount': getattr(store, 'active_documents_count', 0),
+        'pending_documents_count': getattr(store, 'pending_documents_count', 0),
+        'pendingDocumentsCount': getattr(store, 'pending_documents_count', 0),
+        'failed_documents_count': getattr(store, 'failed_documents_count', 0),
+        'failedDocumentsCount': getattr(store, 'failed_documents_count', 0)
+    }
+
+
+def _format_document(doc):
+    """Document resource as a JSON dict with its Gemini-side custom metadata"""
+    custom_metadata = extract_document_metadata(doc, include_local=False)
+    return {
+        'name': doc.name,
+        'display_name': getattr(doc, 'display_name', 'N/A'),
+        'displayName': getattr(doc, 'display_name', 'N/A'),
+        'state': getattr(doc, 'state', 'UNKNOWN'),
+        'size_bytes': getattr(doc, 'size_bytes', 0),
+        'sizeBytes': getattr(doc, 'size_bytes', 0),
+        'mime_type': getattr(doc, 'mime_type', 'N/A'),
+        'mimeType': getattr(doc, 'mime_type', 'N/A'),
+        'create_time': str(getattr(doc, 'create_time', 'N/A')),
+        'createTime': str(getattr(doc, 'create_time', 'N/A')),
+        'custom_metadata': custom_metadata,
+        'customMetadata': custom_metadata
+    }
+
+
+def _with_local_metadata(documents):
+    """Copies of cached document dicts with locally edited metadata merged in.
+
+    Local metadata takes precedence, like extract_document_metadata().
+    """
+    merged = []
+    for document in documents:
+        local = state.local_metadata(document['name'])
+        if local:
+            document = dict(document)
+            custom_metadata = {**document['custom_metadata'], **local}
+            document['custom_metadata'] = document['customMetadata'] = custom_metadata
+        merged.append(document)
+    return merged
+
+
+def get_store_catalog(refresh=False):
+    """All stores (without documents), cached for CATALOG_CACHE_TTL seconds"""
+    stores = None if refresh else catalog_cache.get(STORES_CATALOG_KEY)
+    if stores is None:
+        stores = [_format_store(store) for store in client.file_search_stores.list()]
+        catalog_cache.set(STORES_CATALOG_KEY, stores)
+    return stores
+
+
+def get_store_documents(store_name, refresh=False):
+    """All documents of one store, loaded lazily and cached per store.
+
+    Invalidated by notify_store_changed() whenever the store's documents change.
+    """
+    key = ('documents', store_name)
+    documents = None if refresh else catalog_cache.get(key)
+    if documents is None:
+        documents = [
+            _format_document(doc)
+            for doc in client.file_search_stores.documents.list(parent=store_name)
+        ]
+        catalog_cache.set(key, documents, store=store_name)
+    return documents
+
+
+def get_store_documents_page(store_name, page_token=None, page_size=20):
+    """One page of documents straight from the API, for incremental loading
+
+    Returns:
+        tuple: (documents, next_page_token)
+    """
+    config = {'page_size': page_size}
+    if page_token:
+        config['page_token'] = page_token
+    pager = client.file_search_stores.documents.list(parent=store_name, config=config)
+    return [_format_document(doc) for doc in pager.page], pager.next_page_token
+
+
+catalog_executor = ThreadPoolExecutor(max_workers=CATALOG_FETCH_WORKERS, thread_name_prefix='catalog-fetch')
+
+
+def fetch_documents_for_stores(store_names, refresh=False):
+    """Load the documents of several stores concurrently.
+
+    Each store is fetched on the bounded catalog executor (its pages are
+    still read in order); results come back in the order of store_names. A
+    failing or slow store does not fail the others: a store that is still
+    loading CATALOG_FETCH_TIMEOUT seconds after its fetch started is
+    reported as timed out. Stores waiting for a free worker are not timed.
+
+    Returns:
+        list: (store_name, documents or None, error message or None) tuples
+    """
+    started = {}  # future index -> time.monotonic() when its fetch began
+
+    def fetch(index, store_name):
+        started[index] = time.monotonic()
+        return get_store_documents(store_name, refresh)
+
+    futures = [catalog_executor.submit(fetch, index, store_name) for index, store_name in enumerate(store_names)]
+    pending = set(range(len(futures)))
+    while pending:
+        deadlines = [started[index] + CATALOG_FETCH_TIMEOUT for index in pending if index in started]
+        timeout = max(0, min(deadlines) - time.monotonic()) if deadlines else CATALOG_FETCH_TIMEOUT
+        wait_futures([futures[index] for index in pending], timeout=timeout, return_when=FIRST_COMPLETED)
+        now = time.monotonic()
+        pending = {
+            index for index in pending
+            if not futures[index].done() and not (index in started and now - started[index] >= CATALOG_FETCH_TIMEOUT)
+        }
+
+    results = []
+    for store_name, future in zip(store_names, futures):
+        if not future.done():
+            error = f'Timed out after {CATALOG_FETCH_TIMEOUT}s'
+        elif future.exception() is not None:
+            error = str(future.exception())
+        else:
+            results.append((store_name, future.result(), None))
+            continue
+        logger.warning(f"Error listing documents for store {store_name}: {error}")
+        results.append((store_name, None, error))
+    return results
+
+
+def _sort_key(field):
+    """Sort key that tolerates missing values and mixed types"""
+    def key(item):
+        value = item.get(field)
+        if value is None:
+            return (1, '')
+        if isinstance(value, (int, float)):
+            return (0, value)
+        return (0, str(value).lower())
+    return key
+
+
+def sort_and_paginate(items, args, sort_fields):
+    """Apply the sort, order, page and page_size query parameters.
+
+    Without page_size every item is returned, as before pagination existed.
+
+    Returns:
+        tuple: (page items, pagination dict)
+    """
+    sort = args.get('sort')
+    if sort in sort_fields:
+        items = sorted(items, key=_sort_key(sort), reverse=args.get('order', 'asc') == 'desc')
+
+    total = len(items)
+    try:
+        page = max(1, int(args.get('page', 1)))
+        page_size = int(args.get('page_size', 0))
+    except (TypeError, ValueError):
+        page, page_size = 1, 0
+    if page_size <= 0:
+        return items, {'total': total, 'page': 1, 'page_size': total, 'has_more': False}
+
+    page_size = min(page_size, CATALOG_MAX_PAGE_SIZE)
+    start = (page - 1) * page_size
+    return items[start:start + page_size], {
+        'total': total,
+        'page': page,
+        'page_size': page_size,
+        'has_more': start + page_size < total
+    }
+
+
+def _is_true(value):
+    return str(value).lower() in ('1', 'true', 'yes')
+
+
 @app.route('/stores', methods=['GET'])
 def list_stores():
-    """List all File Search stores with their documents - Listar todos los stores con sus documentos"""
+    """List all File Search stores with their documents - Listar todos los stores con sus documentos
+
+    Query params:
+        include_documents (bool): Attach each store's documents (default true)
+        page, page_size (int): Paginate stores; all stores when page_size is omitted
+        sort (str): display_name, name, create_time, size_bytes or active_documents_count
+        order (str): asc or desc
+        refresh (bool): Bypass the catalog cache
+    """
     try:
-        stores = []
-        for store in client.file_search_stores.list():
-            # Get documents for this store
-            documents = []
-            try:
-                for doc in client.file_search_stores.documents.list(parent=store.name):
-                    custom_metadata = extract_document_metadata(doc, uploaded_files)
-
-                    documents.append({
-                        'name': doc.name,
-                        'display_name': getattr(doc, 'display_name', 'N/A'),
-                        'displayName': getattr(doc, 'display_name', 'N/A'),
-                        'state': getattr(doc, 'state', 'UNKNOWN'),
-                        'size_bytes': getattr(doc, 'size_bytes', 0),
-                        'sizeBytes': getattr(doc, 'size_bytes', 0),
-                        'mime_type': getattr(doc, 'mime_type', 'N/A'),
-                        'mimeType': getattr(doc, 'mime_type', 'N/A'),
-                        'create_time': str(getattr(doc, 'create_time', 'N/A')),
-                        'createTime': str(getattr(doc, 'create_time', 'N/A')),
-                        'custom_metadata': custom_metadata,
-                        'customMetadata': custom_metadata
-                    })
-            except Exception as doc_error:
-                logger.warning(f"Error listing documents for store {store.name}: {str(doc_error)}")
-
-            store_size = int(getattr(store, 'size_bytes', 0) or 0)
-            stores.append({
-                'name': store.name,
-                'display_name': getattr(store, 'display_name', 'N/A'),
-                'displayName': getattr(store, 'display_name', 'N/A'),
-                'create_time': str(getattr(store, 'create_time', 'N/A')),
-                'createTime': str(getattr(store, 'create_time', 'N/A')),
-                'size_bytes': store_size,
-                'sizeBytes': store_size,
-                'active_documents_count': getattr(store, 'active_documents_count', 0),
-                'activeDocumentsCount': getattr(store, 'active_documents_count', 0),
-                'pending_documents_count': getattr(store, 'pending_documents_count', 0),
-                'pendingDocumentsCount': getattr(store, 'pending_documents_count', 0),
-                'failed_documents_count': getattr(store, 'failed_documents_count', 0),
-                'failedDocumentsCount': getattr(store, 'failed_documents_count', 0),
-                'documents': documents
-            })
+        refresh = _is_true(request.args.get('refresh'))
+        include_documents = request.args.get('include_documents', 'true').lower() != 'false'
+
+        page_stores, pagination = sort_and_paginate(
+            get_store_catalog(refresh), request.args, STORE_SORT_FIELDS
+        )
+
+        stores = [dict(store) for store in page_stores]
+        errors = []
+        if include_documents:
+            # Documents are only loaded for the stores on this page, all at once
+            results = fetch_documents_for_stores([store['name'] for store in stores], refresh)
+            for store, (store_name, documents, error) in zip(stores, results):
+                store['documents'] = _with_local_metadata(documents) if documents is not None else []
+                if error:
+                    store['documents_error'] = error
+                    errors.append({'store': store_name, 'error': error})
 
         # Get current store name
-        current_store_name = file_search_store.name if file_search_store else None
+        current_store_name = state.store_name
 
         return jsonify({
             'success': True,
             'stores': stores,
             'count': len(stores),
-            'current_store': current_store_name
+            'current_store': current_store_name,
+            'pagination': pagination,
+            'partial': bool(errors),
+            'errors': errors
         })
 
     except Exception as e:
@@ -1051,13 +5003,32 @@ def list_stores():
 
 @app.route('/storage-usage', methods=['GET'])
 def storage_usage():
-    """Get aggregated storage usage across all stores - Uso de almacenamiento total"""
+    """Get aggregated storage usage across all stores - Uso de almacenamiento total
+
+    Store sizes come from the catalog cache. Stores that report no size but
+    have documents are sized from their document list, fetched concurrently.
+
+    Query params:
+        refresh (bool): Bypass the catalog cache
+    """
     try:
-        total_size = 0
-        store_count = 0
-        for store in client.file_search_stores.list():
-            total_size += int(getattr(store, 'size_bytes', 0) or 0)
-            store_count += 1
+        refresh = _is_true(request.args.get('refresh'))
+        stores = get_store_catalog(refresh)
+        sizes = {store['name']: store['size_bytes'] for store in stores}
+
+        unsized = [
+            store['name'] for store in stores
+            if not store['size_bytes'] and store.get('active_documents_count')
+        ]
+        errors = []
+        for store_name, documents, error in fetch_documents_for_stores(unsized, refresh):
+            if error:
+                errors.append({'store': store_name, 'error': error})
+            else:
+                sizes[store_name] = sum(int(doc.get('size_bytes') or 0) for doc in documents)
+
+        total_size = sum(sizes.values())
+        store_count = len(stores)
 
         tier_limits = {
             'free': 1 * 1024**3,
@@ -1079,7 +5050,14 @@ def storage_usage():
             'tier_limit_bytes': tier_limit,
             'tier_limit_gb': round(tier_limit / (1024**3), 1),
             'usage_percentage': round(usage_pct, 2),
-            'tier_limits': {k: round(v / (1024**3), 1) for k, v in tier_limits.items()}
+            'tier_limits': {k: round(v / (1024**3), 1) for k, v in tier_limits.items()},
+            'stores': [
+                {'name': store['name'], 'display_name': store['display_name'], 'size_bytes': sizes[store['name']]}
+                for store in stores
+            ],
+            'partial': bool(errors),
+            'errors': errors,
+            'dedup_bytes_saved': load_state_value('dedup_bytes_saved', 0)
         })
     except Exception as e:
         logger.error(f"Error getting storage usage: {str(e)}")
@@ -1098,7 +5076,6 @@ def update_tier():
 @app.route('/delete-store', methods=['DELETE'])
 def delete_store():
     """Delete a File Search store (with all documents) - Eliminar store con todos los documentos"""
-    global file_search_store, uploaded_files
 
     try:
         # Get store name from request body or use current store
@@ -1107,19 +5084,21 @@ def delete_store():
 
         # If no store name provided, use current store
         if not store_name:
-            if file_search_store is None:
+            store_name = state.store_name
+            if store_name is None:
                 return jsonify({'error': 'No store specified and no current store'}), 400
-            store_name = file_search_store.name
 
         # Delete the store with force=True (deletes all documents automatically)
         client.file_search_stores.delete(name=store_name, config={'force': True})
         logger.info(f"Deleted file search store: {store_name}")
 
         # Reset state if we deleted the current store
-        if file_search_store and file_search_store.name == store_name:
-            file_search_store = None
-            uploaded_files = []
-            save_state()
+        state.clear_store(store_name)
+        notify_store_changed(store_name)
+        forget_content_hashes(store_name=store_name)
+        forget_url_sources(store_name=store_name)
+        forget_sync_manifest(store_name=store_name)
+        forget_enrichments(store_name=store_name)
 
         return jsonify({
             'success': True,
@@ -1138,26 +5117,22 @@ def delete_store():
 def get_api_info():
     """Return API information for documentation tab - Devolver información API para pestaña de documentación"""
     try:
+        current_store = state.store
+        files = state.files()
         api_info = {
             'success': True,
             'api_key': f"{api_key[:8]}...{api_key[-4:]}" if api_key and len(api_key) > 12 else '***',
-            'store_exists': file_search_store is not None,
-            'store_name': file_search_store.name if file_search_store else None,
-            'store_display_name': getattr(file_search_store, 'display_name', 'RAG-App-Store') if file_search_store else 'RAG-App-Store',
-            'file_count': len(uploaded_files),
-            'files': uploaded_files,
+            'store_exists': current_store is not None,
+            'store_name': current_store.name if current_store else None,
+            'store_display_name': getattr(current_store, 'display_name', 'RAG-App-Store') if current_store else 'RAG-App-Store',
+            'file_count': len(files),
+            'files': files,
             'model': 'gemini-3-flash-preview',
             'example_metadata_filters': []
         }
 
         # Collect example metadata keys from uploaded files
-        metadata_keys = set()
-        for file_info in uploaded_files:
-            if file_info.get('custom_metadata'):
-                for key in file_info['custom_metadata'].keys():
-                    metadata_keys.add(key)
-
-        api_info['metadata_keys'] = list(metadata_keys)
+        api_info['metadata_keys'] = state.metadata_keys()
 
         return jsonify(api_info)
 
@@ -1197,10 +5172,19 @@ def update_api_key():
             with open(env_path, 'w') as f:
                 f.write(f'GEMINI_API_KEY={new_api_key}\n')
 
+        # Files API uploads belong to the previous project: delete them with its client
+        file_handle_cache.clear()
+
         # Update runtime variable and reinitialize client
         api_key = new_api_key
         client = genai.Client(api_key=api_key)
 
+        # Cached listings and answers belong to the previous project
+        catalog_cache.clear()
+        response_cache.clear()
+        extraction_cache.clear()
+        retrieval_cache.clear()
+
         logger.info("API key updated successfully")
         return jsonify({'success': True, 'message': 'API key updated successfully. Please reload the page.'})
 
@@ -1211,7 +5195,6 @@ def update_api_key():
 @app.route('/create-store', methods=['POST'])
 def create_store():
     """Create a new File Search Store - Crear un nuevo File Search Store"""
-    global file_search_store, uploaded_files
     try:
         data = request.json
         display_name = data.get('display_name', '').strip()
@@ -1228,12 +5211,9 @@ def create_store():
 
         logger.info(f"Created File Search Store: {new_store.name}")
 
-        # Switch to the new store
-        file_search_store = new_store
-        uploaded_files = []
-
-        # Save state
-        save_state()
+        # Switch to the new store (and save state)
+        state.set_store(new_store, [])
+        notify_store_changed(new_store.name)
 
         return jsonify({
             'success': True,
@@ -1249,7 +5229,6 @@ def create_store():
 @app.route('/switch-store', methods=['POST'])
 def switch_store():
     """Switch to a different File Search Store - Cambiar a otro store"""
-    global file_search_store, uploaded_files
     try:
         data = request.json
         store_name = data.get('store_name', '').strip()
@@ -1260,13 +5239,9 @@ def switch_store():
         # Verify the store exists
         try:
             new_store = client.file_search_stores.get(name=store_name)
-            file_search_store = new_store
 
-            # Reset uploaded files list (will be loaded from store if needed)
-            uploaded_files = []
-
-            # Save new state
-            save_state()
+            # Reset uploaded files list (will be loaded from store if needed) and save new state
+            state.set_store(new_store, [])
 
             logger.info(f"Switched to store: {store_name}")
             return jsonify({
@@ -1288,7 +5263,6 @@ def switch_store():
 @app.route('/delete-document', methods=['DELETE'])
 def delete_document():
     """Delete a specific document from a store - Eliminar un documento específico de un store"""
-    global uploaded_files
     try:
         data = request.json
         document_name = data.get('document_name', '').strip()
@@ -1300,12 +5274,17 @@ def delete_document():
         try:
             client.file_search_stores.documents.delete(name=document_name, config={'force': True})
             logger.info(f"Deleted document: {document_name}")
-
-            # If this document belongs to the current store, update uploaded_files
-            if file_search_store and document_name.startswith(file_search_store.name):
-                # Remove from uploaded_files if exists
-                uploaded_files = [f for f in uploaded_files if f.get('document_id') != document_name]
-                save_state()
+            notify_store_changed(store_of_document(document_name))
+            forget_content_hashes(document_id=document_name)
+            forget_url_sources(document_id=document_name)
+            forget_sync_manifest(document_id=document_name)
+            forget_enrichments(document_id=document_name)
+
+            # If this document belongs to the current store, update tracked files
+            current_store_name = state.store_name
+            if current_store_name and document_name.startswith(current_store_name):
+                # Remove from tracked files if exists
+                state.remove_document(document_name)
 
             return jsonify({
                 'success': True,
@@ -1322,7 +5301,6 @@ def delete_document():
 @app.route('/update-document-metadata', methods=['POST'])
 def update_document_metadata():
     """Update metadata for a document - Actualizar metadatos de un documento"""
-    global uploaded_files
     try:
         data = request.json
         document_name = data.get('document_name', '').strip()
@@ -1331,24 +5309,9 @@ def update_document_metadata():
         if not document_name:
             return jsonify({'error': 'Document name is required'}), 400
 
-        # Update metadata in local storage
-        updated = False
-        for file_info in uploaded_files:
-            if file_info.get('document_id') == document_name:
-                file_info['custom_metadata'] = new_metadata
-                file_info['metadata_updated_at'] = time.strftime('%Y-%m-%d %H:%M:%S')
-                updated = True
-                break
-
-        # If not found in uploaded_files, add new entry
-        if not updated:
-            uploaded_files.append({
-                'document_id': document_name,
-                'custom_metadata': new_metadata,
-                'metadata_updated_at': time.strftime('%Y-%m-%d %H:%M:%S')
-            })
-
-        save_state()
+        # Update metadata in local storage (adds a new entry if not tracked yet)
+        state.update_metadata(document_name, new_metadata)
+        notify_store_changed(store_of_document(document_name))
         logger.info(f"Updated metadata for document: {document_name}")
 
         return jsonify({
@@ -1381,10 +5344,6 @@ def suggest_metadata():
         language = request.form.get('language', 'en')
         logger.info(f"Using model for metadata generation: {model}, language: {language}")
 
-        # Read file content
-        file_content = file.read()
-        file.seek(0)  # Reset file pointer for potential reuse
-
         # Determine mime type using our smart detection function
         mime_type = get_mime_type(file.filename)
 
@@ -1393,27 +5352,15 @@ def suggest_metadata():
         # Save file temporarily
         temp_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(file.filename))
         file.save(temp_path)
+        content_hash = uploaded_file_hash(file, temp_path)
 
         # Determine if we need to extract text or use Files API
-        use_text_extraction = mime_type in [
-            'application/vnd.openxmlformats-officedocument.wordprocessingml.document',  # DOCX
-            'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',  # XLSX
-            'application/vnd.ms-excel',  # XLS
-            'application/msword'  # DOC (old format)
-        ]
+        use_text_extraction = mime_type in TEXT_EXTRACTION_MIME_TYPES
 
         if use_text_extraction:
-            # Extract text for unsupported formats (DOCX, XLSX)
+            # Extract text for unsupported formats (DOCX, XLSX/XLSM, ODS), sampled to the model's token budget
             logger.info(f"Extracting text from {mime_type} file")
-
-            if 'wordprocessingml' in mime_type or mime_type == 'application/msword':
-                # DOCX or DOC
-                extracted_text = extract_text_from_docx(temp_path)
-            elif 'spreadsheetml' in mime_type or mime_type == 'application/vnd.ms-excel':
-                # XLSX or XLS
-                extracted_text = extract_text_from_xlsx(temp_path)
-            else:
-                extracted_text = ""
+            extracted_text = fit_document_text(temp_path, mime_type, model, content_hash)
 
             if not extracted_text:
                 raise Exception("Could not extract text from document")
@@ -1421,15 +5368,10 @@ def suggest_metadata():
             logger.info(f"Extracted {len(extracted_text)} characters")
             uploaded_file = None  # No uploaded file for text extraction
         else:
-            # Upload file to Gemini Files API for supported formats (PDF, images, etc.)
+            # Upload file to Gemini Files API for supported formats (PDF, images, etc.),
+            # reusing the upload when the same bytes were analyzed recently
             logger.info(f"Uploading to Files API: {mime_type}")
-            uploaded_file = client.files.upload(
-                file=temp_path,
-                config={
-                    'mime_type': mime_type,
-                    'display_name': file.filename
-                }
-            )
+            uploaded_file = cached_files_api_upload(temp_path, file.filename, mime_type, content_hash)
 
         # System prompt with best practices - BILINGUAL VERSION
         if language == 'es':
@@ -1580,13 +5522,13 @@ Remember:
         if use_text_extraction:
             # Use extracted text for DOCX/XLSX
             logger.info("Generating metadata from extracted text")
-            response = client.models.generate_content(
+            response = generate_content_with_retry(
                 model=model,
                 contents=[
                     types.Content(
                         role='user',
                         parts=[
-                            types.Part.from_text(text=f"{analysis_prompt}\n\nDocument content:\n{extracted_text[:10000]}")  # Limit to 10k chars
+                            types.Part.from_text(text=f"{analysis_prompt}\n\nDocument content:\n{extracted_text}")
                         ]
                     )
                 ],
@@ -1598,25 +5540,30 @@ Remember:
         else:
             # Use Files API for PDF and other supported formats
             logger.info("Generating metadata from uploaded file")
-            response = client.models.generate_content(
-                model=model,
-                contents=[
-                    types.Content(
-                        role='user',
-                        parts=[
-                            types.Part.from_uri(
-                                file_uri=uploaded_file.uri,
-                                mime_type=uploaded_file.mime_type
-                            ),
-                            types.Part.from_text(text=analysis_prompt)
-                        ]
+            try:
+                response = generate_content_with_retry(
+                    model=model,
+                    contents=[
+                        types.Content(
+                            role='user',
+                            parts=[
+                                types.Part.from_uri(
+                                    file_uri=uploaded_file.uri,
+                                    mime_type=uploaded_file.mime_type
+                                ),
+                                types.Part.from_text(text=analysis_prompt)
+                            ]
+                        )
+                    ],
+                    config=types.GenerateContentConfig(
+                        system_instruction=system_instruction,
+                        temperature=0.1
                     )
-                ],
-                config=types.GenerateContentConfig(
-                    system_instruction=system_instruction,
-                    temperature=0.1
                 )
-            )
+            except Exception:
+                # The upload may have expired or been deleted: don't hand it out again
+                forget_files_api_upload(content_hash, mime_type)
+                raise
 
         # Extract JSON from response
         response_text = response.text.strip()
@@ -1631,13 +5578,8 @@ Remember:
 
         logger.info(f"Suggested metadata: {suggested_metadata}")
 
-        # Clean up temporary files
+        # Clean up the local temp file (the Files API upload is owned by file_handle_cache)
         try:
-            # Only delete from Files API if we uploaded there
-            if uploaded_file is not None:
-                client.files.delete(name=uploaded_file.name)
-
-            # Always delete local temp file
             if os.path.exists(temp_path):
                 os.remove(temp_path)
         except Exception as cleanup_error:
@@ -1664,6 +5606,58 @@ Remember:
 # DOCUMENT QUERY - Búsqueda semántica en documento específico
 # ============================================
 
+def format_query_chunk(relevant_chunk):
+    """One documents.query result as a dict (relevance_score, text, metadata)"""
+    chunk_data = {}
+    if hasattr(relevant_chunk, 'chunk_relevance_score'):
+        chunk_data['relevance_score'] = relevant_chunk.chunk_relevance_score
+    if hasattr(relevant_chunk, 'chunk') and relevant_chunk.chunk:
+        c = relevant_chunk.chunk
+        if hasattr(c, 'data') and c.data:
+            chunk_data['text'] = getattr(c.data, 'string_value', '')
+        if hasattr(c, 'custom_metadata') and c.custom_metadata:
+            chunk_meta = {}
+            for m in c.custom_metadata:
+                k = getattr(m, 'key', '')
+                if hasattr(m, 'string_value'):
+                    chunk_meta[k] = getattr(m, 'string_value', '')
+                elif hasattr(m, 'numeric_value'):
+                    chunk_meta[k] = getattr(m, 'numeric_value', 0)
+            chunk_data['metadata'] = chunk_meta
+    return chunk_data
+
+
+def cached_document_query(document_name, query, results_count, metadata_filter=None, use_cache=True):
+    """documents.query with a retrieval cache - Consulta con caché
+
+    Results are cached per document, normalized query, metadata filter and
+    store version. A request for fewer chunks than a cached result is served
+    by slicing it (results are ranked), as is any request when the cached
+    result already returned every matching chunk. Entries die with the store
+    version: notify_store_changed() bumps it on upload, delete or re-tag.
+
+    Returns:
+        tuple: (list of chunk dicts, served from cache)
+    """
+    store_name = store_of_document(document_name)
+    key = cache_key('retrieval', document_name, normalize_prompt(query), metadata_filter,
+                    store_version(store_name))
+    cached = retrieval_cache.get(key) if use_cache else None
+    if cached is not None:
+        exhausted = len(cached['chunks']) < cached['results_count']
+        if results_count <= cached['results_count'] or exhausted:
+            return cached['chunks'][:results_count], True
+
+    config = {'results_count': results_count}
+    if metadata_filter:
+        config['metadata_filter'] = metadata_filter
+    response = client.file_search_stores.documents.query(name=document_name, query=query, config=config)
+    chunks = [format_query_chunk(chunk) for chunk in getattr(response, 'relevant_chunks', None) or ()]
+    if use_cache:
+        retrieval_cache.set(key, {'results_count': results_count, 'chunks': chunks}, store=store_name)
+    return chunks, False
+
+
 @app.route('/document-query', methods=['POST'])
 def document_query():
     """Perform semantic search on a specific document WITHOUT full generation.
@@ -1677,6 +5671,7 @@ def document_query():
         query (str): The semantic search query
         results_count (int): Number of chunks to return, max 100 (default 10)
         metadata_filters (list): Optional AIP-160 metadata filters
+        no_cache (bool): Skip the retrieval cache
 
     Returns:
         JSON with list of relevant chunks and their content
@@ -1701,57 +5696,19 @@ def document_query():
 
         logger.info(f"Document query on {document_name}: '{query}' (results_count={results_count})")
 
-        # Build query config
-        query_config = {'results_count': results_count}
+        # Metadata filters in AIP-160 format (same builder as /chat, so equal
+        # filters share retrieval cache entries)
+        metadata_filter = build_metadata_filter(metadata_filters)
+        if metadata_filter:
+            logger.info(f"Document query filter: {metadata_filter}")
 
-        # Add metadata filters if provided (AIP-160 format)
-        if metadata_filters and len(metadata_filters) > 0:
-            filter_parts = []
-            for filter_item in metadata_filters:
-                key = filter_item.get('key', '')
-                value = filter_item.get('value', '')
-                if not key or not value:
-                    continue
-                try:
-                    float(value)
-                    filter_parts.append(f'{key}={value}')
-                except (ValueError, TypeError):
-                    escaped_value = str(value).replace('"', '\\"')
-                    filter_parts.append(f'{key}="{escaped_value}"')
-            if filter_parts:
-                query_config['metadata_filter'] = ' AND '.join(filter_parts)
-                logger.info(f"Document query filter: {query_config['metadata_filter']}")
-
-        # Execute semantic search via documents.query
-        query_response = client.file_search_stores.documents.query(
-            name=document_name,
-            query=query,
-            config=query_config
+        # Execute semantic search via documents.query (served from the retrieval cache when possible)
+        chunks, cached = cached_document_query(
+            document_name, query, results_count, metadata_filter,
+            use_cache=not data.get('no_cache')
         )
 
-        # Extract chunks from response
-        chunks = []
-        if hasattr(query_response, 'relevant_chunks') and query_response.relevant_chunks:
-            for chunk in query_response.relevant_chunks:
-                chunk_data = {}
-                if hasattr(chunk, 'chunk_relevance_score'):
-                    chunk_data['relevance_score'] = chunk.chunk_relevance_score
-                if hasattr(chunk, 'chunk') and chunk.chunk:
-                    c = chunk.chunk
-                    if hasattr(c, 'data') and c.data:
-                        chunk_data['text'] = getattr(c.data, 'string_value', '')
-                    if hasattr(c, 'custom_metadata') and c.custom_metadata:
-                        chunk_meta = {}
-                        for m in c.custom_metadata:
-                            k = getattr(m, 'key', '')
-                            if hasattr(m, 'string_value'):
-                                chunk_meta[k] = getattr(m, 'string_value', '')
-                            elif hasattr(m, 'numeric_value'):
-                                chunk_meta[k] = getattr(m, 'numeric_value', 0)
-                        chunk_data['metadata'] = chunk_meta
-                chunks.append(chunk_data)
-
-        logger.info(f"Document query returned {len(chunks)} chunks")
+        logger.info(f"Document query returned {len(chunks)} chunks{' (cached)' if cached else ''}")
 
         return jsonify({
             'success': True,
@@ -1759,7 +5716,8 @@ def document_query():
             'query': query,
             'results_count': results_count,
             'chunks': chunks,
-            'chunks_returned': len(chunks)
+            'chunks_returned': len(chunks),
+            'cached': cached
         })
 
     except Exception as e:
@@ -1767,6 +5725,235 @@ def document_query():
         return jsonify({'error': f'Error performing document query: {str(e)}'}), 500
 
 
+# ============================================
+# STORE QUERY - Búsqueda semántica en todo un store
+# documents.query fanned out concurrently, merged with a top-k heap
+# ============================================
+
+query_executor = ThreadPoolExecutor(max_workers=STORE_QUERY_WORKERS, thread_name_prefix='store-query')
+
+
+def _metadata_matches(metadata, filters):
+    """True if metadata has every (key, value) filter; numbers compare as numbers"""
+    for key, value in filters:
+        if key not in metadata:
+            return False
+        actual = metadata[key]
+        try:
+            if float(actual) == float(value):
+                continue
+        except (TypeError, ValueError):
+            pass
+        if str(actual) != str(value):
+            return False
+    return True
+
+
+def resolve_query_documents(store_name, metadata_filters=None, index='catalog'):
+    """Names of a store's documents matching metadata filters (all documents without filters).
+
+    With index='catalog' the (cached) document listing is filtered on its
+    Gemini and local metadata. index='local' resolves candidates from the
+    local metadata index alone, without listing the store: only documents
+    whose metadata was set through this app are found.
+    """
+    filters = [
+        (item.get('key'), item.get('value')) for item in metadata_filters or ()
+        if item.get('key') and item.get('value') not in (None, '')
+    ]
+    if index == 'local':
+        prefix = f"{store_name}/documents/"
+        if filters:
+            candidates = set.intersection(*(state.documents_with_metadata_key(key) for key, _ in filters))
+        else:
+            candidates = {f['document_id'] for f in state.files() if f.get('document_id')}
+        return sorted(
+            name for name in candidates
+            if name.startswith(prefix) and _metadata_matches(state.local_metadata(name) or {}, filters)
+        )
+    return [
+        document['name'] for document in _with_local_metadata(get_store_documents(store_name))
+        if _metadata_matches(document['custom_metadata'], filters)
+    ]
+
+
+def _query_document(document_name, query, results_count):
+    chunks, _ = cached_document_query(document_name, query, results_count)
+    return [dict(chunk, document_name=document_name) for chunk in chunks]
+
+
+def iter_store_query(document_names, query, results_count, per_document_count):
+    """Query documents concurrently, keeping the best results_count chunks.
+
+    Yields a progress dict after every document, then a final dict with the
+    merged chunks (best first) and per-document errors. A min-heap of size
+    results_count keeps the top chunks by chunk_relevance_score as results
+    arrive, so memory does not grow with the number of documents.
+    """
+    heap = []  # (score, seq, chunk): the weakest kept chunk on top
+    seq = 0
+    errors = []
+    futures = {
+        query_executor.submit(_query_document, name, query, per_document_count): name
+        for name in document_names
+    }
+    done = 0
+    try:
+        for future in as_completed(futures, timeout=STORE_QUERY_TIMEOUT):
+            done += 1
+            try:
+                chunks = future.result()
+            except Exception as e:
+                errors.append({'document_name': futures[future], 'error': str(e)})
+                chunks = []
+            for chunk in chunks:
+                seq += 1
+                item = (chunk.get('relevance_score') or 0.0, seq, chunk)
+                if len(heap) < results_count:
+                    heapq.heappush(heap, item)
+                elif item[0] > heap[0][0]:
+                    heapq.heapreplace(heap, item)
+            yield {'documents_done': done, 'documents_total': len(futures), 'chunks_found': seq}
+    except FuturesTimeoutError:
+        for future, name in futures.items():
+            if not future.done():
+                future.cancel()
+                errors.append({'document_name': name, 'error': f'Timed out after {STORE_QUERY_TIMEOUT}s'})
+    yield {
+        'chunks': [chunk for _, _, chunk in sorted(heap, key=lambda item: (-item[0], item[1]))],
+        'errors': errors
+    }
+
+
+def _store_query_prompt(query, chunks):
+    """Prompt answering the query from the merged chunks only"""
+    excerpts = '\n\n'.join(
+        f"[{number}] ({chunk['document_name']})\n{chunk.get('text', '')}"
+        for number, chunk in enumerate(chunks, 1)
+    )
+    return (
+        "Answer the question using only the numbered excerpts below and cite them as [n]. "
+        "If they do not contain the answer, say so.\n\n"
+        f"Question: {query}\n\nExcerpts:\n{excerpts}"
+    )
+
+
+@app.route('/store-query', methods=['POST'])
+def store_query():
+    """Retrieval across a whole store (or a metadata-filtered subset) - Búsqueda en todo el store
+
+    Fans documents.query out over the candidate documents concurrently and
+    merges the chunks by relevance. Generation is optional.
+
+    Request body:
+        query (str): The semantic search query
+        store_name (str): Store to search (default: current store)
+        documents (list): Search only these document names (must belong to store_name)
+        metadata_filters (list): {key, value} filters selecting documents
+        index (str): 'catalog' (default) or 'local' (local metadata index only)
+        results_count (int): Merged chunks to return, max 100 (default 10)
+        per_document_count (int): Chunks requested per document (default results_count)
+        generate (bool): Also answer the query from the merged chunks
+        model (str): Model used when generate is true (one of ALLOWED_CHAT_MODELS)
+        stream (bool): Server-Sent Events (default true): `progress` events,
+            one `chunk` event per merged chunk, `token` events when
+            generating, then `done`. With false, one JSON response.
+    """
+    data = request.json or {}
+    query = (data.get('query') or '').strip()
+    if not query:
+        return jsonify({'error': 'query is required'}), 400
+    store_name = data.get('store_name') or state.store_name
+    if not store_name:
+        return jsonify({'error': 'No store selected'}), 400
+
+    try:
+        results_count = max(1, min(100, int(data.get('results_count', 10))))
+    except (ValueError, TypeError):
+        results_count = 10
+    try:
+        per_document_count = max(1, min(100, int(data.get('per_document_count', results_count))))
+    except (ValueError, TypeError):
+        per_document_count = results_count
+    generate = _is_true(data.get('generate', False))
+    model = data.get('model', 'gemini-3-flash-preview')
+    if model not in ALLOWED_CHAT_MODELS:
+        return jsonify({'error': f'Unsupported model: {model}'}), 400
+
+    if data.get('documents'):
+        document_names = list(dict.fromkeys(data['documents']))
+        # Explicit documents must belong to the store the query is scoped to
+        prefix = f'{store_name}/documents/'
+        foreign = [name for name in document_names
+                   if not (isinstance(name, str) and name.startswith(prefix) and '/' not in name[len(prefix):])]
+        if foreign:
+            return jsonify({'error': f'Documents do not belong to {store_name}', 'documents': foreign}), 400
+    else:
+        try:
+            document_names = resolve_query_documents(
+                store_name, data.get('metadata_filters'), data.get('index', 'catalog')
+            )
+        except Exception as e:
+            logger.error(f"Error resolving store query documents: {str(e)}")
+            return jsonify({'error': f'Error listing documents: {str(e)}'}), 500
+    if len(document_names) > STORE_QUERY_MAX_DOCUMENTS:
+        return jsonify({
+            'error': f'{len(document_names)} documents match; narrow the search with metadata_filters '
+                     f'(limit {STORE_QUERY_MAX_DOCUMENTS})'
+        }), 400
+
+    logger.info(f"Store query on {store_name} over {len(document_names)} document(s): '{query}'")
+    summary = {
+        'success': True,
+        'store_name': store_name,
+        'query': query,
+        'results_count': results_count,
+        'documents_searched': len(document_names)
+    }
+
+    if not _is_true(data.get('stream', True)):
+        try:
+            result = list(iter_store_query(document_names, query, results_count, per_document_count))[-1]
+            response = dict(summary, chunks=result['chunks'], chunks_returned=len(result['chunks']),
+                            errors=result['errors'], partial=bool(result['errors']))
+            if generate and result['chunks']:
+                response['answer'] = generate_content_with_retry(
+                    model=model, contents=_store_query_prompt(query, result['chunks'])
+                ).text
+            return jsonify(response)
+        except Exception as e:
+            logger.error(f"Error in store query: {str(e)}")
+            return jsonify({'error': f'Error performing store query: {str(e)}'}), 500
+
+    def stream():
+        try:
+            for event in iter_store_query(document_names, query, results_count, per_document_count):
+                if 'chunks' not in event:
+                    yield _sse_event('progress', event)
+                    continue
+                result = event
+            for rank, chunk in enumerate(result['chunks'], 1):
+                yield _sse_event('chunk', dict(chunk, rank=rank))
+            if generate and result['chunks']:
+                for part in generate_content_stream_limited(
+                        model=model, contents=_store_query_prompt(query, result['chunks'])):
+                    if part.text:
+                        yield _sse_event('token', {'text': part.text})
+            yield _sse_event('done', dict(
+                summary, chunks_returned=len(result['chunks']), errors=result['errors'],
+                partial=bool(result['errors'])
+            ))
+        except Exception as e:
+            logger.error(f"Error in store query stream: {str(e)}")
+            yield _sse_event('error', {'error': f'Error performing store query: {str(e)}'})
+
+    return Response(
+        stream_with_context(stream()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
 # ============================================
 # AUTO-ENRICHMENT ENDPOINT - Enriquecimiento automatico con schema estructurado
 # ============================================
@@ -1817,78 +6004,79 @@ DEFAULT_ENRICH_SCHEMA = {
 }
 
 
-def _analyze_file_with_schema(file_path, filename, mime_type, schema, model='gemini-3-flash-preview'):
-    """
-    Core analysis: upload file to Gemini and extract structured metadata using response_schema.
-    Handles DOCX/XLSX text extraction. Cleans up Files API upload in all cases.
-    """
-    use_text_extraction = mime_type in [
-        'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-        'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-        'application/vnd.ms-excel',
-        'application/msword'
-    ]
+ENRICH_SYSTEM_INSTRUCTION = (
+    "You are a document analysis expert. Extract structured metadata from the document "
+    "following the provided JSON schema exactly. Return only valid JSON with the requested fields. "
+    "Base all values strictly on what appears in the document."
+)
+
+
+def _schema_config(schema):
+    """Generation config of every schema extraction (interactive and batch)"""
+    return types.GenerateContentConfig(
+        system_instruction=ENRICH_SYSTEM_INSTRUCTION,
+        temperature=0.1,
+        response_mime_type='application/json',
+        response_schema=schema
+    )
+
+
+def _schema_prompt(filename):
+    return f"Analyze this document and extract structured metadata. Filename: {filename}"
 
-    uploaded_file = None
 
-    if use_text_extraction:
-        logger.info(f"Auto-enrich: extracting text from {mime_type}")
-        if 'wordprocessingml' in mime_type or mime_type == 'application/msword':
-            extracted_text = extract_text_from_docx(file_path)
-        elif 'spreadsheetml' in mime_type or mime_type == 'application/vnd.ms-excel':
-            extracted_text = extract_text_from_xlsx(file_path)
-        else:
-            extracted_text = ''
-        if not extracted_text:
-            raise ValueError("Could not extract text from document")
-    else:
-        logger.info(f"Auto-enrich: uploading to Files API ({mime_type})")
-        uploaded_file = client.files.upload(
-            file=file_path,
-            config={'mime_type': mime_type, 'display_name': filename}
-        )
+def _schema_text_parts(text, filename):
+    """Prompt parts for text content (already sized to the prompt budget)"""
+    return [types.Part.from_text(text=f"{_schema_prompt(filename)}\n\nDocument content:\n{text}")]
 
-    system_instruction = (
-        "You are a document analysis expert. Extract structured metadata from the document "
-        "following the provided JSON schema exactly. Return only valid JSON with the requested fields. "
-        "Base all values strictly on what appears in the document."
+
+def _generate_with_schema(content_parts, schema, model):
+    """Structured-output call behind the shared rate limiter; returns the parsed JSON"""
+    response = generate_content_with_retry(
+        model=model,
+        contents=[types.Content(role='user', parts=content_parts)],
+        config=_schema_config(schema)
     )
+    return json.loads(response.text)
 
-    prompt = f"Analyze this document and extract structured metadata. Filename: {filename}"
 
-    try:
-        if use_text_extraction:
-            content_parts = [
-                types.Part.from_text(text=f"{prompt}\n\nDocument content:\n{extracted_text[:12000]}")
-            ]
-        else:
-            content_parts = [
-                types.Part.from_uri(
-                    file_uri=uploaded_file.uri,
-                    mime_type=uploaded_file.mime_type
-                ),
-                types.Part.from_text(text=prompt)
-            ]
+def _analyze_text_with_schema(text, filename, schema, model='gemini-3-flash-preview'):
+    """Extract structured metadata from document text"""
+    return _generate_with_schema(_schema_text_parts(text, filename), schema, model)
 
-        response = client.models.generate_content(
-            model=model,
-            contents=[types.Content(role='user', parts=content_parts)],
-            config=types.GenerateContentConfig(
-                system_instruction=system_instruction,
-                temperature=0.1,
-                response_mime_type='application/json',
-                response_schema=schema
-            )
-        )
 
-        return json.loads(response.text)
+def _analyze_file_with_schema(file_path, filename, mime_type, schema, model='gemini-3-flash-preview',
+                              content_hash=None):
+    """
+    Core analysis: upload file to Gemini and extract structured metadata using response_schema.
+    Handles DOCX/XLSX/ODS text extraction. Extracted text and Files API uploads are
+    cached by content hash, so re-analyzing the same bytes skips both.
+    """
+    content_hash = content_hash or _hash_file(file_path)
 
-    finally:
-        if uploaded_file is not None:
-            try:
-                client.files.delete(name=uploaded_file.name)
-            except Exception as cleanup_err:
-                logger.warning(f"Could not delete temp file from Files API: {cleanup_err}")
+    if mime_type in TEXT_EXTRACTION_MIME_TYPES:
+        logger.info(f"Auto-enrich: extracting text from {mime_type}")
+        extracted_text = fit_document_text(file_path, mime_type, model, content_hash)
+        if not extracted_text:
+            raise ValueError("Could not extract text from document")
+        return _analyze_text_with_schema(extracted_text, filename, schema, model)
+
+    logger.info(f"Auto-enrich: uploading to Files API ({mime_type})")
+    uploaded_file = cached_files_api_upload(file_path, filename, mime_type, content_hash)
+    try:
+        return _generate_with_schema([
+            types.Part.from_uri(
+                file_uri=uploaded_file.uri,
+                mime_type=uploaded_file.mime_type
+            ),
+            types.Part.from_text(text=_schema_prompt(filename))
+        ], schema, model)
+    except json.JSONDecodeError:
+        raise
+    except Exception:
+        # The upload may have expired or been deleted: don't hand it out again
+        forget_files_api_upload(content_hash, mime_type)
+        raise
 
 
 @app.route('/auto-enrich', methods=['POST'])
@@ -1925,7 +6113,8 @@ def auto_enrich():
         file.save(temp_path)
 
         try:
-            enriched = _analyze_file_with_schema(temp_path, file.filename, mime_type, schema, model)
+            enriched = _analyze_file_with_schema(temp_path, file.filename, mime_type, schema, model,
+                                                 content_hash=uploaded_file_hash(file, temp_path))
         finally:
             if os.path.exists(temp_path):
                 os.remove(temp_path)
@@ -1943,65 +6132,546 @@ def auto_enrich():
         return jsonify({'error': f'Error enriching document: {str(e)}'}), 500
 
 
+# ============================================
+# BULK ENRICHMENT - Enriquecimiento masivo de stores
+# Schema extraction over a whole store, rate limited and checkpointed
+# ============================================
+
+class EnrichmentInProgressError(Exception):
+    """Raised when a store is already being enriched"""
+
+
+_enrichments_running = set()  # store names
+_enrichments_lock = threading.Lock()
+
+# Broad query used to pull a stored document's chunks back for analysis
+ENRICH_CHUNK_QUERY = 'main topic, people, products, dates, prices, status and outcome of this document'
+
+
+def schema_hash(schema):
+    """Short stable hash of an enrichment schema"""
+    return cache_key('enrich-schema', schema)[:16]
+
+
+def document_chunks_text(document_name, max_chars=EXTRACT_MAX_CHARS):
+    """Text of a stored document rebuilt from its chunks, up to max_chars.
+
+    File Search documents cannot be downloaded, so the chunks returned by
+    documents.query for a broad query stand in for the content (short
+    documents come back whole, in relevance order).
+    """
+    response = client.file_search_stores.documents.query(
+        name=document_name,
+        query=ENRICH_CHUNK_QUERY,
+        config={'results_count': 100}
+    )
+    chunks = (format_query_chunk(chunk) for chunk in getattr(response, 'relevant_chunks', None) or ())
+    return collect_text((chunk['text'] for chunk in chunks if chunk.get('text')), max_chars)
+
+
+def _enrichment_targets(store_name, source):
+    """Documents to enrich: (document_id, label, file path or None)
+
+    With a source directory, only files of its sync manifest that have a
+    document in the store are analyzed, straight from disk. Otherwise every
+    document of the store is analyzed from its chunks.
+    """
+    if source:
+        return [
+            (entry['document_id'], path, os.path.join(source, path))
+            for path, entry in sorted(load_sync_manifest(store_name, source).items())
+            if entry['document_id']
+        ]
+    return [
+        (document['name'], document['display_name'], None)
+        for document in get_store_documents(store_name, refresh=True)
+    ]
+
+
+def _enrich_target(target, schema, model, content_hashes):
+    document_id, label, file_path = target
+    if file_path is not None:
+        return _analyze_file_with_schema(
+            file_path, os.path.basename(label), get_mime_type(label), schema, model,
+            content_hash=content_hashes.get(document_id)
+        )
+    text = document_chunks_text(document_id, prompt_text_chars(model))
+    if not text:
+        raise ValueError('No text could be retrieved for this document')
+    return _analyze_text_with_schema(text, label, schema, model)
+
+
+def enrich_store(store_name, schema, model='gemini-3-flash-preview', parallelism=ENRICH_MAX_PARALLELISM,
+                 source=None, document_names=None, force=False, offline=False, progress_job_id=None):
+    """Extract schema metadata for every document of a store - Enriquecer un store completo
+
+    Documents are analyzed concurrently; Gemini calls go through the shared
+    rate limiter (GEMINI_RPM) with retries. Results are merged into the
+    documents' local metadata in bulk every ENRICH_CHECKPOINT_EVERY documents,
+    together with an enrichments record (store, document, schema hash). An
+    interrupted run therefore keeps its finished checkpoints, and re-running
+    with the same schema skips documents already enriched with it.
+
+    With offline=True the requests are packed into Gemini Batch API jobs
+    instead (see _enrich_in_batches): cheaper, on a separate quota, and
+    finished within hours rather than seconds.
+
+    Args:
+        store_name (str): File Search store resource name
+        schema (dict): Response schema (see DEFAULT_ENRICH_SCHEMA)
+        model (str): Gemini model
+        parallelism (int): Concurrent analyses (or request preparations, offline)
+        source (str, optional): Synced directory to read files from instead of chunks
+        document_names (list, optional): Only enrich these documents
+        force (bool): Re-enrich documents already enriched with this schema
+        offline (bool): Use the Gemini Batch API
+        progress_job_id (str, optional): Job to report progress on
+
+    Returns:
+        dict: Summary with counts and per-document failures (a Future of it when offline)
+
+    Raises:
+        EnrichmentInProgressError: If the store is already being enriched
+    """
+    with _enrichments_lock:
+        if store_name in _enrichments_running:
+            raise EnrichmentInProgressError(f'An enrichment of {store_name} is already running')
+        _enrichments_running.add(store_name)
+
+    def release(_=None):
+        with _enrichments_lock:
+            _enrichments_running.discard(store_name)
+
+    try:
+        summary = _run_enrichment(store_name, schema, model, parallelism, source, document_names,
+                                  force, offline, progress_job_id)
+    except BaseException:
+        release()
+        raise
+    if isinstance(summary, Future):
+        summary.add_done_callback(release)
+    else:
+        release()
+    return summary
+
+
+def _run_enrichment(store_name, schema, model, parallelism, source, document_names, force, offline,
+                    progress_job_id):
+    started = time.monotonic()
+    digest = schema_hash(schema)
+    targets = _enrichment_targets(store_name, source)
+    if document_names:
+        wanted = set(document_names)
+        targets = [target for target in targets if target[0] in wanted]
+    done = set() if force else load_enriched_documents(store_name, digest)
+    todo = [target for target in targets if target[0] not in done]
+    content_hashes = {
+        entry['document_id']: entry['sha256'] for entry in load_sync_manifest(store_name, source).values()
+    } if source else {}
+
+    counts = {'total': len(targets), 'skipped': len(targets) - len(todo), 'enriched': 0, 'failed': 0}
+    failures = []
+    checkpoint = {}  # document_id -> metadata not written back yet
+    lock = threading.Lock()  # results arrive from pool threads, or batch collectors when offline
+
+    def report():
+        if progress_job_id:
+            update_job(progress_job_id, **counts)
+
+    def flush():
+        with lock:
+            if not checkpoint:
+                return
+            record_enrichments(store_name, digest, model, checkpoint)
+            # Tracked files only cover the active store; other stores get the
+            # saved results merged in when they are switched to
+            state.merge_metadata(checkpoint, store_name)
+            logger.info(f"Enrichment of {store_name}: checkpoint of {len(checkpoint)} document(s) saved")
+            checkpoint.clear()
+        notify_store_changed(store_name)
+
+    def record(target, metadata=None, error=None):
+        document_id, label, _ = target
+        with lock:
+            if error is None:
+                checkpoint[document_id] = metadata
+                counts['enriched'] += 1
+            else:
+                logger.error(f"Enrichment failed for {label}: {error}")
+                failures.append({'document_id': document_id, 'name': label, 'error': error})
+                counts['failed'] += 1
+            full = len(checkpoint) >= ENRICH_CHECKPOINT_EVERY
+            report()
+        if full:
+            flush()
+
+    def summarize(_=None):
+        flush()
+        logger.info(
+            f"Enrichment of {store_name} finished: {counts['enriched']} enriched, "
+            f"{counts['skipped']} skipped, {counts['failed']} failed"
+        )
+        return dict(
+            counts,
+            message=f"{counts['enriched']} of {len(todo)} document(s) enriched",
+            store_name=store_name,
+            schema_hash=digest,
+            model=model,
+            offline=offline,
+            elapsed_seconds=round(time.monotonic() - started, 2),
+            failures=failures
+        )
+
+    report()
+    logger.info(
+        f"Enriching {len(todo)}/{len(targets)} document(s) of {store_name} "
+        f"(schema {digest}{', batch mode' if offline else ''})"
+    )
+    if offline:
+        return chain_future(
+            _enrich_in_batches(todo, schema, model, parallelism, content_hashes, record, flush), summarize
+        )
+
+    if todo:
+        with ThreadPoolExecutor(max_workers=min(parallelism, len(todo)), thread_name_prefix='enrich') as executor:
+            futures = {executor.submit(_enrich_target, target, schema, model, content_hashes): target
+                       for target in todo}
+            try:
+                for future in as_completed(futures):
+                    try:
+                        record(futures[future], future.result())
+                    except Exception as e:
+                        record(futures[future], error=str(e))
+            finally:
+                # Keep what was finished even if the run is interrupted
+                flush()
+    return summarize()
+
+
+# ---- Offline mode: Gemini Batch API ----
+
+BATCH_DONE_STATES = {
+    'JOB_STATE_SUCCEEDED', 'JOB_STATE_PARTIALLY_SUCCEEDED',
+    'JOB_STATE_FAILED', 'JOB_STATE_CANCELLED', 'JOB_STATE_EXPIRED'
+}
+BATCH_SUCCESS_STATES = {'JOB_STATE_SUCCEEDED', 'JOB_STATE_PARTIALLY_SUCCEEDED'}
+BATCH_INLINE_MAX_CHARS = 15 * 1024 * 1024  # Inline requests per batch stay under the 20 MB request limit
+
+
+def batch_job_state(batch_job):
+    """State name of a Batch API job, e.g. JOB_STATE_SUCCEEDED"""
+    job_state = getattr(batch_job, 'state', None)
+    return getattr(job_state, 'name', None) or str(job_state)
+
+
+def _refresh_batch_job(batch_job):
+    return client.batches.get(name=batch_job.name)
+
+
+def _batch_job_done(batch_job):
+    return batch_job_state(batch_job) in BATCH_DONE_STATES
+
+
+def _schema_batch_request(target, schema, model, content_hashes, uploads):
+    """Inlined Batch API request for one enrichment target.
+
+    Files that Gemini reads natively are uploaded to the Files API directly
+    (not through file_handle_cache, whose TTL is shorter than a batch run)
+    and appended to uploads so they are deleted once the batches finish.
+
+    Returns:
+        tuple: (InlinedRequest, approximate size in characters)
+    """
+    document_id, label, file_path = target
+    filename = os.path.basename(label)
+    if file_path is None:
+        text = document_chunks_text(document_id, prompt_text_chars(model))
+    else:
+        mime_type = get_mime_type(label)
+        if mime_type not in TEXT_EXTRACTION_MIME_TYPES:
+            uploaded_file = client.files.upload(
+                file=file_path,
+                config={'mime_type': mime_type, 'display_name': filename}
+            )
+            uploads.append(uploaded_file)
+            parts = [
+                types.Part.from_uri(file_uri=uploaded_file.uri, mime_type=uploaded_file.mime_type),
+                types.Part.from_text(text=_schema_prompt(filename))
+            ]
+            request = types.InlinedRequest(
+                contents=[types.Content(role='user', parts=parts)], config=_schema_config(schema)
+            )
+            return request, 1024
+        text = fit_document_text(file_path, mime_type, model, content_hashes.get(document_id))
+    if not text:
+        raise ValueError('No text could be retrieved for this document')
+    parts = _schema_text_parts(text, filename)
+    request = types.InlinedRequest(contents=[types.Content(role='user', parts=parts)], config=_schema_config(schema))
+    return request, len(parts[0].text)
+
+
+def _pack_batches(prepared):
+    """Split (target, request, size) entries into batches by count and inline size"""
+    batch, batch_chars = [], 0
+    for entry in prepared:
+        if batch and (len(batch) >= GEMINI_BATCH_MAX_REQUESTS or batch_chars + entry[2] > BATCH_INLINE_MAX_CHARS):
+            yield batch
+            batch, batch_chars = [], 0
+        batch.append(entry)
+        batch_chars += entry[2]
+    if batch:
+        yield batch
+
+
+def _collect_batch(batch_job, entries, record):
+    """Fan the responses of a finished batch job back to its documents"""
+    job_state = batch_job_state(batch_job)
+    responses = getattr(getattr(batch_job, 'dest', None), 'inlined_responses', None) or []
+    if job_state not in BATCH_SUCCESS_STATES:
+        raise RuntimeError(f'Batch job {batch_job.name} ended in {job_state}')
+    logger.info(f"Batch job {batch_job.name} {job_state}: {len(responses)}/{len(entries)} response(s)")
+    for index, (target, _, _) in enumerate(entries):
+        inlined = responses[index] if index < len(responses) else None
+        if inlined is None:
+            record(target, error='Missing from batch results')
+        elif inlined.error is not None:
+            record(target, error=f'Batch request failed: {getattr(inlined.error, "message", inlined.error)}')
+        else:
+            try:
+                record(target, json.loads(inlined.response.text))
+            except Exception as e:
+                record(target, error=f'Invalid batch response: {str(e)}')
+
+
+def _submit_schema_batch(entries, model, index, record, flush):
+    """Create one Batch API job and track it with the shared operation poller
+
+    Returns:
+        Future: Resolves once the job's results have been recorded
+    """
+    collected = Future()
+    try:
+        batch_job = client.batches.create(
+            model=model,
+            src=[request for _, request, _ in entries],
+            config={'display_name': f'enrich-{index}-{len(entries)}'}
+        )
+    except Exception as e:
+        for target, _, _ in entries:
+            record(target, error=f'Could not create batch job: {str(e)}')
+        collected.set_result(None)
+        return collected
+    logger.info(f"Created batch job {batch_job.name} with {len(entries)} request(s)")
+
+    def collect(done):
+        try:
+            _collect_batch(done.result(), entries, record)
+        except Exception as e:
+            error = (f'Batch job {batch_job.name} did not finish within {GEMINI_BATCH_TIMEOUT}s'
+                     if isinstance(e, TimeoutError) else str(e))
+            for target, _, _ in entries:
+                record(target, error=error)
+        finally:
+            # One checkpoint per collected batch
+            flush()
+            collected.set_result(None)
+
+    operation_tracker.track(
+        batch_job, timeout=GEMINI_BATCH_TIMEOUT, refresh=_refresh_batch_job, is_done=_batch_job_done,
+        max_interval=GEMINI_BATCH_POLL_INTERVAL
+    ).add_done_callback(lambda done: upload_executor.submit(collect, done))
+    return collected
+
+
+def _enrich_in_batches(todo, schema, model, parallelism, content_hashes, record, flush):
+    """Enrich documents through Gemini Batch API jobs - Modo offline
+
+    Request contents (chunk text, extracted text or Files API uploads) are
+    prepared concurrently, packed into jobs of at most
+    GEMINI_BATCH_MAX_REQUESTS inlined requests sharing one system
+    instruction and schema, and tracked by the shared operation poller with
+    long intervals. Batch calls do not use the interactive rate limiter, so
+    large backfills leave the GEMINI_RPM budget to chat.
+
+    Returns:
+        Future: Resolves once every batch job has been collected
+    """
+    uploads = []
+    prepared = []
+    if todo:
+        with ThreadPoolExecutor(max_workers=min(parallelism, len(todo)), thread_name_prefix='enrich') as executor:
+            futures = {executor.submit(_schema_batch_request, target, schema, model, content_hashes, uploads): target
+                       for target in todo}
+            for future in as_completed(futures):
+                try:
+                    prepared.append((futures[future],) + future.result())
+                except Exception as e:
+                    record(futures[future], error=str(e))
+
+    batches = [
+        _submit_schema_batch(entries, model, index, record, flush)
+        for index, entries in enumerate(_pack_batches(prepared), 1)
+    ]
+
+    def cleanup(_):
+        for uploaded_file in uploads:
+            _delete_api_file(uploaded_file)
+
+    return chain_future(gather_futures(batches), cleanup, executor=upload_executor)
+
+
+@app.route('/enrich-store', methods=['POST'])
+def enrich_store_route():
+    """Enrich every document of a store with schema metadata - Enriquecimiento masivo
+
+    JSON body (all optional):
+        store_name (str): Store to enrich; defaults to the current store
+        path (str): Synced directory under SYNC_ROOT to analyze files from
+            (only files synced into the store are enriched)
+        documents (list): Only enrich these document names
+        schema (dict): Response schema (default: DEFAULT_ENRICH_SCHEMA)
+        model (str): Gemini model (default gemini-3-flash-preview)
+        parallelism (int): Concurrent analyses, capped at ENRICH_MAX_PARALLELISM
+        force (bool): Re-enrich documents already enriched with this schema
+        offline (bool): Run through the Gemini Batch API (cheaper, separate
+            quota, results within hours)
+
+    Returns 202 with a job_id; poll GET /jobs/<job_id> for progress and the summary.
+    """
+    data = request.json or {}
+
+    source = None
+    if data.get('path') is not None:
+        try:
+            source = resolve_sync_path(data['path'])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 403 if not SYNC_ROOT else 400
+        if not os.path.isdir(source):
+            return jsonify({'error': f"Directory not found: {data['path']}"}), 400
+
+    schema = data.get('schema') or DEFAULT_ENRICH_SCHEMA
+    if not isinstance(schema, dict):
+        return jsonify({'error': 'schema must be a JSON object'}), 400
+
+    document_names = data.get('documents')
+    if document_names is not None and not isinstance(document_names, list):
+        return jsonify({'error': 'documents must be a list of document names'}), 400
+
+    try:
+        parallelism = int(data.get('parallelism', ENRICH_MAX_PARALLELISM))
+    except (ValueError, TypeError):
+        parallelism = ENRICH_MAX_PARALLELISM
+    parallelism = max(1, min(ENRICH_MAX_PARALLELISM, parallelism))
+
+    target_store_name = data.get('store_name') or state.store_name
+    if not target_store_name:
+        return jsonify({'error': 'No store selected'}), 400
+
+    try:
+        with _enrichments_lock:
+            if target_store_name in _enrichments_running:
+                return jsonify({'error': 'An enrichment of this store is already running'}), 409
+
+        model = data.get('model', 'gemini-3-flash-preview')
+        offline = _is_true(data.get('offline', False))
+        job = create_job('enrichment', store_name=target_store_name, schema_hash=schema_hash(schema),
+                         offline=offline)
+        submit_job(
+            upload_executor, job['id'], enrich_store, target_store_name, schema, model=model,
+            parallelism=parallelism, source=source, document_names=document_names,
+            force=_is_true(data.get('force', False)), offline=offline, progress_job_id=job['id']
+        )
+        logger.info(f"Queued enrichment job {job['id']} for {target_store_name}")
+
+        return jsonify({
+            'success': True,
+            'message': 'Enrichment queued',
+            'job_id': job['id'],
+            'status': job['status'],
+            'status_url': f"/jobs/{job['id']}",
+            'store_name': target_store_name,
+            'schema_hash': schema_hash(schema)
+        }), 202
+
+    except JobQueueFullError as e:
+        logger.warning(f"Enrichment rejected: {str(e)}")
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        logger.error(f"Error queuing enrichment: {str(e)}")
+        return jsonify({'error': f'Error enriching store: {str(e)}'}), 500
+
+
 # ============================================
 # UTILITY ENDPOINTS - Endpoints de utilidad
 # ============================================
 
 @app.route('/clear', methods=['POST'])
 def clear_conversation():
-    global conversation_history
-    conversation_history = []
-    logger.info("Conversation history cleared")
+    session_id = get_session_id()
+    chat_sessions.clear(session_id)
+    logger.info(f"Conversation history cleared for session {session_id}")
     return jsonify({'success': True, 'message': 'Conversation cleared'})
 
 @app.route('/files', methods=['GET'])
 def get_files():
     return jsonify({
         'success': True,
-        'files': uploaded_files,
-        'store_name': file_search_store.name if file_search_store else None
+        'files': state.files(),
+        'store_name': state.store_name
     })
 
 @app.route('/current-store-documents', methods=['GET'])
 def get_current_store_documents():
-    """Get all documents from the current store with metadata"""
+    """Get documents from the current store (or store_name) with metadata
+
+    Query params:
+        store_name (str): Store to list instead of the current one
+        page, page_size, sort, order, refresh: See /stores
+        page_token (str): Fetch one API page at a time instead (lazy loading);
+            the response carries next_page_token. Not combinable with sort.
+    """
     try:
-        if not file_search_store:
+        store_name = request.args.get('store_name')
+        current_store = state.store
+        if not store_name and not current_store:
             return jsonify({
                 'success': True,
                 'documents': [],
                 'store_name': None,
                 'message': 'No store selected'
             })
+        store_name = store_name or current_store.name
+
+        response = {
+            'success': True,
+            'store_name': store_name,
+            'store_display_name': getattr(current_store, 'display_name', 'N/A')
+            if current_store and current_store.name == store_name else None
+        }
 
-        documents = []
         try:
-            for doc in client.file_search_stores.documents.list(parent=file_search_store.name):
-                custom_metadata = extract_document_metadata(doc, uploaded_files)
-
-                documents.append({
-                    'name': doc.name,
-                    'display_name': getattr(doc, 'display_name', 'N/A'),
-                    'displayName': getattr(doc, 'display_name', 'N/A'),
-                    'state': getattr(doc, 'state', 'UNKNOWN'),
-                    'size_bytes': getattr(doc, 'size_bytes', 0),
-                    'sizeBytes': getattr(doc, 'size_bytes', 0),
-                    'mime_type': getattr(doc, 'mime_type', 'N/A'),
-                    'mimeType': getattr(doc, 'mime_type', 'N/A'),
-                    'create_time': str(getattr(doc, 'create_time', 'N/A')),
-                    'createTime': str(getattr(doc, 'create_time', 'N/A')),
-                    'custom_metadata': custom_metadata,
-                    'customMetadata': custom_metadata
-                })
+            if 'page_token' in request.args:
+                try:
+                    page_size = int(request.args.get('page_size', 20))
+                except (TypeError, ValueError):
+                    page_size = 20
+                documents, next_page_token = get_store_documents_page(
+                    store_name, request.args.get('page_token'), max(1, min(page_size, CATALOG_MAX_PAGE_SIZE))
+                )
+                response['documents'] = _with_local_metadata(documents)
+                response['next_page_token'] = next_page_token
+            else:
+                documents, pagination = sort_and_paginate(
+                    get_store_documents(store_name, _is_true(request.args.get('refresh'))),
+                    request.args, DOCUMENT_SORT_FIELDS
+                )
+                response['documents'] = _with_local_metadata(documents)
+                response['pagination'] = pagination
         except Exception as doc_error:
-            logger.warning(f"Error listing documents for current store: {str(doc_error)}")
+            logger.warning(f"Error listing documents for store {store_name}: {str(doc_error)}")
+            response['documents'] = []
 
-        return jsonify({
-            'success': True,
-            'documents': documents,
-            'store_name': file_search_store.name,
-            'store_display_name': getattr(file_search_store, 'display_name', 'N/A')
-        })
+        return jsonify(response)
 
     except Exception as e:
         logger.error(f"Error getting current store documents: {str(e)}")
@@ -2010,33 +6680,234 @@ def get_current_store_documents():
 @app.route('/status', methods=['GET'])
 def status():
     return jsonify({
-        'file_uploaded': file_search_store is not None,
-        'conversation_length': len(conversation_history),
-        'store_name': file_search_store.name if file_search_store else None,
-        'uploaded_files': uploaded_files
+        'file_uploaded': state.store is not None,
+        'conversation_length': chat_sessions.length(get_session_id()),
+        'store_name': state.store_name,
+        'uploaded_files': state.files()
+    })
+
+@app.route('/cache-stats', methods=['GET'])
+def cache_stats():
+    """Hit/miss counters of the in-process caches"""
+    return jsonify({
+        'success': True,
+        'response_cache': response_cache.stats(),
+        'catalog_cache': catalog_cache.stats(),
+        'retrieval_cache': retrieval_cache.stats(),
+        'extraction_cache': extraction_cache.stats(),
+        'file_handle_cache': file_handle_cache.stats()
     })
 
 # ============================================
 # INVESTIGATIONS / REPORTS - Investigaciones multi-pregunta con RAG
 # ============================================
 
+def _answer_investigation_question(question, model, target_store):
+    """Answer one investigation question with File Search.
+
+    Errors are returned as the section answer so one failing question does
+    not abort the whole investigation.
+
+    Returns:
+        dict: Section with question, answer and citations
+    """
+    try:
+        response = generate_content_with_retry(
+            model=model,
+            contents=question,
+            config=types.GenerateContentConfig(
+                tools=[types.Tool(
+                    file_search=types.FileSearch(
+                        file_search_store_names=[target_store]
+                    )
+                )]
+            )
+        )
+
+        # Extract citations from grounding metadata
+        citations = []
+        if response.candidates and response.candidates[0].grounding_metadata:
+            grounding = response.candidates[0].grounding_metadata
+            if hasattr(grounding, 'grounding_chunks') and grounding.grounding_chunks:
+                for chunk in grounding.grounding_chunks:
+                    if hasattr(chunk, 'retrieved_context'):
+                        ctx = chunk.retrieved_context
+                        citations.append({
+                            'title': getattr(ctx, 'title', ''),
+                            'text': getattr(ctx, 'text', '')[:200]
+                        })
+
+        return {
+            'question': question,
+            'answer': response.text,
+            'citations': citations,
+            'status': 'completed'
+        }
+
+    except Exception as q_error:
+        logger.error(f"Error processing question '{question[:80]}': {str(q_error)}")
+        return {
+            'question': question,
+            'answer': f'Error al procesar esta pregunta: {str(q_error)}',
+            'citations': [],
+            'status': 'failed',
+            'error': str(q_error)
+        }
+
+
+def _section_done(section):
+    """True if a section already has a good answer (older records have no status)"""
+    status = section.get('status')
+    if status is None:
+        return not section.get('answer', '').startswith('Error al procesar esta pregunta')
+    return status == 'completed'
+
+
+def investigation_status(investigation):
+    """Effective status of an investigation.
+
+    A record left 'queued' or 'running' without a live job (server restart,
+    crashed worker) is reported as 'interrupted' so it can be resumed.
+    """
+    status = investigation.get('status', 'completed')
+    if status in ('queued', 'running'):
+        job = get_job(investigation.get('job_id'))
+        if job is None or job['status'] in ('completed', 'failed'):
+            return 'interrupted'
+    return status
+
+
+def investigation_progress(investigation):
+    """Completed / failed / pending section counts of an investigation"""
+    sections = investigation.get('sections', [])
+    completed = sum(1 for section in sections if _section_done(section))
+    failed = sum(1 for section in sections if section.get('status') == 'failed')
+    return {
+        'total': len(sections),
+        'completed': completed,
+        'failed': failed,
+        'pending': len(sections) - completed - failed
+    }
+
+
+def _run_investigation(job_id, investigation_id, parallelism):
+    """Answer every unfinished question of an investigation, then summarize.
+
+    Runs as a background job. Each section is persisted as soon as it is
+    answered, so an interrupted run keeps its finished sections and a resume
+    only re-runs the pending and failed ones.
+
+    Returns:
+        dict: Final status and progress counts
+    """
+    investigation = load_investigation(investigation_id)
+    if investigation is None:
+        raise ValueError(f'Investigation not found: {investigation_id}')
+
+    model = investigation['metadata']['model_used']
+    target_store = investigation['store_name']
+    sections = investigation['sections']
+    todo = [i for i, section in enumerate(sections) if not _section_done(section)]
+
+    investigation['status'] = 'running'
+    save_investigation(investigation)
+    update_job(job_id, progress=investigation_progress(investigation))
+    logger.info(
+        f"Running investigation '{investigation['title']}': {len(todo)}/{len(sections)} "
+        f"question(s) to answer on store {target_store}"
+    )
+
+    # Questions are independent: answer them concurrently, keep section order
+    if todo:
+        with ThreadPoolExecutor(max_workers=min(parallelism, len(todo))) as executor:
+            futures = {
+                executor.submit(_answer_investigation_question, sections[i]['question'], model, target_store): i
+                for i in todo
+            }
+            for future in as_completed(futures):
+                i = futures[future]
+                # Stop if the investigation was deleted meanwhile instead of re-creating it
+                if load_investigation(investigation_id) is None:
+                    for pending in futures:
+                        pending.cancel()
+                    logger.info(f"Investigation {investigation_id} deleted while running; stopping")
+                    return {'investigation_id': investigation_id, 'status': 'deleted'}
+                sections[i] = future.result()
+                save_investigation(investigation)
+                update_job(job_id, progress=investigation_progress(investigation))
+                logger.info(f"Answered question {i+1}/{len(sections)}")
+
+    # Generate executive summary from all answers
+    logger.info("Generating executive summary...")
+    all_answers = "\n\n".join([
+        f"Pregunta: {s['question']}\nRespuesta: {s['answer']}"
+        for s in sections
+    ])
+    try:
+        summary_response = generate_content_with_retry(
+            model=model,
+            contents=(
+                f"Eres un analista experto. Genera un resumen ejecutivo conciso de 3-5 lineas "
+                f"de esta investigacion titulada '{investigation['title']}':\n\n{all_answers}"
+            )
+        )
+        investigation['summary'] = summary_response.text
+    except Exception as summary_error:
+        logger.error(f"Error generating summary: {str(summary_error)}")
+        investigation['summary'] = "No se pudo generar el resumen ejecutivo."
+
+    progress = investigation_progress(investigation)
+    investigation['status'] = 'completed' if progress['completed'] == progress['total'] else 'partial'
+    investigation['metadata']['total_citations'] = sum(len(s['citations']) for s in sections)
+    save_investigation(investigation)
+
+    logger.info(f"Investigation '{investigation['title']}' {investigation['status']}. ID: {investigation_id}")
+    return {'investigation_id': investigation_id, 'status': investigation['status'], 'progress': progress}
+
+
+def _submit_investigation(investigation, parallelism):
+    """Queue an investigation run as a background job and persist its job ID
+
+    Raises:
+        JobQueueFullError: If too many jobs are pending
+    """
+    job = create_job('investigation', investigation_id=investigation['id'], title=investigation['title'])
+    investigation['status'] = 'queued'
+    investigation['job_id'] = job['id']
+    save_investigation(investigation)
+    submit_job(investigation_executor, job['id'], _run_investigation, job['id'], investigation['id'], parallelism)
+    return job
+
+
+def _parse_parallelism(value):
+    """Investigation parallelism from a request value, capped at INVESTIGATION_MAX_PARALLELISM"""
+    try:
+        parallelism = int(value if value is not None else INVESTIGATION_MAX_PARALLELISM)
+    except (TypeError, ValueError):
+        parallelism = INVESTIGATION_MAX_PARALLELISM
+    return max(1, min(INVESTIGATION_MAX_PARALLELISM, parallelism))
+
+
 @app.route('/investigate', methods=['POST'])
 def investigate():
-    """Execute a multi-question investigation using RAG with File Search.
+    """Start a multi-question investigation using RAG with File Search.
 
     Each question is answered independently using semantic search on the store,
-    then a final executive summary is generated from all answers.
+    then a final executive summary is generated from all answers. The work runs
+    as a background job; poll /investigations/<id>/progress and fetch
+    /investigations/<id> once it is done.
 
     Request body:
         title (str): Title of the investigation
         questions (list[str]): List of questions to investigate
         store_name (str, optional): Store to use; defaults to current active store
         model (str, optional): Model to use; defaults to gemini-3.1-pro-preview
+        parallelism (int, optional): Questions answered concurrently, capped at
+            INVESTIGATION_MAX_PARALLELISM
 
     Returns:
-        JSON with the full investigation object including sections and summary
+        202 JSON with investigation_id, job_id and the progress URL
     """
-    import uuid
     import datetime
 
     try:
@@ -2051,6 +6922,7 @@ def investigate():
         model = data.get('model', 'gemini-3.1-pro-preview')
         if model not in ALLOWED_MODELS:
             model = 'gemini-3.1-pro-preview'
+        parallelism = _parse_parallelism(data.get('parallelism'))
 
         if not title:
             return jsonify({'error': 'Title is required'}), 400
@@ -2058,113 +6930,115 @@ def investigate():
             return jsonify({'error': 'At least one question is required'}), 400
 
         # Determine target store
-        target_store = store_name or (file_search_store.name if file_search_store else None)
+        target_store = store_name or state.store_name
         if not target_store:
             return jsonify({'error': 'No active store. Create one and upload documents first.'}), 400
 
-        logger.info(f"Starting investigation '{title}' with {len(questions)} questions on store {target_store}")
-
-        sections = []
-        for i, question in enumerate(questions):
-            logger.info(f"Processing question {i+1}/{len(questions)}: {question[:80]}...")
-            try:
-                response = client.models.generate_content(
-                    model=model,
-                    contents=question,
-                    config=types.GenerateContentConfig(
-                        tools=[types.Tool(
-                            file_search=types.FileSearch(
-                                file_search_store_names=[target_store]
-                            )
-                        )]
-                    )
-                )
-
-                # Extract citations from grounding metadata
-                citations = []
-                if response.candidates and response.candidates[0].grounding_metadata:
-                    grounding = response.candidates[0].grounding_metadata
-                    if hasattr(grounding, 'grounding_chunks') and grounding.grounding_chunks:
-                        for chunk in grounding.grounding_chunks:
-                            if hasattr(chunk, 'retrieved_context'):
-                                ctx = chunk.retrieved_context
-                                citations.append({
-                                    'title': getattr(ctx, 'title', ''),
-                                    'text': getattr(ctx, 'text', '')[:200]
-                                })
-
-                sections.append({
-                    'question': question,
-                    'answer': response.text,
-                    'citations': citations
-                })
-
-            except Exception as q_error:
-                logger.error(f"Error processing question {i+1}: {str(q_error)}")
-                sections.append({
-                    'question': question,
-                    'answer': f'Error al procesar esta pregunta: {str(q_error)}',
-                    'citations': []
-                })
-
-        # Generate executive summary from all answers
-        logger.info("Generating executive summary...")
-        all_answers = "\n\n".join([
-            f"Pregunta: {s['question']}\nRespuesta: {s['answer']}"
-            for s in sections
-        ])
-        try:
-            summary_response = client.models.generate_content(
-                model=model,
-                contents=(
-                    f"Eres un analista experto. Genera un resumen ejecutivo conciso de 3-5 lineas "
-                    f"de esta investigacion titulada '{title}':\n\n{all_answers}"
-                )
-            )
-            summary = summary_response.text
-        except Exception as summary_error:
-            logger.error(f"Error generating summary: {str(summary_error)}")
-            summary = "No se pudo generar el resumen ejecutivo."
-
+        # Sections are created up front and filled in as answers arrive
         investigation = {
             'id': str(uuid.uuid4()),
             'title': title,
             'store_name': target_store,
-            'sections': sections,
-            'summary': summary,
+            'sections': [
+                {'question': question, 'answer': '', 'citations': [], 'status': 'pending'}
+                for question in questions
+            ],
+            'summary': '',
             'created_at': datetime.datetime.now().isoformat(),
             'metadata': {
                 'total_questions': len(questions),
-                'total_citations': sum(len(s['citations']) for s in sections),
+                'total_citations': 0,
                 'model_used': model
             }
         }
 
-        # Persist to state file
-        investigations = load_state_value('investigations', [])
-        investigations.append(investigation)
-        save_state_value('investigations', investigations)
-
-        logger.info(f"Investigation '{title}' completed. ID: {investigation['id']}")
-
-        return jsonify({'success': True, 'investigation': investigation})
+        job = _submit_investigation(investigation, parallelism)
+        logger.info(f"Queued investigation '{title}' with {len(questions)} questions on store {target_store}")
 
+        return jsonify({
+            'success': True,
+            'investigation_id': investigation['id'],
+            'job_id': job['id'],
+            'status': 'queued',
+            'progress_url': f"/investigations/{investigation['id']}/progress"
+        }), 202
+
+    except JobQueueFullError as e:
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         logger.error(f"Error in investigate: {str(e)}")
         return jsonify({'error': f'Error running investigation: {str(e)}'}), 500
 
 
+@app.route('/investigations/<investigation_id>/progress', methods=['GET'])
+def get_investigation_progress(investigation_id):
+    """Progress of an investigation: completed/total sections and status"""
+    try:
+        inv = load_investigation(investigation_id)
+        if not inv:
+            return jsonify({'error': f'Investigation not found: {investigation_id}'}), 404
+        return jsonify({
+            'success': True,
+            'investigation_id': investigation_id,
+            'status': investigation_status(inv),
+            'job_id': inv.get('job_id'),
+            'progress': investigation_progress(inv)
+        })
+    except Exception as e:
+        logger.error(f"Error getting investigation progress {investigation_id}: {str(e)}")
+        return jsonify({'error': f'Error getting investigation progress: {str(e)}'}), 500
+
+
+@app.route('/investigations/<investigation_id>/resume', methods=['POST'])
+def resume_investigation(investigation_id):
+    """Re-run the failed and unfinished questions of an investigation.
+
+    Sections that already have an answer are kept; the summary is
+    regenerated once the remaining questions are answered.
+
+    Request body (optional):
+        parallelism (int): Questions answered concurrently
+    """
+    try:
+        inv = load_investigation(investigation_id)
+        if not inv:
+            return jsonify({'error': f'Investigation not found: {investigation_id}'}), 404
+
+        status = investigation_status(inv)
+        if status in ('queued', 'running'):
+            return jsonify({'error': 'Investigation is already running', 'job_id': inv.get('job_id')}), 409
+        if status == 'completed':
+            return jsonify({'error': 'Investigation is already complete'}), 400
+
+        data = request.get_json(silent=True) or {}
+        job = _submit_investigation(inv, _parse_parallelism(data.get('parallelism')))
+        progress = investigation_progress(inv)
+        logger.info(f"Resuming investigation {investigation_id}: {progress['total'] - progress['completed']} question(s) left")
+
+        return jsonify({
+            'success': True,
+            'investigation_id': investigation_id,
+            'job_id': job['id'],
+            'status': 'queued',
+            'progress': progress,
+            'progress_url': f"/investigations/{investigation_id}/progress"
+        }), 202
+
+    except JobQueueFullError as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        logger.error(f"Error resuming investigation {investigation_id}: {str(e)}")
+        return jsonify({'error': f'Error resuming investigation: {str(e)}'}), 500
+
+
 @app.route('/investigations', methods=['GET'])
 def list_investigations():
     """List all saved investigations, sorted by creation date descending."""
     try:
-        investigations = load_state_value('investigations', [])
         # Return newest first
-        investigations_sorted = sorted(
-            investigations,
-            key=lambda x: x.get('created_at', ''),
-            reverse=True
-        )
+        investigations_sorted = load_investigations()
+        for inv in investigations_sorted:
+            inv['status'] = investigation_status(inv)
         return jsonify({
             'success': True,
             'investigations': investigations_sorted,
@@ -2179,10 +7053,10 @@ def list_investigations():
 def get_investigation(investigation_id):
     """Get a specific investigation by ID."""
     try:
-        investigations = load_state_value('investigations', [])
-        for inv in investigations:
-            if inv.get('id') == investigation_id:
-                return jsonify({'success': True, 'investigation': inv})
+        inv = load_investigation(investigation_id)
+        if inv:
+            inv['status'] = investigation_status(inv)
+            return jsonify({'success': True, 'investigation': inv})
         return jsonify({'error': f'Investigation not found: {investigation_id}'}), 404
     except Exception as e:
         logger.error(f"Error getting investigation {investigation_id}: {str(e)}")
@@ -2193,14 +7067,9 @@ def get_investigation(investigation_id):
 def delete_investigation(investigation_id):
     """Delete a specific investigation by ID."""
     try:
-        investigations = load_state_value('investigations', [])
-        original_count = len(investigations)
-        investigations = [inv for inv in investigations if inv.get('id') != investigation_id]
-
-        if len(investigations) == original_count:
+        if not delete_investigation_record(investigation_id):
             return jsonify({'error': f'Investigation not found: {investigation_id}'}), 404
 
-        save_state_value('investigations', investigations)
         logger.info(f"Deleted investigation: {investigation_id}")
 
         return jsonify({
@@ -2236,8 +7105,7 @@ def export_investigation_pdf(investigation_id):
     import re
 
     try:
-        investigations = load_state_value('investigations', [])
-        inv = next((i for i in investigations if i.get('id') == investigation_id), None)
+        inv = load_investigation(investigation_id)
         if not inv:
             return jsonify({'error': 'Investigation not found'}), 404
 